@@ -1,14 +1,44 @@
-from langchain_community.cache import InMemoryCache
-from langchain_gigachat.chat_models import GigaChat
+# langchain_community и langchain_gigachat импортируются при создании модели:
+# их загрузка занимает около секунды, а команды вроде 'schema' модель не используют
+import threading
 
-# Создание глобального кэша в памяти
-llm_cache = InMemoryCache()
+# Глобальный кэш в памяти (создается вместе с первой моделью)
+llm_cache = None
 
 def authorization_gigachat():
+    global llm_cache
+    from langchain_community.cache import InMemoryCache
+    from langchain_gigachat.chat_models import GigaChat
+
+    if llm_cache is None:
+        llm_cache = InMemoryCache()
+
     giga = GigaChat(
         credentials="Ключ к GigaChat",
         model="GigaChat-Max",
         verify_ssl_certs=False,
         cache=llm_cache   # Передаем объект кэша в конструктор класса
     )
-    return giga
\ No newline at end of file
+    return giga
+
+
+class LazyChatModel:
+    """Модель, которая создается фабрикой при первом вызове invoke()"""
+
+    def __init__(self, factory=authorization_gigachat):
+        self.factory = factory
+        self.model = None
+        self._lock = threading.Lock()  # дублирующие запросы могут прийти одновременно
+
+    def _get_model(self):
+        if self.model is None:
+            with self._lock:
+                if self.model is None:
+                    self.model = self.factory()
+        return self.model
+
+    def invoke(self, messages, **kwargs):
+        return self._get_model().invoke(messages, **kwargs)
+
+    def stream(self, messages, **kwargs):
+        return self._get_model().stream(messages, **kwargs)
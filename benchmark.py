@@ -0,0 +1,1843 @@
+"""
+Офлайн-бенчмарки конвейера генерации SQL (без обращения к GigaChat)
+
+Примеры запуска:
+    python benchmark.py pipeline
+    python benchmark.py pipeline --recorded test_results_20250525_180851.txt --latency-scale 0.1
+    python benchmark.py extractor --size 256
+    python benchmark.py fewshot --k 1 3 5 --per-prompt-token-latency 0.0005
+    python benchmark.py router --recorded test_results_20250525_180851.txt
+    python benchmark.py speculative --latency 0.2
+    python benchmark.py export --rows 2000000
+    python benchmark.py analyze --columns 20 200 --rows 20000
+    python benchmark.py incremental --scale 20 --batch-size 500
+    python benchmark.py ingest --scale 50 --append-rows 1000
+    python benchmark.py shard --workers 2 4 --latency 0.2
+    python benchmark.py startup --repeat 5
+    python benchmark.py pragmas --scale 50
+    python benchmark.py storage --scale 50
+    python benchmark.py report --results 1000 10000 50000
+    python benchmark.py coalesce --clients 1 4 16 --latency 0.2
+    python benchmark.py hedge --requests 200 --tail-rate 0.05 --tail-latency 1.0
+    python benchmark.py tokens --budget 1500 1200
+    python benchmark.py generation --prose-tokens 80 --per-token-latency 0.005
+    python benchmark.py compare --history test_history.db --baseline 1 2 --candidate 3
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from db import open_connection, update_statistics
+from metrics import pipeline_metrics
+from result_compare import compare_query_results
+from run_history import RunHistory, format_comparison, format_runs, get_commit_hash
+from sql_utils import SQLStreamExtractor, extract_sql_query
+from stub_llm import ReplayChatModel, estimate_tokens
+from suite_report import SuiteReport, percentiles
+from test_questions_and_queries import TEST_CASES, TEST_CATEGORIES
+
+
+RESULTS_DIR = 'benchmark_results'
+
+# Вопросы вне TEST_CASES, для которых у маршрутизатора нет верного шаблона:
+# он должен отдавать их GigaChat, а не отвечать неверным SQL
+ROUTER_FALLBACK_QUESTIONS = [
+    "Сколько платформ в базе?",
+    "Сколько категорий работ?",
+    "Сколько всего проектов выполнили эксперты?",
+    "Средняя ставка в час у новичков и экспертов",
+    "Средний заработок фрилансеров в Европе и в Азии",
+    "Какой регион приносит наименьший доход?"
+]
+
+# Ответы, на которых извлечение SQL ошибалось: (текст, ожидаемый запрос)
+EXTRACTOR_REGRESSION_CASES = [
+    ("Используйте запрос SELECT COUNT(*) FROM freelancer_earnings",
+     "SELECT COUNT(*) FROM freelancer_earnings"),
+    ("Для этого выполните SELECT AVG(x) FROM t;", "SELECT AVG(x) FROM t"),
+    ("Вот запрос: with x as (select 1) select * from x", "with x as (select 1) select * from x"),
+    ("```python\nprint(1)\n```\nSELECT 2", "SELECT 2"),
+    ("I will update you: SELECT 1", "SELECT 1"),
+    ("Выполните SELECT 1; Запрос: SELECT 2;", "SELECT 2"),
+    ("Отсортируйте with rating", None)
+]
+
+
+def save_report(report, output, name):
+    """Сохраняет отчет бенчмарка в JSON (по умолчанию benchmark_results/<name>_<commit>.json)"""
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{name}_{report['commit']}.json")
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\n💾 Отчет сохранен в файл: {output}")
+
+
+def build_stub_llm(args):
+    """Создает воспроизводящую модель по параметрам командной строки"""
+    options = {
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'per_token_latency': args.per_token_latency,
+        'seed': args.seed,
+        'per_prompt_token_latency': getattr(args, 'per_prompt_token_latency', 0.0)
+    }
+    if args.recorded:
+        return ReplayChatModel.from_results_file(args.recorded, latency_scale=args.latency_scale, **options)
+    return ReplayChatModel.from_test_cases(TEST_CASES, **options)
+
+
+def _suite_report(name, elapsed, count, statuses):
+    """Собирает отчет по одному набору запросов"""
+    report = {
+        'queries': count,
+        'elapsed': elapsed,
+        'throughput': count / elapsed if elapsed else 0.0,
+        'statuses': statuses,
+        'stages': pipeline_metrics.summary()
+    }
+
+    print(f"\n📊 {name}: {count} запросов за {elapsed:.2f}с ({report['throughput']:.2f} запр/с)")
+    if statuses:
+        print("  Статусы: " + ", ".join(f"{k}={v}" for k, v in sorted(statuses.items())))
+    print(pipeline_metrics.format_stats())
+
+    return report
+
+
+def run_tester_suite(llm, db_path, test_cases):
+    """Прогоняет SQLTester с заглушкой модели"""
+    from main_test import SQLTester
+
+    tester = SQLTester(db_path=db_path, llm=llm, pause_between_tests=0)
+
+    setup_start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ready = tester.setup()
+    setup_time = time.perf_counter() - setup_start
+
+    if not ready:
+        raise RuntimeError("Не удалось инициализировать SQLTester")
+
+    pipeline_metrics.reset()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = tester.run_all_tests(test_cases)
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for result in results:
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+
+    report = _suite_report('SQLTester', elapsed, len(results), statuses)
+    report['setup_time'] = setup_time
+    return tester, report
+
+
+def run_repl_suite(llm, tester, test_cases, speculator=None):
+    """Прогоняет вопросы через путь обработки интерактивного режима (main.py)"""
+    from langchain_core.messages import SystemMessage
+    from main import process_user_query
+
+    pipeline_metrics.reset()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with pipeline_metrics.stage('prompt_build'):
+            system_prompt = tester.prompt_builder.build_enhanced_system_prompt()
+        messages = [SystemMessage(content=system_prompt)]
+
+        for test_case in test_cases:
+            process_user_query(test_case['question'], messages, llm, tester.conn, tester.prompt_builder, speculator)
+    elapsed = time.perf_counter() - start
+
+    return _suite_report('REPL', elapsed, len(test_cases), {})
+
+
+def benchmark_pipeline(args):
+    """Сквозной бенчмарк SQLTester и REPL на воспроизводящей модели"""
+    pipeline_metrics.enabled = True
+    test_cases = TEST_CASES * args.repeat
+
+    print(f"🚀 Бенчмарк конвейера: {len(test_cases)} запросов, коммит {get_commit_hash()}")
+
+    llm = build_stub_llm(args)
+    tester, tester_report = run_tester_suite(llm, args.db, test_cases)
+    if args.history:
+        tester.save_results_to_history(args.history, label='benchmark pipeline')
+    try:
+        repl_report = run_repl_suite(llm, tester, test_cases)
+    finally:
+        tester.cleanup()
+
+    report = {
+        'benchmark': 'pipeline',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'recorded': args.recorded,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'per_token_latency': args.per_token_latency,
+            'latency_scale': args.latency_scale,
+            'repeat': args.repeat,
+            'seed': args.seed
+        },
+        'llm_calls': llm.calls,
+        'llm_misses': llm.misses,
+        'suites': {
+            'tester': tester_report,
+            'repl': repl_report
+        }
+    }
+    save_report(report, args.output, 'pipeline')
+    return report
+
+
+def _legacy_extract_sql_query(text):
+    """Прежняя реализация extract_sql_query (регулярные выражения) для сравнения"""
+    sql_match = re.search(r'```(?:sql)?\s*(.*?)\s*```', text, re.DOTALL | re.IGNORECASE)
+    if sql_match:
+        return sql_match.group(1).strip().rstrip(';')
+
+    for keyword in ['SELECT', 'INSERT', 'UPDATE', 'DELETE']:
+        pattern = f'({keyword}.*?)(?:;|$)'
+        match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
+        if match:
+            return match.group(1).strip().rstrip(';')
+
+    return None
+
+
+def build_long_responses(size_kb):
+    """Строит длинные "разговорчивые" ответы модели разной структуры"""
+    sentence = ("Этот запрос группирует фрилансеров по региону клиента и считает средний "
+                "заработок, а затем сортирует результат по убыванию. ")
+    prose = (sentence * (size_kb * 1024 // len(sentence) + 1))[:size_kb * 1024]
+    sql = TEST_CASES[21]['expected_sql']
+
+    return {
+        'fence_first': f"```sql\n{sql}\n```\n{prose}",
+        'fence_last': f"{prose}\n```sql\n{sql}\n```",
+        'bare_last': f"{prose}\n{sql};",
+        'no_sql': prose
+    }
+
+
+def _time_call(func, repeat):
+    """Возвращает среднее время вызова функции, с"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark_extractor(args):
+    """Сравнивает прежнее и потоковое извлечение SQL на длинных ответах"""
+    responses = build_long_responses(args.size)
+    report = {
+        'benchmark': 'extractor',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'size_kb': args.size, 'chunk_size': args.chunk_size, 'repeat': args.repeat},
+        'cases': {}
+    }
+
+    print(f"🚀 Бенчмарк извлечения SQL: ответы по {args.size} КБ, порции по {args.chunk_size} символов")
+    header = f"{'Случай':<12} {'regex, мс':>10} {'целиком, мс':>12} {'поток, мс':>10} {'SQL после, симв':>16}"
+    print(header)
+    print("-" * len(header))
+
+    for name, text in responses.items():
+        def stream():
+            extractor = SQLStreamExtractor()
+            for i in range(0, len(text), args.chunk_size):
+                if extractor.feed(text[i:i + args.chunk_size]):
+                    break
+            return extractor.finish(), extractor.chars_seen
+
+        legacy_result = _legacy_extract_sql_query(text)
+        streamed_result, chars_needed = stream()
+        if streamed_result != extract_sql_query(text):
+            raise RuntimeError(f"Потоковый и полный разбор расходятся для случая {name}")
+
+        case = {
+            'length': len(text),
+            'legacy_time': _time_call(lambda: _legacy_extract_sql_query(text), args.repeat),
+            'full_time': _time_call(lambda: extract_sql_query(text), args.repeat),
+            'stream_time': _time_call(stream, args.repeat),
+            'chars_until_sql': chars_needed if streamed_result else None,
+            'same_as_legacy': streamed_result == legacy_result
+        }
+        report['cases'][name] = case
+
+        print(f"{name:<12} {case['legacy_time'] * 1000:>10.3f} {case['full_time'] * 1000:>12.3f} "
+              f"{case['stream_time'] * 1000:>10.3f} {str(case['chars_until_sql']):>16}")
+
+    failures = []
+    for text, expected in EXTRACTOR_REGRESSION_CASES:
+        extractor = SQLStreamExtractor()
+        for i in range(0, len(text), args.chunk_size):
+            if extractor.feed(text[i:i + args.chunk_size]):
+                break
+        for result in (extract_sql_query(text), extractor.finish()):
+            if result != expected:
+                failures.append({'text': text, 'expected': expected, 'got': result})
+    report['regressions'] = {'total': len(EXTRACTOR_REGRESSION_CASES), 'failures': failures}
+    print(f"\nРегрессионные случаи: {len(EXTRACTOR_REGRESSION_CASES) - len({f['text'] for f in failures})}"
+          f"/{len(EXTRACTOR_REGRESSION_CASES)} без ошибок")
+
+    save_report(report, args.output, 'extractor')
+    if failures:
+        raise RuntimeError(f"Извлечение SQL ошиблось на регрессионных случаях: {failures}")
+    return report
+
+
+def benchmark_fewshot(args):
+    """
+    Сравнивает статический промт и подбор k похожих примеров: размер промта,
+    задержку ответа и точность (по совпадению результатов с эталоном).
+
+    С заглушкой модели ответы не зависят от промта, поэтому точность одинакова,
+    а задержка моделируется через --per-prompt-token-latency; для оценки
+    точности используйте --live (реальный GigaChat).
+    """
+    from main_test import SQLTester
+
+    pipeline_metrics.enabled = True
+    if args.live:
+        from authorization import authorization_gigachat
+        llm = authorization_gigachat()
+    else:
+        llm = build_stub_llm(args)
+
+    modes = [('static', None)] + [('retrieval', k) for k in args.k]
+    report = {
+        'benchmark': 'fewshot',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'live': args.live, 'k': args.k, 'per_prompt_token_latency': args.per_prompt_token_latency},
+        'modes': {}
+    }
+
+    print(f"🚀 Оценка подбора примеров: {len(TEST_CASES)} вопросов, модель {type(llm).__name__}")
+    header = f"{'Режим':<14} {'токенов':>8} {'промт, мс':>10} {'LLM p50, мс':>12} {'успех':>7} {'совпадение':>11}"
+    print(header)
+    print("-" * len(header))
+
+    for mode, k in modes:
+        tester = SQLTester(db_path=args.db, llm=llm, pause_between_tests=args.pause,
+                           prompt_mode=mode, examples_k=k or 3)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ready = tester.setup()
+        if not ready:
+            raise RuntimeError("Не удалось инициализировать SQLTester")
+
+        try:
+            prompt_tokens = [
+                estimate_tokens(tester.prompt_builder.build_enhanced_system_prompt(t['question']))
+                for t in TEST_CASES
+            ]
+
+            pipeline_metrics.reset()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = tester.run_all_tests(TEST_CASES)
+        finally:
+            tester.cleanup()
+
+        stages = pipeline_metrics.summary()
+        name = mode if k is None else f"{mode} k={k}"
+        summary = {
+            'avg_prompt_tokens': sum(prompt_tokens) / len(prompt_tokens),
+            'prompt_build_p50': stages.get('prompt_build', {}).get('p50', 0.0),
+            'llm_p50': stages.get('llm_invoke', {}).get('p50', 0.0),
+            'llm_p95': stages.get('llm_invoke', {}).get('p95', 0.0),
+            'success_rate': sum(r['status'] == 'success' for r in results) / len(results),
+            'result_match_rate': sum(bool(r.get('result_match')) for r in results) / len(results)
+        }
+        report['modes'][name] = summary
+
+        print(f"{name:<14} {summary['avg_prompt_tokens']:>8.0f} {summary['prompt_build_p50'] * 1000:>10.3f} "
+              f"{summary['llm_p50'] * 1000:>12.1f} {summary['success_rate'] * 100:>6.1f}% "
+              f"{summary['result_match_rate'] * 100:>10.1f}%")
+
+    save_report(report, args.output, 'fewshot')
+    return report
+
+
+def benchmark_router(args):
+    """
+    Оценка маршрутизатора типовых вопросов на TEST_CASES: доля вопросов,
+    обработанных без GigaChat, правильность шаблонного SQL (по совпадению
+    результатов с эталоном) и экономия времени в интерактивном режиме.
+    Вопросы ROUTER_FALLBACK_QUESTIONS должны уходить в GigaChat.
+    """
+    from main_test import SQLTester
+
+    pipeline_metrics.enabled = True
+    llm = build_stub_llm(args)
+    tester = SQLTester(db_path=args.db, llm=llm, pause_between_tests=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ready = tester.setup()
+    if not ready:
+        raise RuntimeError("Не удалось инициализировать SQLTester")
+
+    router = tester.prompt_builder.intent_router
+    report = {
+        'benchmark': 'router',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'recorded': args.recorded, 'latency': args.latency, 'latency_scale': args.latency_scale},
+        'questions': [],
+        'fallback': [],
+        'repl': {}
+    }
+
+    print(f"🚀 Маршрутизатор типовых вопросов: {len(TEST_CASES)} вопросов, коммит {report['commit']}")
+    try:
+        for test_case in TEST_CASES:
+            start = time.perf_counter()
+            route = router.route(test_case['question'])
+            route_time = time.perf_counter() - start
+
+            entry = {'id': test_case['id'], 'route_time': route_time, 'intent': None, 'correct': False}
+            if route is not None:
+                check = compare_query_results(tester.conn, route.inline_sql, test_case['expected_sql'])
+                entry.update(intent=route.intent, sql=route.inline_sql, correct=check['equivalent'])
+            report['questions'].append(entry)
+
+            mark = '—' if route is None else ('✅' if entry['correct'] else '❌')
+            print(f"  {mark} #{test_case['id']:<3} {entry['intent'] or 'GigaChat':<14} "
+                  f"{route_time * 1e6:>7.1f} мкс  {test_case['question']}")
+
+        print("\n  Вопросы вне TEST_CASES (ожидается GigaChat):")
+        for question in ROUTER_FALLBACK_QUESTIONS:
+            route = router.route(question)
+            report['fallback'].append({'question': question, 'sql': route.inline_sql if route else None})
+            print(f"  {'✅' if route is None else '❌'} {route.inline_sql if route else 'GigaChat':<14} {question}")
+
+        # Интерактивный режим с маршрутизатором и без него
+        for name, enabled in (('без маршрутизатора', False), ('с маршрутизатором', True)):
+            tester.prompt_builder.intent_router = router if enabled else None
+            calls_before = llm.calls
+            suite = run_repl_suite(llm, tester, TEST_CASES)
+            suite['llm_calls'] = llm.calls - calls_before
+            report['repl'][name] = suite
+    finally:
+        tester.prompt_builder.intent_router = router
+        tester.cleanup()
+
+    hits = [q for q in report['questions'] if q['intent']]
+    baseline, routed = report['repl']['без маршрутизатора'], report['repl']['с маршрутизатором']
+    report['hit_rate'] = len(hits) / len(TEST_CASES)
+    report['precision'] = sum(q['correct'] for q in hits) / len(hits) if hits else 0.0
+    report['time_saved'] = baseline['elapsed'] - routed['elapsed']
+    report['false_routes'] = sum(entry['sql'] is not None for entry in report['fallback'])
+
+    print(f"\n📈 Без GigaChat: {len(hits)}/{len(TEST_CASES)} ({report['hit_rate'] * 100:.1f}%), "
+          f"верных: {sum(q['correct'] for q in hits)}/{len(hits)}, "
+          f"вне TEST_CASES отвечено шаблоном: {report['false_routes']}/{len(ROUTER_FALLBACK_QUESTIONS)}")
+    print(f"⏱️ REPL: {baseline['elapsed']:.2f}с ({baseline['llm_calls']} вызовов LLM) -> "
+          f"{routed['elapsed']:.2f}с ({routed['llm_calls']} вызовов), экономия {report['time_saved']:.2f}с")
+
+    save_report(report, args.output, 'router')
+    return report
+
+
+def benchmark_speculative(args):
+    """
+    Спекулятивное выполнение подсказок PromptBuilder во время вызова LLM:
+    доля попаданий и время выполнения SQL в интерактивном режиме.
+    Маршрутизатор типовых вопросов отключается, чтобы все вопросы шли в модель.
+    """
+    from main_test import SQLTester
+    from speculative import SpeculativeExecutor
+
+    pipeline_metrics.enabled = True
+    llm = build_stub_llm(args)
+    tester = SQLTester(db_path=args.db, llm=llm, pause_between_tests=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ready = tester.setup()
+    if not ready:
+        raise RuntimeError("Не удалось инициализировать SQLTester")
+
+    tester.prompt_builder.intent_router = None
+    speculator = SpeculativeExecutor(args.db, max_candidates=args.candidates)
+    report = {
+        'benchmark': 'speculative',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'recorded': args.recorded, 'latency': args.latency, 'candidates': args.candidates},
+        'suites': {}
+    }
+
+    print(f"🚀 Спекулятивное выполнение: {len(TEST_CASES)} вопросов, коммит {report['commit']}")
+    try:
+        for name, executor in (('off', None), ('on', speculator)):
+            suite = run_repl_suite(llm, tester, TEST_CASES, executor)
+            suite['execute_sql'] = suite['stages'].get('execute_sql', {})
+            report['suites'][name] = suite
+    finally:
+        speculator.close()
+        tester.cleanup()
+
+    report['speculation'] = dict(speculator.stats, hit_rate=speculator.hit_rate)
+    print(speculator.format_stats())
+    off, on = report['suites']['off']['execute_sql'], report['suites']['on']['execute_sql']
+    if off and on:
+        print(f"⏱️ Выполнение SQL: {off['total'] * 1000:.1f} мс -> {on['total'] * 1000:.1f} мс")
+
+    save_report(report, args.output, 'speculative')
+    return report
+
+
+def _max_rss_mb():
+    """Пиковый объем памяти процесса, МБ (None, если недоступно)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_export(args):
+    """
+    Потоковая выгрузка результата в файлы: строк в секунду и рост пиковой
+    памяти на синтетическом результате из миллионов строк (соединение таблицы
+    с собой). Для сравнения выгрузка через fetchall() выполняется последней,
+    так как пиковая память процесса только растет. Parquet выгружается еще и
+    для результата, типы колонок которого меняются между порциями (целые,
+    затем дробные; NULL, затем текст).
+    """
+    import csv
+    import tempfile
+
+    import pandas as pd
+
+    from result_export import EXPORT_FORMATS, export_query
+    from storage import load_frame
+
+    conn = open_connection(args.db)
+    load_frame(conn, 'freelancer_earnings', pd.read_csv('freelancer_earnings_bd.csv'))
+    sql = ("SELECT a.Freelancer_ID, a.Platform, a.Earnings_USD, b.Job_Category, b.Hourly_Rate "
+           "FROM freelancer_earnings a CROSS JOIN freelancer_earnings b LIMIT ?")
+    # Первые строки внешней таблицы дают целые и NULL, остальные - дробные и текст
+    mixed_sql = ("SELECT a.Freelancer_ID, "
+                 "CASE WHEN a.Freelancer_ID <= 10 THEN a.Job_Completed ELSE a.Hourly_Rate END AS Mixed_Number, "
+                 "CASE WHEN a.Freelancer_ID <= 10 THEN NULL ELSE a.Platform END AS Late_Text "
+                 "FROM freelancer_earnings a CROSS JOIN freelancer_earnings b LIMIT ?")
+    formats = [f for f in args.formats if f in EXPORT_FORMATS]
+
+    report = {
+        'benchmark': 'export',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'rows': args.rows, 'batch_size': args.batch_size, 'formats': formats},
+        'formats': {}
+    }
+    skipped = sorted(set(args.formats) - set(formats))
+    print(f"🚀 Выгрузка {args.rows} строк порциями по {args.batch_size}"
+          + (f" (пропущены: {', '.join(skipped)} - нет pyarrow)" if skipped else ""))
+    header = f"{'Формат':<14} {'строк/с':>12} {'время, с':>10} {'размер, МБ':>11} {'рост RSS, МБ':>13}"
+    print(header)
+    print("-" * len(header))
+
+    def row(name, stats, rss_growth):
+        print(f"{name:<14} {stats['rows_per_sec']:>12,.0f} {stats['seconds']:>10.2f} "
+              f"{stats['bytes'] / 1024 / 1024:>11.1f} {rss_growth if rss_growth is not None else float('nan'):>13.1f}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in formats:
+            rss_before = _max_rss_mb()
+            stats = export_query(conn, sql, os.path.join(directory, f"export.{fmt}"), fmt,
+                                 params=(args.rows,), batch_size=args.batch_size)
+            rss_after = _max_rss_mb()
+            stats['rss_growth_mb'] = rss_after - rss_before if rss_before is not None else None
+            report['formats'][fmt] = stats
+            row(fmt, stats, stats['rss_growth_mb'])
+
+        if 'parquet' in formats:
+            rss_before = _max_rss_mb()
+            stats = export_query(conn, mixed_sql, os.path.join(directory, "mixed.parquet"), 'parquet',
+                                 params=(args.rows,), batch_size=args.batch_size)
+            rss_after = _max_rss_mb()
+            stats['rss_growth_mb'] = rss_after - rss_before if rss_before is not None else None
+            report['formats']['parquet_mixed'] = stats
+            row('parquet, типы', stats, stats['rss_growth_mb'])
+            print(f"  Смешанные типы: Parquet переписан с расширенными типами {stats['schema_rewrites']} раз")
+
+        if args.compare_fetchall:
+            path = os.path.join(directory, "fetchall.csv")
+            rss_before = _max_rss_mb()
+            start = time.perf_counter()
+            cursor = conn.execute(sql, (args.rows,))
+            rows = cursor.fetchall()
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow([d[0] for d in cursor.description])
+                writer.writerows(rows)
+            seconds = time.perf_counter() - start
+            stats = {'rows': len(rows), 'seconds': seconds, 'rows_per_sec': len(rows) / seconds,
+                     'bytes': os.path.getsize(path)}
+            del rows
+            rss_after = _max_rss_mb()
+            stats['rss_growth_mb'] = rss_after - rss_before if rss_before is not None else None
+            report['formats']['fetchall_csv'] = stats
+            row('fetchall', stats, stats['rss_growth_mb'])
+
+    conn.close()
+    save_report(report, args.output, 'export')
+    return report
+
+
+def _build_wide_table(conn, table, columns, rows):
+    """Синтетическая таблица: числовые колонки, категории (8 значений) и почти уникальные строки"""
+    definitions = []
+    expressions = []
+    for i in range(columns):
+        if i % 3 == 0:
+            definitions.append(f"num_{i} REAL")
+            expressions.append("abs(random() % 100000) / 100.0")
+        elif i % 3 == 1:
+            definitions.append(f"cat_{i} TEXT")
+            expressions.append(f"'value_' || ((n * {i + 7}) % 8)")
+        else:
+            definitions.append(f"text_{i} TEXT")
+            expressions.append(f"'item_' || (n * {i + 1})")
+
+    conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.execute(f"CREATE TABLE {table} ({', '.join(definitions)})")
+    conn.execute(f"""
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {rows})
+        INSERT INTO {table} SELECT {', '.join(expressions)} FROM seq
+    """)
+    conn.commit()
+
+
+def benchmark_analyze(args):
+    """
+    Ленивый анализ таблиц против полного профилирования всех колонок:
+    время анализа (регистрации колонок) и время до первого промта на
+    синтетических таблицах разной ширины, а также совпадение промтов.
+    """
+    import tempfile
+
+    from table_analyzer import TableAnalyzer
+
+    report = {
+        'benchmark': 'analyze',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'columns': args.columns, 'rows': args.rows, 'repeat': args.repeat},
+        'tables': []
+    }
+
+    print(f"🚀 Анализ таблиц: {args.rows} строк, лучшее из {args.repeat} повторов")
+    header = (f"{'Колонок':>8} {'режим':<8} {'анализ, мс':>11} {'первый промт, мс':>17} "
+              f"{'итого, мс':>10} {'профилей':>9}")
+    print(header)
+    print("-" * len(header))
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'wide.db')
+        for columns in args.columns:
+            conn = open_connection(db_path)
+            _build_wide_table(conn, 'wide', columns, args.rows)
+            conn.close()
+
+            entry = {'columns': columns, 'modes': {}}
+            prompts = {}
+            for mode, lazy in (('полный', False), ('ленивый', True)):
+                best = None
+                for _ in range(args.repeat):
+                    analyzer = TableAnalyzer(db_path, 'wide')
+                    analyzer.connect()
+                    start = time.perf_counter()
+                    analyzer.analyze_column_values(lazy=lazy)
+                    analyze_time = time.perf_counter() - start
+                    prompt = analyzer.get_enhanced_system_prompt('')
+                    prompt_time = time.perf_counter() - start - analyze_time
+                    analyzer.disconnect()
+                    if best is None or analyze_time + prompt_time < best['analyze'] + best['first_prompt']:
+                        best = {'analyze': analyze_time, 'first_prompt': prompt_time,
+                                'profiled_columns': analyzer.profiled_columns}
+                prompts[mode] = prompt
+                entry['modes'][mode] = best
+                print(f"{columns:>8} {mode:<8} {best['analyze'] * 1000:>11.1f} {best['first_prompt'] * 1000:>17.1f} "
+                      f"{(best['analyze'] + best['first_prompt']) * 1000:>10.1f} "
+                      f"{best['profiled_columns']:>4}/{columns:<4}")
+            entry['prompts_equal'] = prompts['полный'] == prompts['ленивый']
+            if not entry['prompts_equal']:
+                print(f"  ❌ промты для {columns} колонок различаются")
+            report['tables'].append(entry)
+
+    print(f"\n📈 Промты совпадают: {sum(t['prompts_equal'] for t in report['tables'])}/{len(report['tables'])}")
+    save_report(report, args.output, 'analyze')
+    return report
+
+
+def _compare_profiles(incremental, full):
+    """Сравнивает профили колонок: точные поля и ошибку оценки числа уникальных"""
+    mismatches = []
+    distinct_errors = {}
+    for column, expected in full.items():
+        actual = incremental.get(column)
+        if actual is None:
+            mismatches.append(f"{column}: нет профиля")
+            continue
+        for key in ('is_numeric', 'total_count', 'unique_values'):
+            if actual[key] != expected[key]:
+                mismatches.append(f"{column}.{key}")
+        if expected['range']:
+            if any(not math.isclose(actual['range'][k], expected['range'][k], rel_tol=1e-9)
+                   for k in ('min', 'max', 'mean')):
+                mismatches.append(f"{column}.range")
+        if actual['unique_count'] != expected['unique_count']:
+            distinct_errors[column] = actual['unique_count'] / expected['unique_count'] - 1
+    return mismatches, distinct_errors
+
+
+def benchmark_incremental(args):
+    """
+    Инкрементальное обновление статистики: таблица наполняется порциями,
+    после каждой TableAnalyzer.append_rows() объединяет сводку порции со
+    сводками колонок. Время сравнивается с полным пересчетом, а итоговые
+    сводки и профили - с посчитанными заново по всей таблице.
+    """
+    import tempfile
+
+    import pandas as pd
+
+    from table_analyzer import TableAnalyzer
+
+    df = pd.concat([pd.read_csv('freelancer_earnings_bd.csv')] * args.scale, ignore_index=True)
+    initial = int(len(df) * args.initial)
+    report = {
+        'benchmark': 'incremental',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'rows': len(df), 'initial': initial, 'batch_size': args.batch_size},
+    }
+    print(f"🚀 Инкрементальная статистика: {initial} строк, затем порции по {args.batch_size} до {len(df)}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'incremental.db')
+        conn = open_connection(db_path)
+        df.iloc[:initial].to_sql('freelancer_earnings', conn, index=False)
+
+        analyzer = TableAnalyzer(db_path, 'freelancer_earnings')
+        analyzer.connect()
+        analyzer.analyze_column_values()
+        start = time.perf_counter()
+        analyzer.append_rows([])  # сводки по уже загруженным строкам
+        report['initial_summaries'] = time.perf_counter() - start
+
+        placeholders = ", ".join("?" * len(df.columns))
+        append_times = []
+        for offset in range(initial, len(df), args.batch_size):
+            rows = list(df.iloc[offset:offset + args.batch_size].itertuples(index=False, name=None))
+            with conn:
+                conn.executemany(f"INSERT INTO freelancer_earnings VALUES ({placeholders})", rows)
+            start = time.perf_counter()
+            analyzer.append_rows(rows)
+            append_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        problems = analyzer.verify_summaries()
+        report['full_summaries'] = time.perf_counter() - start
+
+        fresh = TableAnalyzer(db_path, 'freelancer_earnings')
+        fresh.connect()
+        start = time.perf_counter()
+        fresh.analyze_column_values(lazy=False)
+        report['full_profile'] = time.perf_counter() - start
+        mismatches, distinct_errors = _compare_profiles(analyzer.column_info, fresh.column_info)
+        fresh.disconnect()
+        analyzer.disconnect()
+        conn.close()
+
+    report['append'] = {'batches': len(append_times), 'mean': statistics.mean(append_times),
+                        'max': max(append_times)} if append_times else {}
+    report['summary_mismatches'] = problems
+    report['profile_mismatches'] = mismatches
+    report['distinct_errors'] = distinct_errors
+
+    if append_times:
+        print(f"⏱️ Порция ({len(append_times)} шт.): в среднем {report['append']['mean'] * 1000:.1f} мс, "
+              f"макс. {report['append']['max'] * 1000:.1f} мс")
+    print(f"⏱️ Пересчет заново: сводки {report['full_summaries'] * 1000:.1f} мс, "
+          f"профили {report['full_profile'] * 1000:.1f} мс")
+    print(f"{'✅' if not problems else '❌'} Сводки совпадают с пересчетом заново"
+          + (f": расхождения в {', '.join(problems)}" if problems else ""))
+    print(f"{'✅' if not mismatches else '❌'} Профили совпадают с полным анализом"
+          + (f": {', '.join(mismatches)}" if mismatches else ""))
+    for column, error in distinct_errors.items():
+        print(f"   ≈ {column}: число уникальных по скетчу, ошибка {error * 100:+.1f}%")
+
+    save_report(report, args.output, 'incremental')
+    return report
+
+
+def benchmark_ingest(args):
+    """
+    Дозагрузка дописанных строк CSV против полной перезагрузки to_sql:
+    время, прочитанные байты, совпадение таблицы с полной загрузкой и
+    переход на полную перезагрузку при изменении ранее загруженных строк.
+    """
+    import tempfile
+
+    import pandas as pd
+
+    from data_loader import get_data_version, ingest_csv
+
+    with open('freelancer_earnings_bd.csv', 'rb') as f:
+        header = f.readline()
+        body = f.read()
+    body = body if body.endswith(b'\n') else body + b'\n'
+    lines = (body * args.scale).splitlines(keepends=True)
+    base, appended = lines[:-args.append_rows], lines[-args.append_rows:]
+
+    report = {
+        'benchmark': 'ingest',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'rows': len(lines), 'append_rows': len(appended)},
+        'checks': {}
+    }
+    print(f"🚀 Загрузка CSV: {len(base)} строк, затем дописано {len(appended)}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'data.csv')
+        conn = open_connection(os.path.join(directory, 'ingest.db'), loader=True)
+
+        with open(csv_path, 'wb') as f:
+            f.write(header + b''.join(base))
+        ingest_csv(conn, 'freelancer_earnings', csv_path, 'Freelancer_ID')
+        with open(csv_path, 'ab') as f:
+            f.write(b''.join(appended))
+
+        start = time.perf_counter()
+        df = pd.read_csv(csv_path)
+        df.to_sql('full_reload', conn, if_exists='replace', index=False)
+        report['to_sql_replace'] = time.perf_counter() - start
+
+        delta = ingest_csv(conn, 'freelancer_earnings', csv_path, 'Freelancer_ID')
+        report['delta'] = delta
+        report['checks']['delta_mode'] = delta['mode'] == 'delta' and delta['rows'] == len(appended)
+        report['checks']['same_rows'] = (conn.execute("SELECT * FROM freelancer_earnings").fetchall()
+                                         == conn.execute("SELECT * FROM full_reload").fetchall())
+
+        unchanged = ingest_csv(conn, 'freelancer_earnings', csv_path, 'Freelancer_ID')
+        report['checks']['unchanged'] = unchanged['mode'] == 'unchanged'
+
+        # Выгрузка переписана: строка из середины уже загруженной части удалена
+        middle = len(base) // 2
+        with open(csv_path, 'wb') as f:
+            f.write(header + b''.join(base[:middle] + base[middle + 1:] + appended))
+        version = get_data_version(conn, 'freelancer_earnings')
+        rebuilt = ingest_csv(conn, 'freelancer_earnings', csv_path, 'Freelancer_ID')
+        report['rebuild'] = rebuilt
+        report['checks']['rebuild_on_change'] = (rebuilt['mode'] == 'full'
+                                                 and get_data_version(conn, 'freelancer_earnings') == version + 1)
+        conn.close()
+
+    print(f"⏱️ to_sql(replace) всего файла: {report['to_sql_replace'] * 1000:.1f} мс")
+    print(f"⏱️ Дозагрузка: {delta['rows']} строк за {delta['seconds'] * 1000:.1f} мс, "
+          f"прочитано {delta['bytes_read'] / 1024:.1f} КБ")
+    print(f"⏱️ Полная перезагрузка после изменения: {rebuilt['seconds'] * 1000:.1f} мс ({rebuilt['reason']})")
+    for name, passed in report['checks'].items():
+        print(f"{'✅' if passed else '❌'} {name}")
+
+    save_report(report, args.output, 'ingest')
+    return report
+
+
+def _report_text(tester):
+    """Текст generate_report() без замеров времени (они различаются между прогонами)"""
+    enabled = pipeline_metrics.enabled
+    pipeline_metrics.enabled = False
+    try:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            tester.generate_report()
+    finally:
+        pipeline_metrics.enabled = enabled
+    return re.sub(r'\d+\.\d+с', '<время>', output.getvalue())
+
+
+def benchmark_shard(args):
+    """
+    Последовательный прогон SQLTester против прогона в пуле процессов
+    (run_sharded): время, ускорение и совпадение отчета generate_report().
+    """
+    from main_test import SQLTester
+
+    pipeline_metrics.enabled = True
+    llm = build_stub_llm(args)
+    tester = SQLTester(db_path=args.db, llm=llm, pause_between_tests=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ready = tester.setup()
+    if not ready:
+        raise RuntimeError("Не удалось инициализировать SQLTester")
+
+    report = {
+        'benchmark': 'shard',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'workers': args.workers, 'latency': args.latency, 'recorded': args.recorded},
+        'runs': {}
+    }
+    print(f"🚀 SQLTester: {len(TEST_CASES)} тестов, задержка модели {args.latency}с")
+
+    try:
+        pipeline_metrics.reset()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tester.run_all_tests()
+        serial_time = time.perf_counter() - start
+        serial_report = _report_text(tester)
+        serial_llm_calls = pipeline_metrics.summary().get('llm_invoke', {}).get('count', 0)
+        report['runs']['serial'] = {'elapsed': serial_time, 'llm_calls': serial_llm_calls}
+        print(f"  последовательно: {serial_time:.2f}с")
+
+        for workers in args.workers:
+            pipeline_metrics.reset()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                tester.run_sharded(workers=workers)
+            elapsed = time.perf_counter() - start
+            identical = _report_text(tester) == serial_report
+            llm_calls = pipeline_metrics.summary().get('llm_invoke', {}).get('count', 0)
+            report['runs'][f'workers_{workers}'] = {
+                'elapsed': elapsed, 'speedup': serial_time / elapsed, 'report_identical': identical,
+                'llm_calls': llm_calls
+            }
+            print(f"  {workers} процессов: {elapsed:.2f}с (x{serial_time / elapsed:.2f}), "
+                  f"отчет {'совпадает ✅' if identical else 'отличается ❌'}, "
+                  f"замеров вызова модели: {llm_calls}/{serial_llm_calls}")
+    finally:
+        tester.cleanup()
+
+    save_report(report, args.output, 'shard')
+    return report
+
+
+def _run_queries(conn, queries, repeat):
+    """
+    Выполняет запросы repeat раз
+
+    Returns:
+        tuple: (время первого прохода, сумма медиан времени запросов, результаты первого прохода)
+    """
+    timings = [[] for _ in queries]
+    results = []
+    first_pass = 0.0
+    for attempt in range(repeat):
+        for i, sql in enumerate(queries):
+            start = time.perf_counter()
+            rows = conn.execute(sql).fetchall()
+            elapsed = time.perf_counter() - start
+            timings[i].append(elapsed)
+            if attempt == 0:
+                first_pass += elapsed
+                results.append(rows)
+    return first_pass, sum(statistics.median(t) for t in timings), results
+
+
+def _query_plans(conn, queries):
+    return [conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall() for sql in queries]
+
+
+def benchmark_pragmas(args):
+    """
+    Запросы TEST_CASES на размноженной таблице: соединение с настройками
+    SQLite по умолчанию, с PRAGMA фабрики db.open_connection() и с PRAGMA
+    после ANALYZE. Первый проход идет с пустым кэшем соединения.
+    """
+    import sqlite3
+    import tempfile
+
+    import pandas as pd
+
+    queries = [test_case['expected_sql'] for test_case in TEST_CASES]
+    report = {
+        'benchmark': 'pragmas',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'scale': args.scale, 'repeat': args.repeat},
+        'runs': {}
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'pragmas.db')
+        df = pd.read_csv('freelancer_earnings_bd.csv')
+        df = pd.concat([df] * args.scale, ignore_index=True)
+        conn = open_connection(db_path, loader=True)
+        df.to_sql('freelancer_earnings', conn, index=False)
+        conn.close()
+        size_mb = os.path.getsize(db_path) / 1024 / 1024
+        print(f"🚀 {len(queries)} запросов TEST_CASES, {len(df)} строк ({size_mb:.1f} МБ), повторов {args.repeat}")
+
+        def run(name, conn):
+            first_pass, steady, results = _run_queries(conn, queries, args.repeat)
+            report['runs'][name] = {'first_pass': first_pass, 'steady': steady}
+            print(f"  {name:<18} первый проход {first_pass * 1000:8.1f} мс, повторные {steady * 1000:8.1f} мс")
+            return results
+
+        # Прогрев файлового кэша ОС, чтобы первая конфигурация не платила за чтение с диска
+        conn = sqlite3.connect(db_path)
+        _run_queries(conn, queries, 1)
+        conn.close()
+
+        conn = sqlite3.connect(db_path)
+        baseline = run('default', conn)
+        plans = _query_plans(conn, queries)
+        conn.close()
+
+        conn = open_connection(db_path)
+        tuned = run('pragmas', conn)
+        start = time.perf_counter()
+        update_statistics(conn)
+        report['analyze_time'] = time.perf_counter() - start
+        conn.close()
+
+        conn = open_connection(db_path)
+        analyzed = run('pragmas+analyze', conn)
+        changed = sum(a != b for a, b in zip(plans, _query_plans(conn, queries)))
+        conn.close()
+
+    report['plans_changed'] = changed
+    report['same_results'] = baseline == tuned == analyzed
+    default = report['runs']['default']
+    for name in ('pragmas', 'pragmas+analyze'):
+        run_stats = report['runs'][name]
+        run_stats['speedup_first_pass'] = default['first_pass'] / run_stats['first_pass']
+        run_stats['speedup_steady'] = default['steady'] / run_stats['steady']
+        print(f"  {name}: x{run_stats['speedup_first_pass']:.2f} первый проход, "
+              f"x{run_stats['speedup_steady']:.2f} повторные")
+    print(f"  ANALYZE: {report['analyze_time'] * 1000:.1f} мс, изменилось планов: {changed}/{len(queries)}, "
+          f"результаты {'совпадают ✅' if report['same_results'] else 'различаются ❌'}")
+
+    save_report(report, args.output, 'pragmas')
+    return report
+
+
+def benchmark_storage(args):
+    """
+    Типизированная схема хранения со словарями значений против таблицы to_sql:
+    размер базы после VACUUM, время загрузки, запросы TEST_CASES и полное
+    чтение таблицы на размноженных данных. Результаты запросов сравниваются.
+    """
+    import tempfile
+
+    import pandas as pd
+
+    from storage import load_frame, physical_table, read_columns, storage_size
+
+    queries = [test_case['expected_sql'] for test_case in TEST_CASES]
+    scan_queries = ["SELECT * FROM freelancer_earnings"]
+    report = {
+        'benchmark': 'storage',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'scale': args.scale, 'repeat': args.repeat},
+        'runs': {}
+    }
+
+    df = pd.read_csv('freelancer_earnings_bd.csv')
+    df = pd.concat([df] * args.scale, ignore_index=True)
+    print(f"🚀 {len(df)} строк, {len(queries)} запросов TEST_CASES, повторов {args.repeat}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, typed in (('plain', False), ('typed', True)):
+            db_path = os.path.join(directory, f'{name}.db')
+            conn = open_connection(db_path, loader=True)
+            start = time.perf_counter()
+            load_frame(conn, 'freelancer_earnings', df, typed=typed)
+            update_statistics(conn, physical_table(conn, 'freelancer_earnings'))
+            load_time = time.perf_counter() - start
+            conn.execute("VACUUM")
+            table_size = storage_size(conn, 'freelancer_earnings')
+            dictionaries = [c['name'] for c in read_columns(conn, 'freelancer_earnings') if c['dictionary']]
+            conn.close()
+
+            conn = open_connection(db_path)
+            _run_queries(conn, queries + scan_queries, 1)  # прогрев кэша
+            _, steady, rows = _run_queries(conn, queries, args.repeat)
+            _, scan, _ = _run_queries(conn, scan_queries, args.repeat)
+            conn.close()
+
+            results[name] = [sorted(map(repr, r)) for r in rows]
+            report['runs'][name] = {
+                'file_size': os.path.getsize(db_path), 'table_size': table_size, 'load_time': load_time,
+                'queries': steady, 'full_scan': scan, 'dictionaries': dictionaries
+            }
+            print(f"  {name:<6} файл {os.path.getsize(db_path) / 1024 / 1024:7.2f} МБ, "
+                  f"загрузка {load_time * 1000:7.1f} мс, запросы {steady * 1000:7.1f} мс, "
+                  f"SELECT * {scan * 1000:7.1f} мс")
+
+    plain, typed = report['runs']['plain'], report['runs']['typed']
+    report['size_ratio'] = typed['file_size'] / plain['file_size']
+    report['query_speedup'] = plain['queries'] / typed['queries']
+    report['scan_speedup'] = plain['full_scan'] / typed['full_scan']
+    report['same_results'] = results['plain'] == results['typed']
+    print(f"  словари: {', '.join(typed['dictionaries']) or 'нет'}")
+    print(f"  размер x{report['size_ratio']:.2f}, запросы x{report['query_speedup']:.2f}, "
+          f"SELECT * x{report['scan_speedup']:.2f}, "
+          f"результаты {'совпадают ✅' if report['same_results'] else 'различаются ❌'}")
+
+    save_report(report, args.output, 'storage')
+    return report
+
+
+# Тяжелые зависимости: пакет -> импорт, который выполняет приложение
+HEAVY_IMPORTS = {
+    'pandas': 'import pandas',
+    'numpy': 'import numpy',
+    'langchain_core': 'from langchain_core.messages import SystemMessage',
+    'langchain_community': 'from langchain_community.cache import InMemoryCache',
+    'langchain_gigachat': 'from langchain_gigachat.chat_models import GigaChat',
+    'pyarrow': 'import pyarrow.parquet'
+}
+
+# Замер запуска main.py в отдельном процессе: импорт и время до готового системного промта
+_STARTUP_SCRIPT = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    conn = main.create_database_and_load_data()
+    main.prepare_prompt_builder()
+ready = time.perf_counter()
+conn.close()
+print(json.dumps({'import': imported - start, 'first_prompt': ready - start,
+                  'modules': [m for m in sys.argv[1:] if m in sys.modules]}))
+"""
+
+
+def _run_startup(workdir):
+    """Запускает _STARTUP_SCRIPT в workdir и возвращает замеры и общее время процесса"""
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT] + list(HEAVY_IMPORTS), cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    stats['process'] = time.perf_counter() - start
+    return stats
+
+
+def _import_time(statement):
+    """Время выполнения импорта в чистом процессе, с (None - модуль не установлен)"""
+    script = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+    return float(result.stdout) if result.returncode == 0 else None
+
+
+def benchmark_startup(args):
+    """
+    Запуск main.py в отдельных процессах: холодный (базы нет, CSV загружается)
+    и повторный (база готова): время импорта, время до системного промта и
+    какие тяжелые модули оказались загружены.
+    """
+    import tempfile
+
+    report = {
+        'benchmark': 'startup',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'repeat': args.repeat},
+        'heavy_imports': {module: _import_time(statement) for module, statement in HEAVY_IMPORTS.items()}
+    }
+    print("🚀 Запуск main.py до готового системного промта")
+    print("  Импорт тяжелых модулей отдельно: " + ", ".join(
+        f"{module} {seconds:.2f}с" for module, seconds in report['heavy_imports'].items() if seconds is not None))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        shutil.copy('freelancer_earnings_bd.csv', workdir)
+        cold = _run_startup(workdir)
+        warm = [_run_startup(workdir) for _ in range(args.repeat)]
+
+    def row(name, runs):
+        summary = {key: statistics.median(run[key] for run in runs) for key in ('import', 'first_prompt', 'process')}
+        summary['modules'] = runs[0]['modules']
+        print(f"  {name:<10} импорт {summary['import']:.3f}с, промт {summary['first_prompt']:.3f}с, "
+              f"процесс {summary['process']:.3f}с, загружены: {', '.join(summary['modules']) or 'нет'}")
+        return summary
+
+    report['cold'] = row('холодный', [cold])
+    report['warm'] = row('повторный', warm)
+
+    save_report(report, args.output, 'startup')
+    return report
+
+
+def _synthetic_results(count, failure_rate, seed):
+    """Результаты SQLTester для count тестов на основе TEST_CASES со случайными ошибками и задержками"""
+    rng = random.Random(seed)
+    errors = {
+        'sql_error': ['no such column: Job_Type', 'near "FROM": syntax error', 'no such table: freelancers'],
+        'no_sql_extracted': ['Не удалось извлечь SQL'],
+        'exception': ['Request timed out after 30s', 'Connection reset by peer']
+    }
+    results = []
+    for i in range(count):
+        test_case = TEST_CASES[i % len(TEST_CASES)]
+        status = 'success' if rng.random() >= failure_rate else rng.choice(list(errors))
+        llm_time = rng.lognormvariate(0, 0.5)
+        results.append({
+            'test_id': i + 1,
+            'question': test_case['question'],
+            'category': test_case['category'],
+            'expected_sql': test_case['expected_sql'],
+            'generated_sql': test_case['expected_sql'] if status in ('success', 'sql_error') else None,
+            'status': status,
+            'similarity_score': rng.uniform(60, 100) if status == 'success' else 0,
+            'similarity_type': '',
+            'execution_time': llm_time + rng.random() * 0.01,
+            'llm_time': llm_time,
+            'result_match': status == 'success' and rng.random() < 0.8,
+            'error': rng.choice(errors[status]) if status != 'success' else None,
+            'raw_response': ''
+        })
+    return results
+
+
+def benchmark_report(args):
+    """
+    Отчет SQLTester на синтетических наборах из тысяч результатов:
+    время сбора SuiteReport за один проход и вывода в текст, JSON и CSV.
+    """
+    report = {
+        'benchmark': 'report',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'results': args.results, 'failure_rate': args.failure_rate, 'seed': args.seed},
+        'sizes': {}
+    }
+    print(f"🚀 Отчет по результатам тестов, доля ошибок {args.failure_rate:.0%}")
+    print(f"  {'Тестов':>8} {'сбор, мс':>10} {'текст, мс':>10} {'JSON, мс':>10} {'CSV, мс':>10} {'текст, КБ':>10}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    for count in args.results:
+        results = _synthetic_results(count, args.failure_rate, args.seed)
+
+        build = _time_call(lambda: SuiteReport.from_results(results, TEST_CATEGORIES), args.repeat)
+        suite = SuiteReport.from_results(results, TEST_CATEGORIES)
+        text = _time_call(suite.format_text, args.repeat)
+        json_path = os.path.join(RESULTS_DIR, 'suite_report.json')
+        csv_path = os.path.join(RESULTS_DIR, 'suite_report.csv')
+        json_time = _time_call(lambda: suite.save(json_path), args.repeat)
+        csv_time = _time_call(lambda: suite.save(csv_path), args.repeat)
+        text_size = len(suite.format_text().encode('utf-8'))
+
+        report['sizes'][count] = {
+            'build': build, 'text': text, 'json': json_time, 'csv': csv_time,
+            'text_bytes': text_size, 'json_bytes': os.path.getsize(json_path)
+        }
+        print(f"  {count:>8} {build * 1000:>10.1f} {text * 1000:>10.1f} {json_time * 1000:>10.1f} "
+              f"{csv_time * 1000:>10.1f} {text_size / 1024:>10.1f}")
+
+    save_report(report, args.output, 'report')
+    return report
+
+
+def benchmark_coalesce(args):
+    """
+    Несколько клиентов в потоках одновременно задают вопросы TEST_CASES:
+    число вызовов модели и время ответа без объединения запросов и с
+    CoalescingChatModel. Ответы сравниваются с ответами модели без обертки.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    from llm_client import CoalescingChatModel
+
+    questions = [test_case['question'] for test_case in TEST_CASES][:args.questions]
+    system = SystemMessage(content="Создавай только SQL запросы для SQLite базы данных по запросу пользователя.")
+    report = {
+        'benchmark': 'coalesce',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'clients': args.clients, 'questions': len(questions), 'latency': args.latency,
+                   'jitter': args.jitter},
+        'runs': {}
+    }
+
+    def client(llm, offset):
+        latencies = []
+        answers = []
+        for question in questions[offset:] + questions[:offset]:
+            start = time.perf_counter()
+            answers.append(llm.invoke([system, HumanMessage(content=question)]).content)
+            latencies.append(time.perf_counter() - start)
+        return latencies, answers
+
+    print(f"🚀 {len(questions)} вопросов, задержка модели {args.latency}с ± {args.jitter}с")
+    expected = None
+    for clients in args.clients:
+        for name in ('direct', 'coalesce'):
+            stub = ReplayChatModel.from_test_cases(TEST_CASES, latency=args.latency, jitter=args.jitter,
+                                                   seed=args.seed)
+            llm = CoalescingChatModel(stub) if name == 'coalesce' else stub
+            # Клиенты с общим смещением задают вопросы в одном порядке, остальные - со сдвигом
+            offsets = [0 if i < clients * args.overlap else i for i in range(clients)]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                results = list(pool.map(lambda offset: client(llm, offset), offsets))
+            elapsed = time.perf_counter() - start
+
+            latencies = sorted(t for client_latencies, _ in results for t in client_latencies)
+            answers = {q: a for offset, (_, client_answers) in zip(offsets, results)
+                       for q, a in zip(questions[offset:] + questions[:offset], client_answers)}
+            if expected is None:
+                expected = answers
+            run = {
+                'elapsed': elapsed,
+                'requests': len(latencies),
+                'model_calls': stub.calls,
+                'p50': statistics.median(latencies),
+                'max': latencies[-1],
+                'same_answers': answers == expected
+            }
+            if name == 'coalesce':
+                run['coalesced'] = llm.stats['coalesced']
+            report['runs'][f'{name}_{clients}'] = run
+            print(f"  {clients:>3} клиентов {name:<9} вызовов модели {stub.calls:5d}/{len(latencies):<5d} "
+                  f"p50 {run['p50'] * 1000:7.1f} мс, всего {elapsed:6.2f}с, "
+                  f"ответы {'совпадают ✅' if run['same_answers'] else 'различаются ❌'}")
+
+    save_report(report, args.output, 'coalesce')
+    return report
+
+
+def benchmark_hedge(args):
+    """
+    Срок ответа, дублирование медленных запросов и размыкатель цепи на
+    заглушке модели с "хвостом" задержек: доля tail_rate ответов приходит на
+    tail_latency секунд позже. Сравниваются перцентили задержки без обертки и
+    с HedgedChatModel (задержка дубля - p95 задержек), затем имитируется
+    отказ модели: после failure_threshold ошибок вызовы отклоняются сразу.
+    """
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    from llm_client import CircuitBreaker, HedgedChatModel, ModelUnavailableError
+
+    questions = [test_case['question'] for test_case in TEST_CASES]
+    system = SystemMessage(content="Создавай только SQL запросы для SQLite базы данных по запросу пользователя.")
+    report = {
+        'benchmark': 'hedge',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'requests': args.requests, 'latency': args.latency, 'jitter': args.jitter,
+                   'tail_rate': args.tail_rate, 'tail_latency': args.tail_latency, 'deadline': args.deadline,
+                   'failure_threshold': args.failure_threshold},
+        'runs': {}
+    }
+
+    def build_stub():
+        return ReplayChatModel.from_test_cases(TEST_CASES, latency=args.latency, jitter=args.jitter,
+                                               tail_rate=args.tail_rate, tail_latency=args.tail_latency,
+                                               seed=args.seed)
+
+    def run(name, llm, stub):
+        latencies = []
+        failures = 0
+        for i in range(args.requests):
+            start = time.perf_counter()
+            try:
+                llm.invoke([system, HumanMessage(content=questions[i % len(questions)])])
+            except ModelUnavailableError:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+        summary = percentiles(latencies)
+        summary.update(model_calls=stub.calls, failures=failures)
+        report['runs'][name] = summary
+        print(f"  {name:<9} p50 {summary['p50'] * 1000:7.1f} мс, p95 {summary['p95'] * 1000:7.1f} мс, "
+              f"p99 {summary['p99'] * 1000:7.1f} мс, макс {summary['max'] * 1000:7.1f} мс, "
+              f"вызовов модели {stub.calls}/{args.requests}, без ответа {failures}")
+        return summary
+
+    print(f"🚀 {args.requests} запросов: задержка {args.latency}с ± {args.jitter}с, "
+          f"{args.tail_rate * 100:.0f}% ответов еще на {args.tail_latency}с позже")
+    stub = build_stub()
+    direct = run('direct', stub, stub)
+
+    stub = build_stub()
+    hedged_model = HedgedChatModel(stub, deadline=args.deadline, min_samples=args.min_samples)
+    hedged = run('hedged', hedged_model, stub)
+    report['hedge_stats'] = dict(hedged_model.stats, hedge_delay=hedged_model.current_hedge_delay())
+    print(hedged_model.format_stats())
+    for p in ('p95', 'p99', 'max'):
+        report[f'{p}_speedup'] = direct[p] / hedged[p] if hedged[p] else 0.0
+    print(f"  p99 x{report['p99_speedup']:.2f}, макс x{report['max_speedup']:.2f}, "
+          f"лишних вызовов {(hedged['model_calls'] - args.requests) / args.requests * 100:.1f}%")
+
+    # Отказ модели: все вызовы завершаются ошибкой, затем модель восстанавливается
+    stub = build_stub()
+    stub.error_rate = 1.0
+    breaker = CircuitBreaker(failure_threshold=args.failure_threshold, reset_timeout=args.reset_timeout)
+    model = HedgedChatModel(stub, deadline=args.deadline, max_hedges=0, breaker=breaker)
+    outage = run('outage', model, stub)
+    stub.error_rate = 0.0
+    time.sleep(args.reset_timeout)
+    start = time.perf_counter()
+    model.invoke([system, HumanMessage(content=questions[0])])
+    report['breaker'] = {
+        'model_calls': outage['model_calls'], 'rejected': model.stats['rejected'],
+        'opened': breaker.stats['opened'], 'recovered': breaker.state == 'closed',
+        'probe_time': time.perf_counter() - start
+    }
+    print(f"  отказ: вызовов модели {outage['model_calls']}/{args.requests}, отклонено сразу "
+          f"{model.stats['rejected']}, после паузы {args.reset_timeout}с цепь {breaker.state}")
+
+    save_report(report, args.output, 'hedge')
+    return report
+
+
+def benchmark_tokens(args):
+    """
+    Учет токенов по компонентам промта и бюджет промта на TEST_CASES
+
+    Для каждого бюджета (первым - без ограничения) прогоняются SQLTester (вопросы
+    без истории) и интерактивный режим: все вопросы одним диалогом, история
+    которого растет с каждым ответом. Заглушка модели не сообщает токены, поэтому
+    они оцениваются локально, а задержка зависит от размера промта через
+    --per-prompt-token-latency. С заглушкой ответы не зависят от промта:
+    влияние сокращения схемы на точность проверяйте с реальным GigaChat.
+    """
+    from langchain_core.messages import SystemMessage
+    from main import process_user_query
+    from main_test import SQLTester
+    from token_usage import COMPONENT_NAMES, TokenAccountant
+
+    pipeline_metrics.enabled = True
+    llm = build_stub_llm(args)
+    budgets = [None] + args.budget
+    report = {
+        'benchmark': 'tokens',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'budget': args.budget, 'prompt_mode': args.prompt_mode,
+                   'per_prompt_token_latency': args.per_prompt_token_latency},
+        'runs': {}
+    }
+
+    print(f"🚀 Учет токенов: {len(TEST_CASES)} вопросов, режим промта {args.prompt_mode}")
+    header = (f"{'Прогон':<22} {'промт':>7} {'история':>8} {'схема':>7} {'значения':>9} "
+              f"{'LLM p50, мс':>12} {'удалено ист.':>12} {'сокр. схема':>11} {'успех':>7}")
+    print(header)
+    print("-" * len(header))
+
+    for budget in budgets:
+        tester = SQLTester(db_path=args.db, llm=llm, pause_between_tests=0, prompt_mode=args.prompt_mode,
+                           token_budget=budget)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ready = tester.setup()
+        if not ready:
+            raise RuntimeError("Не удалось инициализировать SQLTester")
+
+        try:
+            pipeline_metrics.reset()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = tester.run_all_tests(TEST_CASES)
+            suite = SuiteReport.from_results(results).tokens.summary()
+            suite_llm = pipeline_metrics.summary().get('llm_invoke', {})
+
+            # Интерактивный режим: один диалог, история растет; все вопросы идут к модели
+            tester.prompt_builder.intent_router = None
+            accountant = TokenAccountant(budget)
+            pipeline_metrics.reset()
+            with contextlib.redirect_stdout(io.StringIO()):
+                messages = [SystemMessage(content=tester.prompt_builder.build_enhanced_system_prompt())]
+                for test_case in TEST_CASES:
+                    process_user_query(test_case['question'], messages, llm, tester.conn, tester.prompt_builder,
+                                       token_accountant=accountant)
+            session = accountant.summary()
+            session_llm = pipeline_metrics.summary().get('llm_invoke', {})
+        finally:
+            tester.cleanup()
+
+        label = f"бюджет {budget}" if budget else "без бюджета"
+        for name, summary, llm_stage in (('тесты', suite, suite_llm), ('диалог', session, session_llm)):
+            summary['llm_p50'] = llm_stage.get('p50', 0.0)
+            requests = summary['requests'] or 1
+            components = summary['components']
+            print(f"{label + ', ' + name:<22} {summary['avg_prompt_tokens']:>7.0f} "
+                  f"{components.get('history', 0) / requests:>8.0f} {components.get('schema', 0) / requests:>7.0f} "
+                  f"{components.get('values', 0) / requests:>9.0f} {summary['llm_p50'] * 1000:>12.1f} "
+                  f"{summary['history_trimmed']:>12} {summary['schema_trimmed']:>11} "
+                  + (f"{sum(r['status'] == 'success' for r in results) / len(results) * 100:>6.1f}%"
+                     if name == 'тесты' else f"{'-':>7}"))
+        report['runs'][label] = {
+            'budget': budget,
+            'tests': dict(suite, success_rate=sum(r['status'] == 'success' for r in results) / len(results)),
+            'session': session
+        }
+
+    unlimited = report['runs']['без бюджета']['session']
+    print("\nКомпоненты промта в диалоге без бюджета: " + ", ".join(
+        f"{COMPONENT_NAMES[c]} {t / unlimited['prompt_tokens'] * 100:.0f}%"
+        for c, t in unlimited['components'].items() if t))
+
+    save_report(report, args.output, 'tokens')
+    return report
+
+
+def benchmark_generation(args):
+    """
+    Ограничение длины ответа на TEST_CASES: сквозная задержка SQLTester без
+    ограничения и с max_tokens и стоп-последовательностью (ответ обрезается
+    после получения целиком или читается потоком до стоп-последовательности),
+    а также с ответом в JSON {"sql": ...}.
+
+    Перед замером проверяется, что стоп-последовательность не обрезает ответ
+    на открывающем маркере: блоки ```` ```sql ```` и ```` ``` ```` с текстом до и
+    после них в обоих режимах должны давать исходный SQL.
+
+    Заглушка модели отвечает блоком кода с эталонным SQL и пояснением из
+    --prose-tokens токенов после него, как это часто делает GigaChat; в режиме
+    JSON - только объектом {"sql": ...}. Время ответа - задержка до первого
+    токена (--latency) плюс --per-token-latency на каждый токен ответа.
+    """
+    from langchain_core.messages import HumanMessage
+
+    from llm_client import control_generation
+    from main_test import SQLTester
+
+    sql = "SELECT COUNT(*) FROM freelancer_earnings"
+    fenced = [f"{before}{fence}\n{sql}\n```{after}"
+              for fence in ('```sql', '```') for before in ('', 'Запрос:\n') for after in ('', '\nПояснение')]
+    for stream in (False, True):
+        for answer in fenced:
+            llm = control_generation(ReplayChatModel({'q': answer}, stream_chunk_chars=3), 'sql', stream=stream)
+            content = llm.invoke([HumanMessage(content='q')]).content
+            if extract_sql_query(content) != sql:
+                raise RuntimeError(f"Стоп-последовательность испортила ответ {answer!r} "
+                                   f"({'поток' if stream else 'целиком'}): {content!r}")
+    print(f"✅ Маркеры блоков кода: {len(fenced)} вариантов ответа, целиком и потоком")
+
+    prose = ("Этот запрос выбирает нужные строки из таблицы freelancer_earnings, группирует их и "
+             "округляет числовые результаты до двух знаков. ")
+    prose = (prose * (args.prose_tokens * 4 // len(prose) + 1))[:args.prose_tokens * 4]
+    options = {'latency': args.latency, 'jitter': args.jitter, 'per_token_latency': args.per_token_latency,
+               'seed': args.seed}
+    verbose = {t['question']: f"```sql\n{t['expected_sql']}\n```\n\n{prose}" for t in TEST_CASES}
+    structured = {t['question']: json.dumps({'sql': t['expected_sql']}, ensure_ascii=False) for t in TEST_CASES}
+
+    # (название, формат ответа, ответы заглушки, чтение потоком)
+    modes = [
+        ('без ограничения', None, verbose, False),
+        ('sql, целиком', 'sql', verbose, False),
+        ('sql, поток', 'sql', verbose, True),
+        ('json', 'json', structured, False)
+    ]
+    report = {
+        'benchmark': 'generation',
+        'commit': get_commit_hash(),
+        'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'latency': args.latency, 'per_token_latency': args.per_token_latency,
+                   'prose_tokens': args.prose_tokens, 'max_tokens': args.max_tokens},
+        'modes': {}
+    }
+
+    print(f"🚀 Ограничение длины ответа: {len(TEST_CASES)} вопросов, пояснение {args.prose_tokens} токенов, "
+          f"{args.per_token_latency * 1000:.1f} мс/токен")
+    header = f"{'Режим':<20} {'токенов':>8} {'p50, мс':>9} {'p95, мс':>9} {'среднее, мс':>12} {'экономия':>9} {'успех':>7}"
+    print(header)
+    print("-" * len(header))
+
+    baseline = None
+    for name, output_format, responses, stream in modes:
+        llm = ReplayChatModel(responses, **options)
+        tester = SQLTester(db_path=args.db, llm=llm, pause_between_tests=0, output_format=output_format,
+                           max_tokens=args.max_tokens)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ready = tester.setup()
+        if not ready:
+            raise RuntimeError("Не удалось инициализировать SQLTester")
+        tester.giga = control_generation(llm, output_format, args.max_tokens, stream=stream)
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = tester.run_all_tests(TEST_CASES)
+        finally:
+            tester.cleanup()
+
+        latency = percentiles([r['execution_time'] for r in results])
+        tokens = SuiteReport.from_results(results).tokens.summary()
+        baseline = baseline or latency
+        summary = {
+            'output_format': output_format,
+            'stream': stream,
+            'latency': latency,
+            'avg_completion_tokens': tokens['avg_completion_tokens'],
+            'saved': 1 - latency['mean'] / baseline['mean'] if baseline['mean'] else 0.0,
+            'success_rate': sum(r['status'] == 'success' for r in results) / len(results),
+            'result_match_rate': sum(bool(r.get('result_match')) for r in results) / len(results)
+        }
+        report['modes'][name] = summary
+        print(f"{name:<20} {summary['avg_completion_tokens']:>8.0f} {latency['p50'] * 1000:>9.0f} "
+              f"{latency['p95'] * 1000:>9.0f} {latency['mean'] * 1000:>12.0f} {summary['saved'] * 100:>8.1f}% "
+              f"{summary['success_rate'] * 100:>6.1f}%")
+
+    save_report(report, args.output, 'generation')
+    return report
+
+
+def compare_runs(args):
+    """
+    Сравнивает прогон тестов из истории с базовыми прогонами; при найденной
+    регрессии завершается с кодом 1 (для проверки в CI).
+    """
+    history = RunHistory(args.history)
+    try:
+        if args.list:
+            print(format_runs(history.list_runs()))
+            return None
+
+        candidate = args.candidate or (history.latest_run_ids(1) or [None])[-1]
+        baseline = args.baseline or [run_id for run_id in history.latest_run_ids(2) if run_id != candidate][:1]
+        if candidate is None or not baseline:
+            print("❌ Для сравнения нужно минимум два прогона в истории")
+            raise SystemExit(2)
+
+        comparison = history.compare(baseline, candidate, alpha=args.alpha,
+                                     latency_threshold=args.latency_threshold,
+                                     accuracy_threshold=args.accuracy_threshold)
+    finally:
+        history.close()
+
+    print(format_comparison(comparison))
+
+    if args.output:
+        report = {
+            'benchmark': 'compare',
+            'commit': get_commit_hash(),
+            'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': {'history': args.history, 'baseline': baseline, 'candidate': candidate},
+            'comparison': comparison
+        }
+        save_report(report, args.output, 'compare')
+
+    if comparison['regressions']:
+        raise SystemExit(1)
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарки конвейера генерации SQL")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pipeline = subparsers.add_parser('pipeline', help="Сквозной бенчмарк SQLTester и REPL")
+    pipeline.add_argument('--db', default='freelancer_earnings.db', help="Путь к базе данных")
+    pipeline.add_argument('--recorded', help="Файл test_results_*.txt с записанными ответами")
+    pipeline.add_argument('--latency', type=float, default=0.0, help="Фиксированная задержка ответа, с")
+    pipeline.add_argument('--jitter', type=float, default=0.0, help="Случайный разброс задержки, с")
+    pipeline.add_argument('--per-token-latency', type=float, default=0.0, help="Задержка на токен ответа, с")
+    pipeline.add_argument('--latency-scale', type=float, default=1.0, help="Множитель записанных задержек")
+    pipeline.add_argument('--repeat', type=int, default=1, help="Число повторов набора TEST_CASES")
+    pipeline.add_argument('--seed', type=int, default=0, help="Seed генератора задержек")
+    pipeline.add_argument('--history', help="Сохранить прогон SQLTester в историю (путь к базе)")
+    pipeline.add_argument('--output', help="Путь к JSON отчету")
+    pipeline.set_defaults(func=benchmark_pipeline)
+
+    extractor = subparsers.add_parser('extractor', help="Извлечение SQL из длинных ответов")
+    extractor.add_argument('--size', type=int, default=64, help="Размер ответа, КБ")
+    extractor.add_argument('--chunk-size', type=int, default=16, help="Размер порции потока, символов")
+    extractor.add_argument('--repeat', type=int, default=20, help="Число повторов замера")
+    extractor.add_argument('--output', help="Путь к JSON отчету")
+    extractor.set_defaults(func=benchmark_extractor)
+
+    fewshot = subparsers.add_parser('fewshot', help="Статический промт против подбора похожих примеров")
+    fewshot.add_argument('--db', default='freelancer_earnings.db', help="Путь к базе данных")
+    fewshot.add_argument('--k', type=int, nargs='+', default=[1, 3, 5], help="Число подбираемых примеров")
+    fewshot.add_argument('--live', action='store_true', help="Использовать реальный GigaChat")
+    fewshot.add_argument('--pause', type=float, default=0.0, help="Пауза между тестами, с")
+    fewshot.add_argument('--recorded', help="Файл test_results_*.txt с записанными ответами")
+    fewshot.add_argument('--latency', type=float, default=0.0, help="Фиксированная задержка ответа, с")
+    fewshot.add_argument('--jitter', type=float, default=0.0, help="Случайный разброс задержки, с")
+    fewshot.add_argument('--per-token-latency', type=float, default=0.0, help="Задержка на токен ответа, с")
+    fewshot.add_argument('--per-prompt-token-latency', type=float, default=0.0005,
+                         help="Задержка на токен промта (обработка контекста), с")
+    fewshot.add_argument('--latency-scale', type=float, default=1.0, help="Множитель записанных задержек")
+    fewshot.add_argument('--seed', type=int, default=0, help="Seed генератора задержек")
+    fewshot.add_argument('--output', help="Путь к JSON отчету")
+    fewshot.set_defaults(func=benchmark_fewshot)
+
+    router = subparsers.add_parser('router', help="Ответы на типовые вопросы без GigaChat")
+    router.add_argument('--db', default='freelancer_earnings.db', help="Путь к базе данных")
+    router.add_argument('--recorded', help="Файл test_results_*.txt с записанными ответами")
+    router.add_argument('--latency', type=float, default=0.2, help="Фиксированная задержка ответа, с")
+    router.add_argument('--jitter', type=float, default=0.0, help="Случайный разброс задержки, с")
+    router.add_argument('--per-token-latency', type=float, default=0.0, help="Задержка на токен ответа, с")
+    router.add_argument('--latency-scale', type=float, default=1.0, help="Множитель записанных задержек")
+    router.add_argument('--seed', type=int, default=0, help="Seed генератора задержек")
+    router.add_argument('--output', help="Путь к JSON отчету")
+    router.set_defaults(func=benchmark_router)
+
+    speculative = subparsers.add_parser('speculative', help="Фоновое выполнение подсказок во время вызова LLM")
+    speculative.add_argument('--db', default='freelancer_earnings.db', help="Путь к базе данных")
+    speculative.add_argument('--candidates', type=int, default=3, help="Число запросов-кандидатов")
+    speculative.add_argument('--recorded', help="Файл test_results_*.txt с записанными ответами")
+    speculative.add_argument('--latency', type=float, default=0.2, help="Фиксированная задержка ответа, с")
+    speculative.add_argument('--jitter', type=float, default=0.0, help="Случайный разброс задержки, с")
+    speculative.add_argument('--per-token-latency', type=float, default=0.0, help="Задержка на токен ответа, с")
+    speculative.add_argument('--latency-scale', type=float, default=1.0, help="Множитель записанных задержек")
+    speculative.add_argument('--seed', type=int, default=0, help="Seed генератора задержек")
+    speculative.add_argument('--output', help="Путь к JSON отчету")
+    speculative.set_defaults(func=benchmark_speculative)
+
+    export = subparsers.add_parser('export', help="Потоковая выгрузка результатов в файлы")
+    export.add_argument('--db', default='freelancer_earnings.db', help="Путь к базе данных")
+    export.add_argument('--rows', type=int, default=2000000, help="Число строк результата")
+    export.add_argument('--batch-size', type=int, default=10000, help="Строк в порции")
+    export.add_argument('--formats', nargs='+', default=['csv', 'jsonl', 'parquet'], help="Форматы выгрузки")
+    export.add_argument('--compare-fetchall', action='store_true', help="Сравнить с выгрузкой через fetchall()")
+    export.add_argument('--output', help="Путь к JSON отчету")
+    export.set_defaults(func=benchmark_export)
+
+    analyze = subparsers.add_parser('analyze', help="Ленивый анализ таблиц против полного профилирования")
+    analyze.add_argument('--columns', type=int, nargs='+', default=[20, 100, 300], help="Ширина таблиц")
+    analyze.add_argument('--rows', type=int, default=20000, help="Строк в таблице")
+    analyze.add_argument('--repeat', type=int, default=3, help="Повторов каждого замера")
+    analyze.add_argument('--output', help="Путь к JSON отчету")
+    analyze.set_defaults(func=benchmark_analyze)
+
+    incremental = subparsers.add_parser('incremental', help="Инкрементальное обновление статистики таблицы")
+    incremental.add_argument('--scale', type=int, default=20, help="Во сколько раз размножить демо данные")
+    incremental.add_argument('--initial', type=float, default=0.5, help="Доля строк, загружаемых сразу")
+    incremental.add_argument('--batch-size', type=int, default=500, help="Строк в порции")
+    incremental.add_argument('--output', help="Путь к JSON отчету")
+    incremental.set_defaults(func=benchmark_incremental)
+
+    ingest = subparsers.add_parser('ingest', help="Дозагрузка новых строк CSV против полной перезагрузки")
+    ingest.add_argument('--scale', type=int, default=50, help="Во сколько раз размножить демо данные")
+    ingest.add_argument('--append-rows', type=int, default=1000, help="Сколько строк дописать")
+    ingest.add_argument('--output', help="Путь к JSON отчету")
+    ingest.set_defaults(func=benchmark_ingest)
+
+    shard = subparsers.add_parser('shard', help="SQLTester в пуле процессов против последовательного прогона")
+    shard.add_argument('--db', default='freelancer_earnings.db', help="Путь к базе данных")
+    shard.add_argument('--workers', type=int, nargs='+', default=[2, 4], help="Число процессов")
+    shard.add_argument('--recorded', help="Файл test_results_*.txt с записанными ответами")
+    shard.add_argument('--latency', type=float, default=0.2, help="Фиксированная задержка ответа, с")
+    shard.add_argument('--jitter', type=float, default=0.0, help="Случайный разброс задержки, с")
+    shard.add_argument('--per-token-latency', type=float, default=0.0, help="Задержка на токен ответа, с")
+    shard.add_argument('--latency-scale', type=float, default=1.0, help="Множитель записанных задержек")
+    shard.add_argument('--seed', type=int, default=0, help="Seed генератора задержек")
+    shard.add_argument('--output', help="Путь к JSON отчету")
+    shard.set_defaults(func=benchmark_shard)
+
+    startup = subparsers.add_parser('startup', help="Время запуска main.py и загруженные тяжелые модули")
+    startup.add_argument('--repeat', type=int, default=5, help="Число повторных запусков")
+    startup.add_argument('--output', help="Путь к JSON отчету")
+    startup.set_defaults(func=benchmark_startup)
+
+    pragmas = subparsers.add_parser('pragmas', help="PRAGMA и ANALYZE против настроек SQLite по умолчанию")
+    pragmas.add_argument('--scale', type=int, default=50, help="Во сколько раз размножить демо данные")
+    pragmas.add_argument('--repeat', type=int, default=5, help="Число повторов каждого запроса")
+    pragmas.add_argument('--output', help="Путь к JSON отчету")
+    pragmas.set_defaults(func=benchmark_pragmas)
+
+    storage = subparsers.add_parser('storage', help="Типизированная схема со словарями против таблицы to_sql")
+    storage.add_argument('--scale', type=int, default=50, help="Во сколько раз размножить демо данные")
+    storage.add_argument('--repeat', type=int, default=5, help="Число повторов каждого запроса")
+    storage.add_argument('--output', help="Путь к JSON отчету")
+    storage.set_defaults(func=benchmark_storage)
+
+    report = subparsers.add_parser('report', help="Сбор и вывод отчета SQLTester на больших наборах")
+    report.add_argument('--results', type=int, nargs='+', default=[1000, 10000, 50000], help="Число результатов")
+    report.add_argument('--failure-rate', type=float, default=0.1, help="Доля неуспешных тестов")
+    report.add_argument('--repeat', type=int, default=3, help="Число повторов замера")
+    report.add_argument('--seed', type=int, default=0, help="Seed генератора результатов")
+    report.add_argument('--output', help="Путь к JSON отчету")
+    report.set_defaults(func=benchmark_report)
+
+    coalesce = subparsers.add_parser('coalesce', help="Объединение одинаковых одновременных запросов к модели")
+    coalesce.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16], help="Число одновременных клиентов")
+    coalesce.add_argument('--questions', type=int, default=len(TEST_CASES), help="Число вопросов TEST_CASES")
+    coalesce.add_argument('--overlap', type=float, default=1.0,
+                          help="Доля клиентов, задающих вопросы в одном порядке (остальные - со сдвигом)")
+    coalesce.add_argument('--latency', type=float, default=0.2, help="Задержка ответа модели, с")
+    coalesce.add_argument('--jitter', type=float, default=0.05, help="Случайный разброс задержки, с")
+    coalesce.add_argument('--seed', type=int, default=0, help="Seed разброса задержки")
+    coalesce.add_argument('--output', help="Путь к JSON отчету")
+    coalesce.set_defaults(func=benchmark_coalesce)
+
+    hedge = subparsers.add_parser('hedge', help="Срок ответа, дублирование запросов и размыкатель цепи")
+    hedge.add_argument('--requests', type=int, default=200, help="Число последовательных запросов")
+    hedge.add_argument('--latency', type=float, default=0.05, help="Задержка ответа модели, с")
+    hedge.add_argument('--jitter', type=float, default=0.02, help="Случайный разброс задержки, с")
+    hedge.add_argument('--tail-rate', type=float, default=0.05, help="Доля медленных ответов")
+    hedge.add_argument('--tail-latency', type=float, default=1.0, help="Дополнительная задержка медленных ответов, с")
+    hedge.add_argument('--deadline', type=float, default=10.0, help="Срок ответа, с")
+    hedge.add_argument('--min-samples', type=int, default=20, help="Задержек до расчета p95 для дублирования")
+    hedge.add_argument('--failure-threshold', type=int, default=5, help="Ошибок подряд до размыкания цепи")
+    hedge.add_argument('--reset-timeout', type=float, default=1.0, help="Пауза до пробного вызова, с")
+    hedge.add_argument('--seed', type=int, default=0, help="Seed разброса задержки")
+    hedge.add_argument('--output', help="Путь к JSON отчету")
+    hedge.set_defaults(func=benchmark_hedge)
+
+    tokens = subparsers.add_parser('tokens', help="Учет токенов по компонентам промта и бюджет промта")
+    tokens.add_argument('--db', default='freelancer_earnings.db', help="Путь к базе данных")
+    tokens.add_argument('--budget', type=int, nargs='*', default=[1500, 1200],
+                        help="Бюджеты токенов промта (прогон без бюджета выполняется всегда)")
+    tokens.add_argument('--prompt-mode', default='static', choices=('static', 'retrieval'), help="Режим промта")
+    tokens.add_argument('--recorded', help="Файл test_results_*.txt с записанными ответами")
+    tokens.add_argument('--latency', type=float, default=0.0, help="Фиксированная задержка ответа, с")
+    tokens.add_argument('--jitter', type=float, default=0.0, help="Случайный разброс задержки, с")
+    tokens.add_argument('--per-token-latency', type=float, default=0.0, help="Задержка на токен ответа, с")
+    tokens.add_argument('--per-prompt-token-latency', type=float, default=0.00002,
+                        help="Задержка на токен промта (обработка контекста), с")
+    tokens.add_argument('--latency-scale', type=float, default=1.0, help="Множитель записанных задержек")
+    tokens.add_argument('--seed', type=int, default=0, help="Seed генератора задержек")
+    tokens.add_argument('--output', help="Путь к JSON отчету")
+    tokens.set_defaults(func=benchmark_tokens)
+
+    generation = subparsers.add_parser('generation', help="Ограничение длины ответа: max_tokens, stop, JSON")
+    generation.add_argument('--db', default='freelancer_earnings.db', help="Путь к базе данных")
+    generation.add_argument('--latency', type=float, default=0.2, help="Задержка до первого токена ответа, с")
+    generation.add_argument('--jitter', type=float, default=0.0, help="Случайный разброс задержки, с")
+    generation.add_argument('--per-token-latency', type=float, default=0.005, help="Задержка на токен ответа, с")
+    generation.add_argument('--prose-tokens', type=int, default=80, help="Длина пояснения после SQL, токенов")
+    generation.add_argument('--max-tokens', type=int, default=512, help="Предел токенов ответа")
+    generation.add_argument('--seed', type=int, default=0, help="Seed генератора задержек")
+    generation.add_argument('--output', help="Путь к JSON отчету")
+    generation.set_defaults(func=benchmark_generation)
+
+    compare = subparsers.add_parser('compare', help="Поиск регрессий между сохраненными прогонами тестов")
+    compare.add_argument('--history', default='test_history.db', help="Путь к базе истории прогонов")
+    compare.add_argument('--baseline', type=int, nargs='+',
+                         help="Номера базовых прогонов (по умолчанию - предпоследний)")
+    compare.add_argument('--candidate', type=int, help="Номер проверяемого прогона (по умолчанию - последний)")
+    compare.add_argument('--alpha', type=float, default=0.05, help="Уровень значимости")
+    compare.add_argument('--latency-threshold', type=float, default=0.1,
+                         help="Минимальный относительный рост медианы задержки")
+    compare.add_argument('--accuracy-threshold', type=float, default=0.0,
+                         help="Минимальное падение доли успешных тестов")
+    compare.add_argument('--list', action='store_true', help="Показать последние прогоны")
+    compare.add_argument('--output', help="Путь к JSON отчету")
+    compare.set_defaults(func=compare_runs)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Объединяемые сводки колонок для инкрементального обновления статистики таблиц
+"""
+
+import hashlib
+import heapq
+import math
+import struct
+from collections import Counter
+
+
+def _value_key(value):
+    """Байтовое представление значения для хеширования (1 и 1.0 совпадают, как в SQLite)"""
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 63:
+        value = int(value)
+    if isinstance(value, int):
+        return b'i' + str(value).encode()
+    if isinstance(value, float):
+        return b'f' + struct.pack('<d', value)
+    if isinstance(value, bytes):
+        return b'b' + value
+    return b's' + str(value).encode('utf-8')
+
+
+class KMVSketch:
+    """
+    Скетч k минимальных значений хеша для оценки числа уникальных значений.
+
+    Пока уникальных значений меньше k, оценка точная. Скетч объединения
+    двух наборов равен объединению их скетчей, поэтому скетч, обновляемый
+    порциями, совпадает с посчитанным заново по всей таблице.
+    """
+
+    HASH_SPACE = float(2 ** 64)
+
+    def __init__(self, k=1024):
+        self.k = k
+        self._heap = []  # max-куча по хешу (хранится с обратным знаком)
+        self._hashes = set()
+
+    @staticmethod
+    def hash_value(value):
+        digest = hashlib.blake2b(_value_key(value), digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    def add_hash(self, value_hash):
+        if value_hash in self._hashes:
+            return
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, -value_hash)
+            self._hashes.add(value_hash)
+        elif value_hash < -self._heap[0]:
+            removed = -heapq.heapreplace(self._heap, -value_hash)
+            self._hashes.discard(removed)
+            self._hashes.add(value_hash)
+
+    def add(self, value):
+        self.add_hash(self.hash_value(value))
+
+    def merge(self, other):
+        """Добавляет к скетчу другой скетч с тем же k"""
+        if other.k != self.k:
+            raise ValueError("Нельзя объединить скетчи с разным k")
+        for value_hash in other._hashes:
+            self.add_hash(value_hash)
+        return self
+
+    def estimate(self):
+        """Оценка числа уникальных значений"""
+        if len(self._hashes) < self.k:
+            return len(self._hashes)
+        kth = -self._heap[0]
+        return int(round((self.k - 1) * self.HASH_SPACE / (kth + 1)))
+
+    def __eq__(self, other):
+        return isinstance(other, KMVSketch) and self.k == other.k and self._hashes == other._hashes
+
+
+class ColumnSummary:
+    """
+    Объединяемая сводка значений колонки: число значений, сумма, минимум и
+    максимум (для числовых), частоты значений (пока уникальных не больше
+    max_tracked) и KMV-скетч уникальных значений.
+
+    merge() сводки новой порции дает тот же результат, что и сводка,
+    посчитанная по всей таблице заново (сумма - с точностью до округления).
+    """
+
+    def __init__(self, is_numeric, max_tracked=1000, sketch_size=1024):
+        self.is_numeric = is_numeric
+        self.max_tracked = max_tracked
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.frequencies = Counter()
+        self.sketch = KMVSketch(sketch_size)
+
+    @classmethod
+    def from_values(cls, values, is_numeric, max_tracked=1000, sketch_size=1024):
+        """Строит сводку по значениям колонки (NULL пропускаются)"""
+        summary = cls(is_numeric, max_tracked, sketch_size)
+        summary.add_values(values)
+        return summary
+
+    def add_values(self, values):
+        values = [v for v in values if v is not None]
+        if not values:
+            return self
+
+        self.count += len(values)
+        if self.is_numeric:
+            numbers = [float(v) for v in values]
+            self.sum += math.fsum(numbers)
+            low, high = min(numbers), max(numbers)
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+
+        if self.frequencies is not None:
+            self.frequencies.update(values)
+            if len(self.frequencies) > self.max_tracked:
+                self.frequencies = None
+
+        for value in values:
+            self.sketch.add(value)
+        return self
+
+    def merge(self, other):
+        """Добавляет к сводке сводку другой части колонки"""
+        self.count += other.count
+        if self.is_numeric and other.count:
+            self.sum += other.sum
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+        if self.frequencies is not None and other.frequencies is not None:
+            self.frequencies.update(other.frequencies)
+            if len(self.frequencies) > self.max_tracked:
+                self.frequencies = None
+        else:
+            self.frequencies = None
+
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def unique_count(self):
+        """Точное число уникальных значений, если частоты известны, иначе оценка скетча"""
+        if self.frequencies is not None:
+            return len(self.frequencies)
+        return self.sketch.estimate()
+
+    def differences(self, other):
+        """Список расхождений с другой сводкой (пустой - сводки совпадают)"""
+        problems = []
+        for field in ('count', 'min', 'max'):
+            if getattr(self, field) != getattr(other, field):
+                problems.append(f"{field}: {getattr(self, field)} != {getattr(other, field)}")
+        if not math.isclose(self.sum, other.sum, rel_tol=1e-9, abs_tol=1e-9):
+            problems.append(f"sum: {self.sum} != {other.sum}")
+        if self.frequencies != other.frequencies:
+            problems.append("frequencies")
+        if self.sketch != other.sketch:
+            problems.append("sketch")
+        return problems
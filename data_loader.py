@@ -0,0 +1,272 @@
+"""
+Загрузка CSV в SQLite: полная перезагрузка или дозагрузка только новых строк
+
+Выгрузка-источник только дописывает строки в конец CSV, поэтому при
+повторном запуске достаточно прочитать файл с места, где остановилась
+прошлая загрузка. Состояние (смещение в байтах, заголовок, последний ключ,
+контрольная сумма блоков загруженной части) хранится в таблице _ingest_state
+той же базы. Если заголовок или уже загруженная часть файла изменились,
+таблица перезагружается целиком.
+
+Загруженная часть проверяется выборочно: начало, конец и SAMPLE_BLOCKS
+блоков по CHECK_BYTES байт, равномерно распределенных между ними. Перезапись
+выгрузки (удаленные или вставленные строки сдвигают все последующие байты)
+обнаруживается, а правка значения той же длины вне проверяемых блоков - нет;
+для такого случая есть режим полной загрузки.
+
+pandas импортируется только когда есть строки для загрузки: запуск с
+неизменившимся CSV обходится без него. Схему таблицы (типизированные колонки
+и словари значений или обычная таблица) создает модуль storage.
+"""
+
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from db import update_statistics
+from storage import create_storage, frame_rows, insert_rows, physical_table, storage_layout, typed_storage_enabled
+
+
+STATE_TABLE = '_ingest_state'
+CHECK_BYTES = 4096
+SAMPLE_BLOCKS = 16
+TAIL_WINDOW = 65536
+ANALYZE_CHANGE = 0.1  # доля новых строк, после которой статистика ANALYZE пересобирается
+
+
+def _quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _ensure_state_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            csv_path TEXT NOT NULL,
+            header TEXT NOT NULL,
+            key_column TEXT,
+            byte_offset INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            last_key TEXT,
+            checksum TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )
+    """)
+
+
+def _read_state(conn, table):
+    _ensure_state_table(conn)
+    cursor = conn.execute(f"SELECT * FROM {STATE_TABLE} WHERE table_name = ?", (table,))
+    row = cursor.fetchone()
+    return dict(zip([d[0] for d in cursor.description], row)) if row else None
+
+
+def get_data_version(conn, table=None):
+    """
+    Счетчик изменений таблицы: растет при каждой загрузке, добавившей строки
+
+    Кэши, зависящие от содержимого таблицы, используют его как часть ключа
+    (SpeculativeExecutor, эталоны SQLTester). Без table - сумма счетчиков всех
+    загруженных таблиц. Таблица состояния не создается: соединение может быть
+    только для чтения.
+    """
+    where, params = ("WHERE table_name = ?", (table,)) if table is not None else ("", ())
+    try:
+        row = conn.execute(f"SELECT SUM(version) FROM {STATE_TABLE} {where}", params).fetchone()
+    except sqlite3.OperationalError:
+        return 0  # загрузок еще не было
+    return row[0] or 0
+
+
+def _loaded_checksum(f, offset):
+    """Контрольная сумма начала, конца и равномерно расположенных блоков первых offset байт"""
+    sha = hashlib.sha1()
+    starts = {0, max(0, offset - CHECK_BYTES)}
+    starts.update(offset * i // (SAMPLE_BLOCKS + 1) for i in range(1, SAMPLE_BLOCKS + 1))
+    for start in sorted(starts):
+        f.seek(start)
+        sha.update(f.read(min(CHECK_BYTES, offset - start)))
+    return sha.hexdigest()
+
+
+def _last_key(header, data, key):
+    """Ключ последней строки в data (байты, заканчивающиеся целыми строками CSV) или None"""
+    data = data.rstrip(b'\r\n')
+    lines = data[-TAIL_WINDOW:].rsplit(b'\n', 1)
+    if len(lines) < 2 and len(data) >= TAIL_WINDOW:
+        return None  # строка длиннее окна - ключ не проверяем
+    if not lines[-1].strip():
+        return None
+    rows = list(csv.reader(io.StringIO((header + lines[-1]).decode('utf-8', 'replace'))))
+    columns = [c.strip() for c in rows[0]]
+    if key not in columns or len(rows) < 2 or len(rows[-1]) != len(columns):
+        return None
+    return rows[-1][columns.index(key)]
+
+
+def _check_loaded_part(f, size, header, state, key):
+    """Причина полной перезагрузки или None, если загруженная часть файла не изменилась"""
+    offset = state['byte_offset']
+    if size < offset:
+        return "файл стал короче"
+    if header.decode('utf-8', 'replace') != state['header']:
+        return "изменился заголовок"
+    if _loaded_checksum(f, offset) != state['checksum']:
+        return "изменились ранее загруженные строки"
+    if state['last_key'] is not None and offset > len(header):
+        start = max(len(header), offset - TAIL_WINDOW)
+        f.seek(start)
+        if _last_key(header, f.read(offset - start), key) not in (None, state['last_key']):
+            return "изменился ключ последней загруженной строки"
+    return None
+
+
+def ingest_csv(conn, table, csv_path, key=None, mode='delta', typed=None, on_rows=None):
+    """
+    Загружает CSV в таблицу
+
+    В режиме 'delta' читаются только строки, дописанные после прошлой
+    загрузки, и добавляются в таблицу одной транзакцией вместе с
+    обновлением состояния. Незавершенная последняя строка (без перевода
+    строки) в обоих режимах откладывается до следующей загрузки.
+
+    Args:
+        conn: соединение SQLite
+        table (str): имя таблицы
+        csv_path (str): путь к CSV файлу
+        key (str or None): колонка-ключ для проверки последней строки (по умолчанию первая)
+        mode (str): 'delta' - дозагрузка, 'full' - полная перезагрузка
+        typed (bool or None): типизированная схема хранения (None - по TYPED_STORAGE);
+            если схема таблицы другая, таблица перезагружается целиком
+        on_rows (callable or None): вызывается с дозагруженными строками (кортежи в
+            порядке колонок) после фиксации транзакции, например TableAnalyzer.append_rows;
+            после полной загрузки не вызывается
+
+    Returns:
+        dict: mode ('full', 'delta', 'unchanged'), reason, rows, total_rows,
+            bytes_read, seconds, version, analyzed (обновлена ли статистика ANALYZE)
+    """
+    start = time.perf_counter()
+    typed = typed_storage_enabled() if typed is None else typed
+    state = _read_state(conn, table)
+
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        size = os.fstat(f.fileno()).st_size
+        key = key or header.decode('utf-8').strip().split(',')[0].strip('"')
+
+        reason = None
+        if mode != 'delta':
+            reason = "запрошена полная загрузка"
+        elif state is None:
+            reason = "нет состояния прошлой загрузки"
+        elif state['csv_path'] != os.path.abspath(csv_path) or state['key_column'] != key:
+            reason = "изменился источник"
+        elif storage_layout(conn, table) != ('typed' if typed else 'plain'):
+            reason = "изменилась схема хранения"
+        elif not _table_matches(conn, table, state['row_count']):
+            reason = "таблица не соответствует состоянию загрузки"
+        else:
+            reason = _check_loaded_part(f, size, header, state, key)
+
+        offset = len(header) if reason else state['byte_offset']
+        f.seek(offset)
+        data = f.read()
+
+    # Дописанная, но еще не завершенная строка будет загружена в следующий раз
+    # (и при полной загрузке: иначе смещение попадет в середину строки)
+    data = data[:data.rfind(b'\n') + 1]
+    if not reason and not data.strip():
+        return _stats('unchanged', None, 0, state['row_count'], 0, start, state['version'], False)
+
+    import pandas as pd
+
+    try:
+        frame = pd.read_csv(io.BytesIO(header + data)) if data.strip() else None
+    except (pd.errors.ParserError, UnicodeDecodeError, ValueError) as e:
+        if reason:
+            raise
+        return ingest_csv(conn, table, csv_path, key, mode='full', typed=typed, on_rows=on_rows) | {
+            'reason': f"ошибка разбора новых строк: {e}"}
+
+    rows = frame_rows(frame) if frame is not None else []
+    last_key = _last_key(header, data, key) if frame is not None and len(frame) else None
+    new_offset = offset + len(data)
+    version = (state['version'] if state else 0) + 1
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN")
+    try:
+        if reason:
+            create_storage(conn, table, frame if frame is not None else pd.read_csv(io.BytesIO(header)), typed)
+        insert_rows(conn, table, rows)
+
+        total_rows = len(rows) if reason else state['row_count'] + len(rows)
+        with open(csv_path, 'rb') as f:
+            checksum = _loaded_checksum(f, new_offset)
+        conn.execute(f"""
+            INSERT OR REPLACE INTO {STATE_TABLE}
+            (table_name, csv_path, header, key_column, byte_offset, row_count, last_key,
+             checksum, version, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (table, os.path.abspath(csv_path), header.decode('utf-8', 'replace'), key, new_offset, total_rows,
+              last_key if last_key is not None else (state or {}).get('last_key'),
+              checksum, version, datetime.now().strftime('%Y-%m-%dT%H:%M:%S')))
+        conn.execute("COMMIT")
+    except sqlite3.IntegrityError as e:
+        conn.execute("ROLLBACK")
+        if reason:
+            raise
+        # Значение новых строк не подходит к типу STRICT колонки - типы выбираются заново
+        return ingest_csv(conn, table, csv_path, key, mode='full', typed=typed, on_rows=on_rows) | {
+            'reason': f"новые строки не подходят к типам колонок: {e}"}
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    # Статистика планировщика: после полной загрузки - всегда, после дозагрузки -
+    # когда число строк изменилось заметно
+    analyzed = update_statistics(conn, physical_table(conn, table), min_change=0.0 if reason else ANALYZE_CHANGE)
+    if not reason and rows and on_rows is not None:
+        on_rows(rows)
+    return _stats('full' if reason else 'delta', reason, len(rows), total_rows, len(data), start, version,
+                  analyzed)
+
+
+def _table_matches(conn, table, row_count):
+    """Проверяет, что таблица существует и в ней столько строк, сколько записано в состоянии"""
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {_quote_identifier(table)}").fetchone()[0] == row_count
+    except sqlite3.Error:
+        return False
+
+
+def _stats(mode, reason, rows, total_rows, bytes_read, start, version, analyzed):
+    return {
+        'mode': mode,
+        'reason': reason,
+        'rows': rows,
+        'total_rows': total_rows,
+        'bytes_read': bytes_read,
+        'seconds': time.perf_counter() - start,
+        'version': version,
+        'analyzed': analyzed
+    }
+
+
+def format_ingest_stats(table, stats):
+    """Форматирует итог загрузки"""
+    if stats['mode'] == 'unchanged':
+        return f"Таблица {table} актуальна ({stats['total_rows']} записей, версия {stats['version']})."
+    if stats['mode'] == 'delta':
+        return (f"Таблица {table}: дозагружено {stats['rows']} новых записей "
+                f"(всего {stats['total_rows']}, прочитано {stats['bytes_read'] / 1024:.1f} КБ, "
+                f"версия {stats['version']}).")
+    return (f"Таблица {table} создана. Загружено {stats['rows']} записей"
+            f" ({stats['reason']}, версия {stats['version']}).")
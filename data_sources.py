@@ -0,0 +1,61 @@
+"""
+Описание источников данных: CSV файлы, таблицы и описания для поиска схем
+
+Описания таблиц и колонок используются индексом SchemaCatalog, чтобы в промт
+попадали только схемы, относящиеся к вопросу. Свой набор источников можно
+задать JSON файлом в переменной окружения DATA_SOURCES_FILE (тот же формат,
+что и DATA_SOURCES).
+"""
+
+import json
+import os
+
+DB_PATH = 'freelancer_earnings.db'
+PRIMARY_TABLE = 'freelancer_earnings'
+
+DATA_SOURCES = [
+    {
+        'table': 'freelancer_earnings',
+        'csv': 'freelancer_earnings_bd.csv',
+        'key': 'Freelancer_ID',
+        'description': 'Фрилансеры: заработок, платформы, категории работ, опыт, регионы клиентов и способы оплаты',
+        'columns': {
+            'Freelancer_ID': 'идентификатор фрилансера',
+            'Job_Category': 'категория работ, специализация',
+            'Platform': 'платформа, биржа фриланса',
+            'Experience_Level': 'уровень опыта: начинающий, средний, эксперт',
+            'Client_Region': 'регион клиента, страна',
+            'Payment_Method': 'способ оплаты: криптовалюта, PayPal, банковский перевод',
+            'Job_Completed': 'количество выполненных проектов',
+            'Earnings_USD': 'заработок, доход в долларах',
+            'Hourly_Rate': 'почасовая ставка',
+            'Job_Success_Rate': 'процент успешных проектов',
+            'Client_Rating': 'рейтинг клиентов',
+            'Job_Duration_Days': 'продолжительность проекта в днях',
+            'Project_Type': 'тип проекта: фиксированная или почасовая оплата',
+            'Rehire_Rate': 'процент повторного найма',
+            'Marketing_Spend': 'расходы на маркетинг'
+        }
+    }
+]
+
+
+def get_data_sources():
+    """Возвращает список источников данных (из DATA_SOURCES_FILE, если задан)"""
+    path = os.environ.get('DATA_SOURCES_FILE')
+    if not path:
+        return DATA_SOURCES
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def get_table_descriptions(sources=None):
+    """Возвращает описания таблиц в формате {таблица: {'description', 'columns'}}"""
+    return {
+        source['table']: {
+            'description': source.get('description', ''),
+            'columns': source.get('columns', {})
+        }
+        for source in (sources if sources is not None else get_data_sources())
+    }
@@ -0,0 +1,122 @@
+"""
+Фабрика соединений SQLite с настройками производительности
+
+Все соединения приложения открываются через open_connection(): размер кэша
+страниц и отображение файла в память (mmap) задаются через PRAGMA.
+Соединение загрузчика дополнительно переводится в режим WAL. После загрузки
+данных update_statistics() собирает статистику sqlite_stat1 для планировщика
+запросов.
+
+Значения по умолчанию переопределяются переменной окружения SQLITE_PRAGMAS
+(например, "cache_size=-131072,mmap_size=0,temp_store=MEMORY"), SQLITE_TUNING=0
+отключает настройку.
+"""
+
+import os
+import re
+import sqlite3
+
+
+# temp_store=MEMORY не включен: сортировка GROUP BY запросов TEST_CASES с ним
+# на 10-30% медленнее (benchmark.py pragmas); его можно задать через SQLITE_PRAGMAS
+DEFAULT_PRAGMAS = {
+    'cache_size': -65536,      # 64 МБ (отрицательное значение - размер в КБ)
+    'mmap_size': 268435456     # 256 МБ
+}
+
+# Загрузчик пишет в WAL: читатели (например, спекулятивное выполнение) не блокируются
+LOADER_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL'
+}
+
+_PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+_PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def _quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def get_pragmas(overrides=None, loader=False):
+    """
+    Возвращает PRAGMA для нового соединения
+
+    Args:
+        overrides (dict or None): значения, заменяющие настройки по умолчанию
+        loader (bool): добавить настройки загрузчика (WAL)
+    """
+    if os.environ.get('SQLITE_TUNING', '1') == '0':
+        return {}
+
+    pragmas = dict(LOADER_PRAGMAS) if loader else {}
+    pragmas.update(DEFAULT_PRAGMAS)
+    for item in filter(None, os.environ.get('SQLITE_PRAGMAS', '').split(',')):
+        name, _, value = item.partition('=')
+        pragmas[name.strip().lower()] = value.strip()
+    pragmas.update(overrides or {})
+    return pragmas
+
+
+def apply_pragmas(conn, pragmas):
+    """Выполняет PRAGMA name = value для каждой настройки"""
+    for name, value in pragmas.items():
+        if not _PRAGMA_NAME.match(name) or not _PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f"Недопустимая настройка SQLite: {name}={value}")
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def open_connection(path, pragmas=None, loader=False, **kwargs):
+    """
+    Открывает соединение SQLite с настройками производительности
+
+    Args:
+        path (str): путь к базе данных
+        pragmas (dict or None): значения, заменяющие настройки по умолчанию
+        loader (bool): соединение загрузчика данных (режим WAL)
+        **kwargs: аргументы sqlite3.connect (например, check_same_thread)
+    """
+    conn = sqlite3.connect(path, **kwargs)
+    try:
+        apply_pragmas(conn, get_pragmas(pragmas, loader))
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def update_statistics(conn, table=None, min_change=0.0):
+    """
+    Собирает статистику для планировщика (ANALYZE -> sqlite_stat1)
+
+    Args:
+        conn: соединение SQLite
+        table (str or None): таблица (None - вся база)
+        min_change (float): пропустить, если статистика таблицы уже есть и число
+            строк изменилось меньше чем на эту долю (для дозагрузок)
+
+    Returns:
+        bool: выполнен ли ANALYZE
+    """
+    if table is not None and min_change > 0:
+        recorded = _stat_rows(conn, table)
+        if recorded:
+            rows = conn.execute(f"SELECT COUNT(*) FROM {_quote_identifier(table)}").fetchone()[0]
+            if abs(rows - recorded) < min_change * recorded:
+                return False
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute(f"ANALYZE {_quote_identifier(table)}" if table is not None else "ANALYZE")
+    conn.commit()
+    return True
+
+
+def _stat_rows(conn, table):
+    """Число строк таблицы по sqlite_stat1 (None - статистики нет)"""
+    try:
+        row = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", (table,)).fetchone()
+    except sqlite3.Error:
+        return None  # ANALYZE еще не выполнялся
+    return int(row[0].split()[0]) if row and row[0] else None
@@ -0,0 +1,89 @@
+"""
+Подбор примеров вопрос/SQL для промта по близости к вопросу пользователя
+"""
+
+import json
+import os
+import re
+
+from test_questions_and_queries import TEST_CASES
+from text_index import TfidfIndex
+
+
+def _normalize_question(text):
+    return re.sub(r'\s+', ' ', text or '').strip().lower()
+
+
+class ExampleSelector:
+    """
+    Класс для выбора k наиболее похожих примеров для few-shot промта.
+
+    Примеры - тестовые случаи TEST_CASES и ранее успешные пары вопрос/SQL
+    (сохраняются в history_path). Поиск - TF-IDF по символьным n-граммам.
+    При leave_one_out=True пример с тем же вопросом исключается - так
+    оценка точности не завышается за счет подсказки готового ответа.
+    """
+
+    def __init__(self, examples=None, history_path='successful_examples.json', k=3, leave_one_out=False):
+        self.k = k
+        self.leave_one_out = leave_one_out
+        self.history_path = history_path
+        self.index = TfidfIndex()
+        self._history = []
+        self._known = set()
+
+        for example in (examples if examples is not None else TEST_CASES):
+            self._add(example['question'], example['expected_sql'])
+        self._load_history()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _add(self, question, sql):
+        key = _normalize_question(question)
+        if not key or key in self._known:
+            return False
+        self._known.add(key)
+        self.index.add(key, question, {'question': question, 'sql': sql})
+        return True
+
+    def _load_history(self):
+        if not self.history_path or not os.path.exists(self.history_path):
+            return
+
+        try:
+            with open(self.history_path, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Не удалось прочитать {self.history_path}: {e}")
+            return
+
+        for example in history:
+            if self._add(example['question'], example['sql']):
+                self._history.append(example)
+
+    def add_example(self, question, sql):
+        """Добавляет успешную пару вопрос/SQL и сохраняет ее в историю"""
+        if not self._add(question, sql):
+            return False
+
+        self._history.append({'question': question, 'sql': sql})
+        if self.history_path:
+            with open(self.history_path, 'w', encoding='utf-8') as f:
+                json.dump(self._history, f, ensure_ascii=False, indent=2)
+        return True
+
+    def select(self, question, k=None):
+        """Возвращает k наиболее похожих примеров [{'question', 'sql'}, ...]"""
+        exclude = None
+        if self.leave_one_out:
+            key = _normalize_question(question)
+            exclude = lambda doc_id: doc_id == key
+
+        hits = self.index.query(question, k=k or self.k, min_score=0.0, exclude=exclude)
+        return [payload for _, _, payload in hits]
+
+    @staticmethod
+    def format_examples(examples):
+        """Форматирует примеры для промта"""
+        return "\n\n".join(f"{example['question']}:\n{example['sql']}" for example in examples)
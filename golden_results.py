@@ -0,0 +1,139 @@
+"""
+Хранилище эталонных результатов тестовых запросов
+
+Результат каждого expected_sql вычисляется один раз для данного отпечатка данных
+и сохраняется в виде компактного отпечатка (ResultDigest). Тестовые прогоны
+сравнивают с ним результат сгенерированного запроса, не выполняя эталон повторно.
+Пересчет происходит только при изменении данных.
+"""
+
+import hashlib
+import json
+import os
+
+from result_compare import digest_query, is_ordered_query, tolerance_to_digits
+
+
+def compute_data_fingerprint(*paths):
+    """Вычисляет отпечаток исходных файлов данных (SHA-256 содержимого)"""
+    sha = hashlib.sha256()
+    for path in paths:
+        sha.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+    return sha.hexdigest()[:16]
+
+
+class GoldenResultStore:
+    """
+    Класс для хранения отпечатков эталонных результатов в JSON файле
+    """
+
+    def __init__(self, path='golden_results.json', float_tolerance=1e-6):
+        self.path = path
+        self.float_digits = tolerance_to_digits(float_tolerance)
+        self.fingerprint = None
+        self.entries = {}
+        self.recomputed = 0
+        self.load()
+
+    @staticmethod
+    def query_key(sql):
+        """Ключ эталона - хэш текста запроса"""
+        return hashlib.sha1(sql.strip().encode('utf-8')).hexdigest()[:16]
+
+    def load(self):
+        """Загружает хранилище с диска"""
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Не удалось прочитать {self.path}: {e}")
+            return
+
+        if data.get('float_digits') == self.float_digits:
+            self.fingerprint = data.get('fingerprint')
+            self.entries = data.get('entries', {})
+
+    def save(self):
+        """Сохраняет хранилище на диск"""
+        data = {
+            'fingerprint': self.fingerprint,
+            'float_digits': self.float_digits,
+            'entries': self.entries
+        }
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def prepare(self, conn, test_cases, fingerprint):
+        """
+        Готовит эталоны для тестовых случаев
+
+        При смене отпечатка данных все эталоны сбрасываются; отсутствующие
+        вычисляются и сохраняются. Возвращает число пересчитанных эталонов.
+        """
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            self.entries = {}
+
+        recomputed = 0
+        for test_case in test_cases:
+            sql = test_case['expected_sql']
+            key = self.query_key(sql)
+            if key in self.entries:
+                continue
+
+            ordered = is_ordered_query(sql)
+            digest, error = digest_query(conn, sql, ordered, self.float_digits)
+            self.entries[key] = {
+                'test_id': test_case.get('id'),
+                'ordered': ordered,
+                'digest': digest.hexdigest() if digest else None,
+                'rows': digest.count if digest else 0,
+                'error': error
+            }
+            recomputed += 1
+
+        if recomputed:
+            self.save()
+        self.recomputed = recomputed
+        return recomputed
+
+    def get(self, expected_sql):
+        """Возвращает запись эталона или None"""
+        return self.entries.get(self.query_key(expected_sql))
+
+    def compare(self, conn, generated_sql, expected_sql):
+        """
+        Сравнивает результат сгенерированного запроса с сохраненным эталоном
+
+        Returns:
+            dict or None: результат в формате compare_query_results или None,
+            если эталон для запроса не подготовлен
+        """
+        entry = self.get(expected_sql)
+        if entry is None:
+            return None
+
+        digest, error = digest_query(conn, generated_sql, entry['ordered'], self.float_digits)
+        result = {
+            'equivalent': False,
+            'ordered': entry['ordered'],
+            'rows_compared': min(digest.count, entry['rows']) if digest else 0,
+            'reason': None,
+            'generated_error': error,
+            'expected_error': entry['error']
+        }
+
+        if digest is None or entry['digest'] is None:
+            result['reason'] = 'execution_error'
+        else:
+            result['equivalent'] = digest.hexdigest() == entry['digest']
+            if not result['equivalent']:
+                result['reason'] = 'row_count' if digest.count != entry['rows'] else 'values'
+
+        return result
@@ -0,0 +1,491 @@
+"""
+Маршрутизатор типовых вопросов: готовый параметризованный SQL без обращения к GigaChat
+"""
+
+import re
+from collections import deque
+
+
+class AhoCorasick:
+    """
+    Автомат Ахо-Корасик: поиск всех вхождений набора строк за один проход по тексту.
+
+    Каждой строке сопоставляется произвольная полезная нагрузка, которую
+    возвращает iter_matches() вместе с позициями вхождения.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._built = False
+
+    def __len__(self):
+        return sum(len(out) for out in self._out)
+
+    def add(self, pattern, payload):
+        """Добавляет строку поиска"""
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(pattern), payload))
+        self._built = False
+
+    def build(self):
+        """Строит суффиксные ссылки (обход в ширину)"""
+        queue = deque(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+
+    def iter_matches(self, text):
+        """Возвращает вхождения (начало, конец, нагрузка) в порядке окончания"""
+        if not self._built:
+            self.build()
+
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, payload in out[node]:
+                yield i + 1 - length, i + 1, payload
+
+
+class RouteMatch:
+    """Распознанный вопрос: имя шаблона, SQL с плейсхолдерами '?' и параметры"""
+
+    def __init__(self, intent, sql, params):
+        self.intent = intent
+        self.sql = sql
+        self.params = list(params)
+
+    @property
+    def inline_sql(self):
+        """SQL с подставленными значениями параметров (для вывода и истории диалога)"""
+        params = iter(self.params)
+        return re.sub(r'\?', lambda _: _sql_literal(next(params)), self.sql)
+
+    def __repr__(self):
+        return f"RouteMatch({self.intent!r}, {self.inline_sql!r})"
+
+
+def _sql_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+
+def _parse_number(text):
+    value = float(text.replace(',', '.'))
+    return int(value) if value.is_integer() else value
+
+
+class IntentRouter:
+    """
+    Класс для ответа на типовые вопросы по шаблонам SQL без вызова GigaChat.
+
+    Вопрос просматривается одним проходом автомата Ахо-Корасик по основам слов:
+    агрегаты (средн, сколько, процент...), метрики (заработ, рейтинг...),
+    группировки (по платформам, в каждом регионе...), сравнения (выше 50) и
+    значения категориальных колонок из column_info (Upwork, эксперт -> Expert).
+    Если слоты однозначно складываются в один из шаблонов, возвращается
+    параметризованный SQL; при любой неоднозначности (неизвестное число,
+    отрицание, две группировки, два значения одной колонки, сущность без
+    группировки - "сколько платформ", "какой регион") - None, и вопрос
+    уходит в GigaChat.
+    """
+
+    KEYWORDS = {
+        'средн': 'avg',
+        'минимальн': 'min', 'наименьш': 'min',
+        'максимальн': 'max', 'наибольш': 'max',
+        'самым высок': 'max', 'самый высок': 'max', 'самой высок': 'max', 'самого высок': 'max',
+        'сколько': 'count',
+        'процент': 'percent', 'доля': 'percent', 'долю': 'percent',
+        'распредел': 'distribution',
+        'сравн': 'compare', 'насколько': 'compare',
+        'топ': 'top', 'лучш': 'top',
+        'фрилансер': 'subject'
+    }
+
+    METRICS = {
+        'заработ': 'Earnings_USD', 'доход': 'Earnings_USD',
+        'рейтинг': 'Client_Rating',
+        'ставк': 'Hourly_Rate',
+        'выполн': 'Job_Completed',
+        'продолжительн': 'Job_Duration_Days', 'длительн': 'Job_Duration_Days',
+        'маркетинг': 'Marketing_Spend',
+        'повторн': 'Rehire_Rate',
+        'успех': 'Job_Success_Rate', 'успеш': 'Job_Success_Rate'
+    }
+
+    # Короткие имена метрик для псевдонимов (Average_Earnings, Max_Rating...)
+    METRIC_ALIASES = {
+        'Earnings_USD': 'Earnings',
+        'Client_Rating': 'Rating',
+        'Hourly_Rate': 'Hourly_Rate',
+        'Job_Completed': 'Projects',
+        'Job_Duration_Days': 'Duration',
+        'Marketing_Spend': 'Marketing',
+        'Rehire_Rate': 'Rehire_Rate',
+        'Job_Success_Rate': 'Success_Rate'
+    }
+
+    # Единица измерения после числа однозначно задает метрику: "более 100 проектов"
+    UNITS = {
+        'проект': 'Job_Completed',
+        'дн': 'Job_Duration_Days', 'ден': 'Job_Duration_Days'
+    }
+
+    ENTITIES = {
+        'платформ': 'Platform',
+        'категори': 'Job_Category',
+        'регион': 'Client_Region',
+        'уровн': 'Experience_Level', 'опыт': 'Experience_Level',
+        'оплат': 'Payment_Method'
+    }
+
+    COMPARATORS = {
+        'выше': '>', 'более': '>', 'больше': '>', 'свыше': '>',
+        'ниже': '<', 'менее': '<', 'меньше': '<'
+    }
+
+    VALUE_ALIASES = {
+        'эксперт': 'Expert', 'начинающ': 'Beginner', 'новичк': 'Beginner',
+        'крипт': 'Crypto', 'банковск': 'Bank Transfer', 'мобильн': 'Mobile Banking',
+        'фиксирован': 'Fixed',
+        'ази': 'Asia', 'европ': 'Europe', 'австрали': 'Australia', 'канад': 'Canada',
+        'сша': 'USA', 'америк': 'USA', 'великобритан': 'UK', 'ближн': 'Middle East'
+    }
+
+    # Слова, которые шаблоны не выражают: такие вопросы всегда уходят в GigaChat
+    # ("всего" - обычно сумма метрики, а не число строк)
+    BLOCK_WORDS = ('не', 'нет', 'без', 'или', 'ни', 'всего')
+    BLOCK_STEMS = ('кроме', 'исключ', 'медиан', 'корреляц', 'год', 'месяц', 'динамик', 'тренд',
+                   'отношени', 'сумм', 'итог')
+
+    GROUP_MARKERS = ('по', 'каждой', 'каждом', 'каждому', 'каждого', 'каждая', 'каждый', 'от')
+
+    DEFAULT_LIMIT = 10
+    MAX_CATEGORY_VALUES = 50
+
+    def __init__(self, table_name, column_info):
+        self.table_name = table_name
+        self.column_info = column_info
+        self.automaton = AhoCorasick()
+        self._compile()
+
+    def _compile(self):
+        """Собирает автомат из основ слов и значений колонок"""
+        columns = self.column_info
+        add = self.automaton.add
+
+        for stem, keyword in self.KEYWORDS.items():
+            add(stem, ('keyword', keyword))
+        for stem, column in self.METRICS.items():
+            if column in columns and columns[column]['is_numeric']:
+                add(stem, ('metric', column))
+        for stem, column in self.ENTITIES.items():
+            if column in columns:
+                add(stem, ('entity', column))
+        for stem, op in self.COMPARATORS.items():
+            add(stem, ('compare', op))
+        for word in self.BLOCK_WORDS:
+            add(word, ('block', word))
+        for stem in self.BLOCK_STEMS:
+            add(stem, ('stop', stem))
+
+        # Значения категориальных колонок: точные (Upwork, Web Development) и русские основы
+        owners = {}
+        for column, info in columns.items():
+            if info['is_numeric'] or info['unique_count'] > self.MAX_CATEGORY_VALUES:
+                continue
+            for value in info['unique_values']:
+                if isinstance(value, str) and value.strip():
+                    owners.setdefault(value, []).append(column)
+                    add(value.lower(), ('value', column, value))
+
+        for stem, value in self.VALUE_ALIASES.items():
+            if len(owners.get(value, ())) == 1:
+                add(stem, ('value', owners[value][0], value))
+
+    @staticmethod
+    def _is_word_start(text, start):
+        return start == 0 or not text[start - 1].isalnum()
+
+    def tokenize(self, question):
+        """
+        Возвращает слоты вопроса: список (начало, конец, нагрузка) без перекрытий.
+
+        Основа должна начинаться с начала слова; из перекрывающихся вхождений
+        остается самое левое и самое длинное. Точные значения колонок и
+        короткие служебные слова (не, или...) должны совпадать со словом целиком.
+        """
+        text = question.lower().replace('ё', 'е')
+        candidates = []
+        for start, end, payload in self.automaton.iter_matches(text):
+            if not self._is_word_start(text, start):
+                continue
+            whole_word = payload[0] == 'block' or (payload[0] == 'value' and payload[2].lower() == text[start:end])
+            if whole_word and end < len(text) and text[end].isalnum():
+                continue
+            candidates.append((start, end, payload))
+
+        candidates.sort(key=lambda m: (m[0], -(m[1] - m[0])))
+        tokens = []
+        last_end = 0
+        for start, end, payload in candidates:
+            if start >= last_end:
+                tokens.append((start, end, payload))
+                last_end = end
+        return text, tokens
+
+    def route(self, question):
+        """
+        Возвращает RouteMatch для типового вопроса или None
+
+        Args:
+            question (str): вопрос пользователя на естественном языке
+        """
+        if not question or not self.column_info:
+            return None
+
+        text, tokens = self.tokenize(question)
+        if any(payload[0] in ('block', 'stop') for _, _, payload in tokens):
+            return None
+
+        numbers = [(m.start(), m.end(), _parse_number(m.group()))
+                   for m in re.finditer(r'(?<![\w.,])\d+(?:[.,]\d+)?(?!\w)', text)]
+        used_numbers = set()
+
+        keywords = {}
+        for start, end, payload in tokens:
+            if payload[0] == 'keyword':
+                keywords.setdefault(payload[1], start)
+
+        metrics = [(start, end, payload[1]) for start, end, payload in tokens if payload[0] == 'metric']
+
+        # "процент успеха", "процент повторного найма" - метрика, а не доля
+        if 'percent' in keywords:
+            percent_end = next(end for start, end, payload in tokens if payload == ('keyword', 'percent'))
+            if any(re.fullmatch(r'\w*\s+', text[percent_end:start]) for start, _, _ in metrics):
+                del keywords['percent']
+
+        # Топ-N
+        limit = self.DEFAULT_LIMIT
+        top_end = None
+        if 'top' in keywords:
+            top = re.compile(r'(?:топ|лучш\w*)[\s-]*(\d+)?').match(text, keywords['top'])
+            top_end = top.end()
+            if top.group(1):
+                limit = int(top.group(1))
+                used_numbers.update(n for n in numbers if n[0] == top.start(1))
+
+        # Условия сравнения: "выше 50", "более 100 проектов"
+        conditions = []
+        bound_metrics = set()
+        for start, end, payload in tokens:
+            if payload[0] != 'compare':
+                continue
+            number = next((n for n in numbers if n[0] >= end and re.fullmatch(r'\s*', text[end:n[0]])), None)
+            if number is None:
+                continue
+            used_numbers.add(number)
+
+            unit = re.match(r'\s*%?\s*(\w+)', text[number[1]:])
+            column = None
+            if unit:
+                column = next((c for stem, c in self.UNITS.items() if unit.group(1).startswith(stem)), None)
+                if column not in self.column_info:
+                    column = None
+            if column is None:
+                nearest = min(
+                    (m for m in metrics if m not in bound_metrics),
+                    key=lambda m: start - m[1] if m[1] <= start else m[0] - number[1],
+                    default=None
+                )
+                if nearest is None:
+                    return None
+                bound_metrics.add(nearest)
+                column = nearest[2]
+            conditions.append((column, payload[1], number[2]))
+
+        if len(used_numbers) != len(numbers):
+            return None
+
+        # Два значения одной колонки ("новички и эксперты") - это группировка
+        # или IN, а не условие AND
+        values = []
+        for _, _, payload in tokens:
+            if payload[0] == 'value' and (payload[1], payload[2]) not in values:
+                if any(column == payload[1] for column, _ in values):
+                    return None
+                values.append((payload[1], payload[2]))
+
+        groups = []
+        for start, end, payload in tokens:
+            if payload[0] != 'entity':
+                continue
+            before = re.findall(r'\w+', text[:start])[-2:]
+            after_group = groups and before[-1:] == ['и']  # "по регионам и платформам"
+            after_top = top_end is not None and re.fullmatch(r'\s*', text[top_end:start])
+            if after_group or after_top or any(word in self.GROUP_MARKERS for word in before):
+                if payload[1] not in groups:
+                    groups.append(payload[1])
+            elif all(column != payload[1] for column, _ in values):
+                # "Сколько платформ", "какой регион приносит..." - COUNT(DISTINCT)
+                # или группировка с выбором строки, шаблонов для них нет; сущность
+                # рядом со своим значением ("категории Web Development") - фильтр
+                return None
+        if len(groups) > 1:
+            return None
+        group = groups[0] if groups else None
+
+        # Метрика агрегата - первая свободная метрика после ключевого слова
+        free_metrics = [m for m in metrics if m not in bound_metrics]
+
+        def metric_after(keyword):
+            position = keywords.get(keyword, 0)
+            after = [m for m in free_metrics if m[0] >= position]
+            chosen = (after or free_metrics or [None])[0]
+            return chosen[2] if chosen else None
+
+        if 'compare' in keywords:
+            return self._compare(values, metric_after('compare'), conditions, group)
+        if 'distribution' in keywords:
+            return self._distribution(group, metric_after('distribution'), values, conditions)
+        if 'percent' in keywords:
+            return self._percentage(values, conditions, group)
+
+        aggregates = [k for k in ('avg', 'min', 'max', 'count') if k in keywords]
+        if 'avg' in aggregates:
+            aggregates = ['avg']  # "сколько проектов в среднем"
+        if set(aggregates) == {'min', 'max'}:
+            aggregates = ['minmax']
+        if len(aggregates) > 1:
+            return None
+        aggregate = aggregates[0] if aggregates else None
+
+        if aggregate:
+            metric = metric_after(aggregate if aggregate != 'minmax' else 'min')
+            if group:
+                return self._group_aggregate(aggregate, metric, group, values, conditions, limit)
+            return self._scalar_aggregate(aggregate, metric, values, conditions)
+
+        if group:
+            return None
+        if 'top' in keywords:
+            metric = metric_after('top')
+            if metric is None:
+                return None
+            return self._rows('top_rows', values, conditions, metric, limit)
+        if 'subject' in keywords and conditions:
+            return self._rows('filter_rows', values, conditions, conditions[0][0], limit)
+        return None
+
+    def _where(self, values, conditions):
+        """Собирает WHERE из значений колонок и числовых условий"""
+        clauses = [f"{column} = ?" for column, _ in values] + [f"{column} {op} ?" for column, op, _ in conditions]
+        params = [value for _, value in values] + [number for _, _, number in conditions]
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _alias(self, prefix, metric):
+        return f"{prefix}_{self.METRIC_ALIASES.get(metric, metric)}"
+
+    def _rows(self, intent, values, conditions, order_by, limit):
+        where, params = self._where(values, conditions)
+        sql = f"SELECT * FROM {self.table_name}{where} ORDER BY {order_by} DESC LIMIT {limit}"
+        return RouteMatch(intent, sql, params)
+
+    def _scalar_aggregate(self, aggregate, metric, values, conditions):
+        where, params = self._where(values, conditions)
+        if aggregate == 'count':
+            return RouteMatch('count', f"SELECT COUNT(*) AS Count FROM {self.table_name}{where}", params)
+        if metric is None:
+            return None
+        if aggregate == 'minmax':
+            select = (f"ROUND(MIN({metric}), 2) AS {self._alias('Min', metric)}, "
+                      f"ROUND(MAX({metric}), 2) AS {self._alias('Max', metric)}")
+        else:
+            prefix = {'avg': 'Average', 'min': 'Min', 'max': 'Max'}[aggregate]
+            select = f"ROUND({aggregate.upper()}({metric}), 2) AS {self._alias(prefix, metric)}"
+        return RouteMatch(aggregate, f"SELECT {select} FROM {self.table_name}{where}", params)
+
+    def _group_aggregate(self, aggregate, metric, group, values, conditions, limit):
+        where, params = self._where(values, conditions)
+        if aggregate == 'count':
+            select, order = "COUNT(*) AS Count", "Count"
+        elif metric is None:
+            return None
+        elif aggregate == 'minmax':
+            order = self._alias('Max', metric)
+            select = f"ROUND(MIN({metric}), 2) AS {self._alias('Min', metric)}, ROUND(MAX({metric}), 2) AS {order}"
+        else:
+            order = self._alias({'avg': 'Average', 'min': 'Min', 'max': 'Max'}[aggregate], metric)
+            select = f"ROUND({aggregate.upper()}({metric}), 2) AS {order}"
+
+        sql = (f"SELECT {group}, {select} FROM {self.table_name}{where} "
+               f"GROUP BY {group} ORDER BY {order} DESC LIMIT {limit}")
+        return RouteMatch(f"group_{aggregate}", sql, params)
+
+    def _percentage(self, values, conditions, group):
+        """Доля строк, удовлетворяющих условию: числовое условие считается, значения фильтруют"""
+        if group:
+            return None
+        if conditions:
+            if len(conditions) != 1:
+                return None
+            column, op, number = conditions[0]
+            case, case_params = f"{column} {op} ?", [number]
+            where, params = self._where(values, [])
+        elif len(values) == 1:
+            column, value = values[0]
+            case, case_params = f"{column} = ?", [value]
+            where, params = "", []
+        else:
+            return None
+
+        sql = f"SELECT ROUND(COUNT(CASE WHEN {case} THEN 1 END) * 100.0 / COUNT(*), 2) AS Percentage FROM {self.table_name}{where}"
+        return RouteMatch('percentage', sql, case_params + params)
+
+    def _distribution(self, group, metric, values, conditions):
+        if not group or metric is None:
+            return None
+        where, params = self._where(values, conditions)
+        average = self._alias('Average', metric)
+        sql = (f"SELECT {group}, ROUND(AVG({metric}), 2) AS {average}, COUNT(*) AS Count, "
+               f"ROUND(MIN({metric}), 2) AS {self._alias('Min', metric)}, "
+               f"ROUND(MAX({metric}), 2) AS {self._alias('Max', metric)} "
+               f"FROM {self.table_name}{where} GROUP BY {group} ORDER BY {average} DESC")
+        return RouteMatch('distribution', sql, params)
+
+    def _compare(self, values, metric, conditions, group):
+        """Среднее метрики для значения колонки против всех остальных"""
+        if len(values) != 1 or metric is None or conditions or group:
+            return None
+        column, value = values[0]
+        name = re.sub(r'\W+', '_', value).strip('_')
+        this = f"AVG(CASE WHEN {column} = ? THEN {metric} END)"
+        other = f"AVG(CASE WHEN {column} != ? THEN {metric} END)"
+        sql = (f"SELECT ROUND({this}, 2) AS {name}_Avg, ROUND({other}, 2) AS Other_Avg, "
+               f"ROUND({this} - {other}, 2) AS Difference FROM {self.table_name}")
+        return RouteMatch('compare', sql, [value, value, value, value])
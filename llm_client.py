@@ -0,0 +1,517 @@
+"""
+Обертки чат-модели: объединение одинаковых одновременных запросов, сроки
+ответа, дублирующие (hedged) запросы, размыкатель цепи и ограничение длины ответа
+
+Обертки поддерживают тот же вызов invoke(messages, **kwargs), что и GigaChat,
+поэтому их можно накладывать друг на друга и на заглушку ReplayChatModel.
+"""
+
+import hashlib
+import json
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+
+# Закрывающий маркер блока кода: ищется только после открывающего маркера
+# ("```sql" или "```"), поэтому генерация останавливается сразу после запроса,
+# а не на пояснениях к нему
+SQL_STOP_SEQUENCES = ('\n```',)
+
+
+class ModelUnavailableError(Exception):
+    """Модель не ответила: истек срок ответа, ошибка вызова или цепь разомкнута"""
+
+
+class ModelTimeoutError(ModelUnavailableError):
+    """Модель не ответила до истечения срока"""
+
+
+def message_key(messages, kwargs=None):
+    """Хэш списка сообщений (тип и текст каждого) и параметров вызова"""
+    payload = [[getattr(m, 'type', type(m).__name__), getattr(m, 'content', m)] for m in messages]
+    text = json.dumps([payload, sorted((kwargs or {}).items())], ensure_ascii=False, default=repr)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    """Выполняющийся вызов модели, которого ждут одинаковые запросы"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self.waiters = 0
+
+
+class CoalescingChatModel:
+    """
+    Класс для объединения одинаковых одновременных запросов к модели (single-flight).
+
+    InMemoryCache заполняется только после завершения вызова, поэтому
+    одинаковые вопросы, заданные одновременно (несколько пользователей или
+    потоков), уходят в модель каждый отдельно. Здесь первый запрос с данным
+    хэшем сообщений вызывает модель, а одинаковые запросы, пришедшие до его
+    завершения, ждут и получают тот же ответ (или то же исключение).
+    Завершенные вызовы не запоминаются - это задача кэша модели.
+
+    Объединение работает в пределах процесса и помогает только при
+    одновременных вызовах из нескольких потоков (сервер на общей модели,
+    benchmark.py coalesce). REPL задает вопросы по одному, а рабочие процессы
+    SQLTester.run_sharded держат свои копии обертки, поэтому build_chat_model
+    добавляет ее только по LLM_COALESCE=1.
+    """
+
+    def __init__(self, llm):
+        """
+        Args:
+            llm: чат-модель с методом invoke(messages, **kwargs)
+        """
+        self.llm = llm
+        self._lock = threading.Lock()
+        self._flights = {}  # хэш сообщений -> _Flight
+        self.stats = {
+            'requests': 0,
+            'calls': 0,
+            'coalesced': 0,
+            'errors': 0,
+            'max_waiters': 0,
+            'call_time': 0.0
+        }
+
+    def __getstate__(self):
+        # Блокировку и выполняющиеся вызовы нельзя передать в другой процесс
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_flights'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Остальные атрибуты (например, имя модели) - от обернутой модели
+        if name.startswith('__') or 'llm' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    @property
+    def saved_rate(self):
+        """Доля запросов, обслуженных без отдельного вызова модели"""
+        return self.stats['coalesced'] / self.stats['requests'] if self.stats['requests'] else 0.0
+
+    def invoke(self, messages, **kwargs):
+        """Вызывает модель или дожидается такого же выполняющегося вызова"""
+        key = message_key(messages, kwargs)
+        with self._lock:
+            self.stats['requests'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+                self.stats['coalesced'] += 1
+                self.stats['max_waiters'] = max(self.stats['max_waiters'], flight.waiters)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.response
+
+        start = time.perf_counter()
+        try:
+            flight.response = self.llm.invoke(messages, **kwargs)
+            return flight.response
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                self.stats['calls'] += 1
+                self.stats['errors'] += flight.error is not None
+                self.stats['call_time'] += time.perf_counter() - start
+            flight.done.set()
+
+    def format_stats(self):
+        """Форматирует статистику объединения запросов"""
+        stats = self.stats
+        return (f"🔗 Объединение запросов к модели: запросов {stats['requests']}, "
+                f"вызовов модели {stats['calls']}, сэкономлено {stats['coalesced']} "
+                f"({self.saved_rate * 100:.1f}%), макс. ожидающих {stats['max_waiters']}, "
+                f"ошибок {stats['errors']}, время вызовов {stats['call_time']:.2f}с")
+
+
+class CircuitBreaker:
+    """
+    Класс размыкателя цепи для вызовов модели.
+
+    После failure_threshold неудачных вызовов подряд цепь размыкается: вызовы
+    сразу отклоняются, не дожидаясь сети. Через reset_timeout секунд один
+    пробный вызов проверяет модель (полуразомкнутое состояние): успех
+    замыкает цепь, неудача размыкает ее снова.
+    """
+
+    STATES = ('closed', 'open', 'half_open')
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self._probe = False
+        self._lock = threading.Lock()
+        self.stats = {'opened': 0, 'rejected': 0}
+
+    def allow(self):
+        """Можно ли выполнить вызов (в полуразомкнутом состоянии - только один пробный)"""
+        with self._lock:
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._probe = False
+            if self.state == 'closed' or (self.state == 'half_open' and not self._probe):
+                self._probe = self.state == 'half_open'
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.stats['opened'] += 1
+                self.state = 'open'
+                self.opened_at = self.clock()
+                self._probe = False
+
+
+class HedgedChatModel:
+    """
+    Класс для вызова модели со сроком ответа и дублирующими запросами.
+
+    Вызов модели выполняется в фоновом потоке. Если ответа нет дольше
+    задержки дублирования, тот же запрос отправляется еще раз (до max_hedges
+    дублей) и используется первый успешный ответ - так медленный "хвост"
+    задержек GigaChat не задерживает пользователя. Задержка дублирования по
+    умолчанию - квантиль hedge_quantile (p95) задержек последних успешных
+    вызовов; пока их меньше min_samples, запросы не дублируются. Если ответа
+    нет за deadline секунд, вызов завершается ModelTimeoutError (опоздавшие
+    ответы отбрасываются).
+
+    Неудачные вызовы учитывает CircuitBreaker: при разомкнутой цепи invoke()
+    сразу завершается ModelUnavailableError, и вызывающий код показывает
+    локальные подсказки вместо ответа модели.
+    """
+
+    def __init__(self, llm, deadline=60.0, hedge_delay=None, hedge_quantile=0.95, min_samples=20,
+                 max_hedges=1, window=200, breaker=None):
+        """
+        Args:
+            llm: чат-модель с методом invoke(messages, **kwargs)
+            deadline (float or None): срок ответа в секундах (None - без срока)
+            hedge_delay (float or None): задержка дублирования; None - по квантилю задержек
+            hedge_quantile (float): квантиль задержек для задержки дублирования
+            min_samples (int): сколько успешных вызовов нужно для расчета квантиля
+            max_hedges (int): сколько дублей можно отправить (0 - не дублировать)
+            window (int): сколько последних задержек учитывать
+            breaker (CircuitBreaker or None): размыкатель цепи (None - не используется)
+        """
+        self.llm = llm
+        self.deadline = deadline
+        self.hedge_delay = hedge_delay
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self.breaker = breaker
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'hedged': 0,
+            'hedge_wins': 0,
+            'timeouts': 0,
+            'errors': 0,
+            'rejected': 0,
+            'extra_calls': 0
+        }
+
+    def __getattr__(self, name):
+        if name.startswith('__') or 'llm' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def current_hedge_delay(self):
+        """Задержка перед отправкой дубля (None - дублирование пока не используется)"""
+        if self.max_hedges <= 0:
+            return None
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, math.ceil(self.hedge_quantile * len(latencies)) - 1)]
+
+    def _attempt(self, index, messages, kwargs, results):
+        start = time.perf_counter()
+        try:
+            results.put((index, self.llm.invoke(messages, **kwargs), None, time.perf_counter() - start))
+        except Exception as e:
+            results.put((index, None, e, time.perf_counter() - start))
+
+    def _launch(self, index, messages, kwargs, results):
+        thread = threading.Thread(target=self._attempt, args=(index, messages, kwargs, results),
+                                  name=f'llm-attempt-{index}', daemon=True)
+        thread.start()
+
+    def invoke(self, messages, **kwargs):
+        """Вызывает модель с дублированием медленных запросов и сроком ответа"""
+        with self._lock:
+            self.stats['requests'] += 1
+        if self.breaker is not None and not self.breaker.allow():
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise ModelUnavailableError("модель недоступна: цепь разомкнута после серии ошибок")
+
+        start = time.perf_counter()
+        deadline = start + self.deadline if self.deadline is not None else None
+        hedge_delay = self.current_hedge_delay()
+        results = queue.Queue()
+        messages = list(messages)  # вызывающий код дописывает в список, пока опоздавшие попытки работают
+        self._launch(0, messages, kwargs, results)
+        launched, failed = 1, 0
+
+        while True:
+            # Очередной дубль отправляется через hedge_delay после предыдущей попытки
+            next_hedge = None
+            if hedge_delay is not None and launched <= self.max_hedges:
+                next_hedge = start + hedge_delay * launched
+            moments = [t for t in (deadline, next_hedge) if t is not None]
+            timeout = max(0.0, min(moments) - time.perf_counter()) if moments else None
+            try:
+                index, response, error, latency = results.get(timeout=timeout)
+            except queue.Empty:
+                if next_hedge is not None and (deadline is None or next_hedge < deadline):
+                    self._launch(launched, messages, kwargs, results)
+                    launched += 1
+                    with self._lock:
+                        self.stats['hedged'] += launched == 2
+                        self.stats['extra_calls'] += 1
+                    continue
+                self._finish(success=False, timeout=True)
+                raise ModelTimeoutError(f"модель не ответила за {self.deadline:.1f}с") from None
+
+            if error is None:
+                self._finish(success=True, latency=latency, hedge_win=index > 0)
+                return response
+            failed += 1
+            if failed == launched:
+                self._finish(success=False)
+                raise ModelUnavailableError(f"ошибка вызова модели: {error}") from error
+
+    def _finish(self, success, latency=None, hedge_win=False, timeout=False):
+        with self._lock:
+            if success:
+                self._latencies.append(latency)
+                self.stats['hedge_wins'] += hedge_win
+            elif timeout:
+                self.stats['timeouts'] += 1
+            else:
+                self.stats['errors'] += 1
+        if self.breaker is not None:
+            if success:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def format_stats(self):
+        """Форматирует статистику сроков ответа и дублирования"""
+        stats = self.stats
+        delay = self.current_hedge_delay()
+        text = (f"⏱️ Вызовы модели: запросов {stats['requests']}, с дублем {stats['hedged']} "
+                f"(дубль быстрее {stats['hedge_wins']}, лишних вызовов {stats['extra_calls']}), "
+                f"истек срок {stats['timeouts']}, ошибок {stats['errors']}, отклонено {stats['rejected']}, "
+                f"задержка дубля {f'{delay:.2f}с' if delay is not None else 'не задана'}")
+        if self.breaker is not None:
+            text += f", цепь {self.breaker.state} (размыкалась {self.breaker.stats['opened']})"
+        return text
+
+
+class GenerationControlChatModel:
+    """
+    Класс для ограничения длины ответа модели: max_tokens и стоп-последовательности.
+
+    max_tokens передается в каждый вызов. Стоп-последовательности применяются
+    на стороне клиента и только после открывающего маркера блока кода: stop
+    модели не отличил бы закрывающий маркер от открывающего "```" и обрезал бы
+    ответ до SQL (GigaChat stop к тому же не поддерживает). Если у модели есть
+    stream(), ответ читается потоком и поток закрывается, как только в тексте
+    появилась стоп-последовательность, - так генерация пояснений после SQL не
+    оплачивается ожиданием. Ответ обрезается сразу после стоп-последовательности
+    (закрывающего маркера), блок кода остается закрытым.
+
+    Поток не проходит через кэш langchain (BaseChatModel.stream его не читает и
+    не пополняет), а при закрытом досрочно потоке теряется usage_metadata.
+    Поэтому если у модели настроен кэш (authorization_gigachat передает
+    InMemoryCache), ответ запрашивается целиком через invoke() и обрезается
+    после получения: повторный вопрос отвечается из кэша без вызова модели,
+    зато первый ответ ждет конца генерации пояснений.
+    """
+
+    def __init__(self, llm, max_tokens=512, stop=SQL_STOP_SEQUENCES, stream=True):
+        """
+        Args:
+            llm: чат-модель с методом invoke(messages, **kwargs) (и, возможно, stream)
+            max_tokens (int or None): предел токенов ответа (None - не передавать)
+            stop (tuple): стоп-последовательности (пустой кортеж - не передавать)
+            stream (bool): читать ответ потоком и останавливать его на стоп-последовательности
+                (если у модели нет кэша)
+        """
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.stop = tuple(stop or ())
+        self.stream = stream
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'streamed': 0,
+            'stopped': 0,
+            'truncated': 0
+        }
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith('__') or 'llm' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def invoke(self, messages, **kwargs):
+        """Вызывает модель с max_tokens и стоп-последовательностями"""
+        if self.max_tokens is not None:
+            kwargs.setdefault('max_tokens', self.max_tokens)
+
+        streamed = (self.stream and bool(self.stop) and callable(getattr(self.llm, 'stream', None))
+                    and not self._uses_cache())
+        if streamed:
+            response, stopped = self._stream(messages, kwargs)
+        else:
+            response = self.llm.invoke(messages, **kwargs)
+            stopped = self._cut(response)
+
+        finish_reason = (getattr(response, 'response_metadata', None) or {}).get('finish_reason')
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['streamed'] += streamed
+            self.stats['stopped'] += stopped
+            self.stats['truncated'] += finish_reason == 'length'
+        return response
+
+    def _uses_cache(self):
+        """Настроен ли у модели кэш langchain (свой или глобальный)"""
+        model = self.llm
+        get_model = getattr(model, '_get_model', None)
+        if get_model is not None:
+            model = get_model()  # LazyChatModel: модель все равно создается для этого вызова
+        cache = getattr(model, 'cache', False)
+        if cache is None or cache is True:
+            from langchain_core.globals import get_llm_cache
+            return get_llm_cache() is not None
+        return cache is not False
+
+    def _stream(self, messages, kwargs):
+        """Читает ответ потоком до стоп-последовательности; возвращает (ответ, остановлен ли поток)"""
+        longest = max(len(stop) for stop in self.stop)
+        chunks = iter(self.llm.stream(messages, **kwargs))
+        message = None
+        text = ''
+        stopped = False
+        try:
+            for chunk in chunks:
+                message = chunk if message is None else message + chunk
+                start = max(0, len(text) - longest + 1)
+                text += chunk.content
+                cut = self._find_stop(text, start)
+                if cut is not None:
+                    text = text[:cut]
+                    stopped = True
+                    break
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()  # закрывает соединение: модель больше не генерирует ответ
+
+        if message is None:
+            from langchain_core.messages import AIMessage
+            return AIMessage(content=''), False
+        message.content = text
+        return message, stopped
+
+    def _find_stop(self, text, start=0):
+        """
+        Позиция конца первой стоп-последовательности после открывающего маркера
+        блока кода в text (поиск с позиции start); None - ее еще нет
+        """
+        opening = text.find('```')
+        if opening < 0:
+            return None
+        start = max(start, opening + 3)
+        ends = [p + len(stop) for stop in self.stop for p in (text.find(stop, start),) if p >= 0]
+        return min(ends) if ends else None
+
+    def _cut(self, response):
+        """Обрезает полученный целиком ответ после стоп-последовательности; возвращает, был ли он обрезан"""
+        content = getattr(response, 'content', None)
+        cut = self._find_stop(content) if isinstance(content, str) else None
+        if cut is None:
+            return False
+        response.content = content[:cut]
+        return True
+
+    def format_stats(self):
+        """Форматирует статистику ограничения длины ответов"""
+        stats = self.stats
+        return (f"✂️ Длина ответов: запросов {stats['requests']}, max_tokens {self.max_tokens}, "
+                f"потоком {stats['streamed']}, остановлено на стоп-последовательности {stats['stopped']}, "
+                f"обрезано по max_tokens {stats['truncated']}")
+
+
+def control_generation(llm, output_format, max_tokens=512, stream=True):
+    """
+    Ограничивает длину ответов модели для формата ответа PromptBuilder.output_format
+
+    'sql' - max_tokens и остановка после закрывающего маркера блока кода,
+    'json' - только max_tokens, None - модель возвращается без обертки.
+    """
+    if output_format is None:
+        return llm
+    stop = SQL_STOP_SEQUENCES if output_format == 'sql' else ()
+    return GenerationControlChatModel(llm, max_tokens=max_tokens, stop=stop, stream=stream)
+
+
+def iter_wrappers(model):
+    """Обертки цепочки модели от внешней к внутренней"""
+    while isinstance(model, (CoalescingChatModel, HedgedChatModel, GenerationControlChatModel)):
+        yield model
+        model = model.llm
@@ -1,23 +1,43 @@
-import sqlite3
-import pandas as pd
 import os
-from langchain_core.messages import HumanMessage, SystemMessage
-from authorization import authorization_gigachat
+from authorization import LazyChatModel
+from data_loader import format_ingest_stats, ingest_csv
+from db import open_connection
+from data_sources import DB_PATH, PRIMARY_TABLE, get_data_sources, get_table_descriptions
+from llm_client import (CircuitBreaker, CoalescingChatModel, HedgedChatModel, ModelUnavailableError,
+                        control_generation, iter_wrappers)
+from metrics import pipeline_metrics
+from pagination import ResultPager
 from prompt_builder import PromptBuilder
+from query_guard import QueryCostGuard
+from result_export import EXPORT_FORMATS, export_query, format_export_stats
+from speculative import SpeculativeExecutor
 from sql_utils import extract_sql_query, execute_sql_safely, format_sql_results
+from token_usage import TokenAccountant
 
+PAGE_SIZE = 20
 
-def create_database_and_load_data():
-    """Создает базу данных SQLite и загружает данные из CSV файла"""
-    if not os.path.exists('freelancer_earnings_bd.csv'):
-        print("Ошибка: файл freelancer_earnings_bd.csv не найден!")
+# pandas и langchain импортируются при первом использовании: повторный запуск
+# с готовой базой и команды вроде 'schema' обходятся без них (benchmark.py startup)
+
+
+def create_database_and_load_data(sources=None, delta=True):
+    """
+    Создает базу данных SQLite и загружает данные из CSV файлов источников
+
+    При delta=True дозагружаются только строки, дописанные в CSV после прошлого
+    запуска (если файл изменился иначе - таблица перезагружается целиком),
+    при delta=False таблица всегда перезагружается целиком.
+    """
+    sources = sources if sources is not None else get_data_sources()
+
+    primary = next((s for s in sources if s['table'] == PRIMARY_TABLE), sources[0])
+    if not os.path.exists(primary['csv']):
+        print(f"Ошибка: файл {primary['csv']} не найден!")
         return None
 
-    conn = sqlite3.connect('freelancer_earnings.db')
+    conn = open_connection(DB_PATH, loader=True)
     try:
-        df = pd.read_csv('freelancer_earnings_bd.csv')
-        df.to_sql('freelancer_earnings', conn, if_exists='replace', index=False)
-        print(f"База данных создана. Загружено {len(df)} записей.")
+        ingest_sources(conn, sources, delta)
         return conn
     except Exception as e:
         print(f"Ошибка при загрузке данных: {e}")
@@ -25,34 +45,322 @@ def create_database_and_load_data():
         return None
 
 
-def main():
-    # Создаем базу данных
-    conn = create_database_and_load_data()
-    if not conn:
-        return
+def ingest_sources(conn, sources, delta=True, catalog=None):
+    """
+    Загружает CSV файлы источников в таблицы
 
-    # Используем PromptBuilder для анализа и создания промтов
+    Если передан catalog (SchemaCatalog), профили проанализированных таблиц
+    обновляются по дозагруженным строкам (TableAnalyzer.append_rows), без
+    повторного прохода по таблице.
+
+    Returns:
+        dict: {таблица: итог ingest_csv}
+    """
+    results = {}
+    for source in sources:
+        if not os.path.exists(source['csv']):
+            print(f"⚠️ Файл {source['csv']} не найден, таблица {source['table']} пропущена")
+            continue
+
+        analyzer = catalog.analyzers.get(source['table']) if catalog is not None else None
+        on_rows = analyzer.append_rows if analyzer is not None and analyzer.column_info else None
+        with pipeline_metrics.stage('data_load'):
+            stats = ingest_csv(conn, source['table'], source['csv'], source.get('key'),
+                               mode='delta' if delta else 'full', on_rows=on_rows)
+        print(format_ingest_stats(source['table'], stats))
+        results[source['table']] = stats
+    return results
+
+
+def reload_data(conn, prompt_builder, sources=None):
+    """
+    Дозагружает строки, дописанные в CSV во время сессии (команда 'reload')
+
+    Returns:
+        bool: изменились ли данные
+    """
+    sources = sources if sources is not None else get_data_sources()
+    results = ingest_sources(conn, sources, catalog=prompt_builder.catalog)
+    modes = {stats['mode'] for stats in results.values()}
+    if modes <= {'unchanged'}:
+        return False
+    prompt_builder.refresh_analysis(reanalyze='full' in modes)
+    return True
+
+
+def get_output_format():
+    """Формат ответа модели из LLM_OUTPUT_FORMAT: 'sql' (по умолчанию), 'json' или None ('off')"""
+    output_format = os.environ.get('LLM_OUTPUT_FORMAT', 'sql')
+    return None if output_format == 'off' else output_format
+
+
+def build_chat_model(llm=None):
+    """
+    Собирает цепочку модели: срок ответа, дублирование медленных запросов и
+    размыкатель цепи -> ограничение длины ответа -> GigaChat
+
+    Объединение одинаковых запросов (CoalescingChatModel) добавляется поверх
+    цепочки только по LLM_COALESCE=1: в однопоточном REPL ему нечего объединять.
+
+    Args:
+        llm: модель (None - GigaChat, создается при первом вопросе)
+    """
+    model = control_generation(llm if llm is not None else LazyChatModel(), get_output_format(),
+                               max_tokens=int(os.environ.get('LLM_MAX_TOKENS', 512)) or None,
+                               stream=os.environ.get('LLM_STREAM', '1') != '0')
+    hedge_delay = os.environ.get('LLM_HEDGE_DELAY')
+    model = HedgedChatModel(
+        model,
+        deadline=float(os.environ.get('LLM_DEADLINE', 60)),
+        hedge_delay=float(hedge_delay) if hedge_delay else None,
+        max_hedges=0 if os.environ.get('LLM_HEDGE', '1') == '0' else 1,
+        breaker=CircuitBreaker(failure_threshold=int(os.environ.get('LLM_BREAKER_FAILURES', 5)),
+                               reset_timeout=float(os.environ.get('LLM_BREAKER_RESET', 30)))
+    )
+    if os.environ.get('LLM_COALESCE', '0') == '1':
+        model = CoalescingChatModel(model)
+    return model
+
+
+def show_local_suggestions(prompt_builder, question, reason):
+    """Выводит шаблонные подсказки PromptBuilder, когда модель недоступна"""
+    print(f"⚠️ GigaChat недоступен ({reason}). Локальные подсказки:")
+    for i, suggestion in enumerate(prompt_builder.get_improved_suggestions(question), 1):
+        print(f"  {i}. {suggestion}")
+
+
+def execute_and_show(conn, sql, params=None, display_sql=None, speculated=None, source_sql=None):
+    """
+    Выполняет запрос и выводит результат
+
+    SELECT читается постранично: в памяти только первая страница, остальные
+    выводятся командами 'next'/'prev' через возвращаемый ResultPager.
+    source_sql - исходный запрос, если sql переписан проверкой стоимости
+    (его выгружает команда 'export').
+
+    Returns:
+        tuple: (success, ResultPager или None)
+    """
+    display_sql = display_sql or sql
+    pager = None
+    has_more = False
+
+    with pipeline_metrics.stage('execute_sql'):
+        if speculated is not None:
+            success, results, columns = speculated
+            if success:
+                # Спекулятивный результат - первая страница и строка сверх нее
+                pager = ResultPager(conn, sql, params, PAGE_SIZE, first_page=results, source_sql=source_sql)
+                results, has_more = pager.page, pager.has_next
+        elif sql.upper().lstrip().startswith(('SELECT', 'WITH')):
+            try:
+                pager = ResultPager(conn, sql, params, PAGE_SIZE, source_sql=source_sql)
+                success, results, columns = True, pager.next(), pager.columns
+                has_more = pager.has_next
+            except Exception as e:
+                success, results, columns = False, str(e), []
+        else:
+            success, results, columns = execute_sql_safely(conn, sql, params)
+
+    with pipeline_metrics.stage('format_results'):
+        output = format_sql_results(success, results, columns, display_sql, PAGE_SIZE, has_more)
+    print(output)
+    return success, pager
+
+
+def process_user_query(user_input, messages, giga, conn, prompt_builder, speculator=None, cost_guard=None,
+                       token_accountant=None):
+    """
+    Обрабатывает вопрос пользователя: валидация, генерация SQL через GigaChat,
+    выполнение запроса и вывод результата
+
+    Типовые вопросы (IntentRouter) выполняются по готовому шаблону без GigaChat.
+    Если передан speculator (SpeculativeExecutor), вероятные запросы-подсказки
+    выполняются в фоне, пока GigaChat формирует ответ. Если передан cost_guard
+    (QueryCostGuard), слишком дорогие по плану запросы отклоняются или
+    выполняются с LIMIT; подсказки спекулятивного выполнения и индекс примеров
+    при этом сверяются с исходным запросом. Если передан token_accountant (TokenAccountant),
+    токены запроса учитываются по компонентам промта, а при заданном бюджете
+    промт укладывается в него за счет истории и детализации схемы.
+
+    Returns:
+        ResultPager or None: постраничный доступ к результату SELECT
+    """
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    question = user_input
+    pager = None
+
+    with pipeline_metrics.stage('routing'):
+        route = prompt_builder.route_question(user_input)
+
+    if route is not None:
+        print(f"⚡ Типовой вопрос ({route.intent}): SQL по шаблону, без обращения к GigaChat")
+        try:
+            _, pager = execute_and_show(conn, route.sql, route.params, display_sql=route.inline_sql)
+
+            # История диалога остается связной для следующих вопросов к GigaChat
+            messages.append(HumanMessage(content=user_input))
+            messages.append(AIMessage(content=f"```sql\n{route.inline_sql}\n```"))
+        except Exception as e:
+            print(f"❌ Ошибка при обработке запроса: {e}")
+        return pager
+
+    # Валидация пользовательского ввода ПЕРЕД отправкой к GigaChat
+    validation_result = None
+    if prompt_builder.is_analyzed:
+        with pipeline_metrics.stage('validation'):
+            validation_result = prompt_builder.validate_and_suggest(user_input)
+
+        if not validation_result['validation_passed']:
+            print("\n🔧 АВТОМАТИЧЕСКАЯ ОПТИМИЗАЦИЯ ЗАПРОСА:")
+            for warning in validation_result['warnings']:
+                print(f"  • {warning}")
+
+            if validation_result['suggestions']:
+                print("\n✅ ИСПОЛЬЗУЕТСЯ ОПТИМИЗИРОВАННЫЙ SQL:")
+                # Берем первый рекомендуемый запрос и используем его
+                recommended_query = validation_result['suggestions'][0]
+                print(f"  {recommended_query}")
+
+                # Заменяем пользовательский ввод на готовый SQL запрос
+                user_input = f"Выполни этот SQL запрос: {recommended_query}"
+                print("\n🚀 Запрос автоматически оптимизирован и готов к выполнению!")
+
+    try:
+        # Системный промт под вопрос: схемы нужных таблиц и похожие примеры
+        plan = None
+        if token_accountant is not None:
+            with pipeline_metrics.stage('prompt_build'):
+                history = messages[1:]
+                plan = token_accountant.fit(prompt_builder, question, history, user_input)
+                messages[:] = [SystemMessage(content=plan['system_prompt'])] + history
+        elif prompt_builder.is_question_specific:
+            with pipeline_metrics.stage('prompt_build'):
+                messages[0] = SystemMessage(content=prompt_builder.build_enhanced_system_prompt(question))
+
+        # Добавляем сообщение пользователя
+        messages.append(HumanMessage(content=user_input))
+        print("🤖 Анализирую запрос и создаю SQL...")
+
+        # Пока GigaChat отвечает, выполняем вероятные запросы в фоне
+        if speculator is not None and prompt_builder.is_analyzed:
+            candidates = (validation_result or {}).get('suggestions', []) + \
+                prompt_builder.get_improved_suggestions(question)
+            speculator.start(candidates)
+
+        # Получаем ответ от GigaChat (со сроком ответа; при недоступности - локальные подсказки)
+        try:
+            with pipeline_metrics.stage('llm_invoke'):
+                response = giga.invoke(messages)
+        except ModelUnavailableError as e:
+            messages.pop()  # вопрос без ответа не остается в истории диалога
+            show_local_suggestions(prompt_builder, question, e)
+            return pager
+        messages.append(response)
+        if plan is not None:
+            token_accountant.record(plan, response)
+
+        # Извлекаем SQL запрос
+        with pipeline_metrics.stage('extract_sql'):
+            sql_query = extract_sql_query(response.content)
+
+        # Проверяем стоимость запроса по плану выполнения
+        source_sql = sql_query
+        if sql_query and cost_guard is not None:
+            with pipeline_metrics.stage('cost_guard'):
+                decision = cost_guard.check(conn, sql_query)
+            if decision['decision'] == 'reject':
+                print(f"🛑 Запрос отклонен: {decision['reason']}")
+                print(f"📝 SQL: {sql_query}")
+                return pager
+            if decision['decision'] == 'rewrite':
+                print(f"✂️ Запрос ограничен: {decision['reason']}")
+                sql_query = decision['sql']
+
+        if sql_query:
+            # Выполняем запрос (или берем готовый результат спекулятивного выполнения)
+            speculated = speculator.lookup(source_sql) if speculator is not None else None
+            success, pager = execute_and_show(conn, sql_query, speculated=speculated, source_sql=source_sql)
+
+            # Успешная пара вопрос/SQL пополняет индекс примеров
+            if success and prompt_builder.prompt_mode == 'retrieval' and question == user_input:
+                prompt_builder.example_selector.add_example(question, source_sql)
+
+        else:
+            print("❌ Не удалось извлечь SQL запрос из ответа.")
+            print(f"🤖 Полный ответ: {response.content}")
+
+    except Exception as e:
+        print(f"❌ Ошибка при обработке запроса: {e}")
+    finally:
+        if speculator is not None:
+            speculator.cancel()
+
+    return pager
+
+
+def prepare_prompt_builder():
+    """
+    Анализирует таблицы и строит системный промт
+
+    Returns:
+        tuple: (PromptBuilder, системный промт)
+    """
     print("\nАнализирую структуру таблицы...")
-    prompt_builder = PromptBuilder('freelancer_earnings.db', 'freelancer_earnings')
+    descriptions = get_table_descriptions()
+    prompt_builder = PromptBuilder(DB_PATH, PRIMARY_TABLE, tables=list(descriptions), descriptions=descriptions,
+                                   prompt_mode=os.environ.get('PROMPT_MODE', 'static'),
+                                   use_intent_router=os.environ.get('INTENT_ROUTER', '0') == '1',
+                                   output_format=get_output_format())
 
     if prompt_builder.analyze_and_prepare():
         print("✅ Анализ завершен успешно")
         print(prompt_builder.get_table_summary())
-        enhanced_system_prompt = prompt_builder.build_enhanced_system_prompt()
+        with pipeline_metrics.stage('prompt_build'):
+            enhanced_system_prompt = prompt_builder.build_enhanced_system_prompt()
         print("Системный промт обновлен с улучшениями")
     else:
         print("⚠️ Не удалось проанализировать таблицу, используется базовый промт")
-        enhanced_system_prompt = prompt_builder.build_basic_system_prompt()
+        with pipeline_metrics.stage('prompt_build'):
+            enhanced_system_prompt = prompt_builder.build_basic_system_prompt()
 
-    # Инициализируем GigaChat
-    try:
-        giga = authorization_gigachat()
-    except Exception as e:
-        print(f"❌ Ошибка подключения к GigaChat: {e}")
-        conn.close()
+    return prompt_builder, enhanced_system_prompt
+
+
+def build_cost_guard(prompt_builder):
+    """
+    Проверка стоимости запросов по статистике таблиц (None - отключена COST_GUARD=0)
+
+    Число строк результата не ограничивается: ResultPager читает результат
+    постранично, поэтому LIMIT добавляется только к слишком дорогим запросам.
+    """
+    if not prompt_builder.is_analyzed or os.environ.get('COST_GUARD', '1') == '0':
+        return None
+    return QueryCostGuard.from_catalog(
+        prompt_builder.catalog,
+        max_cost=float(os.environ.get('QUERY_MAX_COST', 5e7)),
+        max_result_rows=None
+    )
+
+
+def main():
+    # Создаем базу данных
+    conn = create_database_and_load_data(delta=os.environ.get('DELTA_INGEST', '1') != '0')
+    if not conn:
         return
 
-    messages = [SystemMessage(content=enhanced_system_prompt)]
+    # Используем PromptBuilder для анализа и создания промтов
+    prompt_builder, enhanced_system_prompt = prepare_prompt_builder()
+
+    # GigaChat подключается при первом вопросе, которому нужна модель
+    giga = build_chat_model()
+    messages = None
+    speculator = (SpeculativeExecutor(DB_PATH, page_size=PAGE_SIZE)
+                  if os.environ.get('SPECULATIVE', '0') == '1' else None)
+    cost_guard = build_cost_guard(prompt_builder)
+    # Учет токенов по компонентам промта; LLM_PROMPT_BUDGET - бюджет промта в токенах
+    token_accountant = TokenAccountant(budget=int(os.environ.get('LLM_PROMPT_BUDGET', 0)) or None)
 
     print("\n" + "=" * 70)
     print("🚀 УЛУЧШЕННАЯ СИСТЕМА SQL-ЗАПРОСОВ ГОТОВА!")
@@ -63,9 +371,14 @@ def main():
     print("• 'examples' - примеры запросов")
     print("• 'suggest <текст>' - умные предложения")
     print("• 'validate <текст>' - валидация запроса")
+    print("• 'next' / 'prev' - следующая / предыдущая страница результата")
+    print("• 'export <формат> <файл>' - выгрузка результата (csv, jsonl, parquet)")
+    print("• 'reload' - дозагрузка строк, дописанных в CSV")
+    print("• 'stats' - задержки по этапам ('stats json <файл>' - сохранить в JSON)")
     print("• 'пока' - выход")
     print("-" * 70)
 
+    pager = None
     while True:
         user_input = input("\n💬 Ваш запрос: ").strip()
 
@@ -81,7 +394,7 @@ def main():
 📚 СПРАВКА:
 • Задавайте вопросы на естественном языке
 • Система автоматически создаст SQL запрос  
-• Доступные команды: help, schema, examples, suggest, validate, пока
+• Доступные команды: help, schema, examples, suggest, validate, next, prev, export, reload, stats, пока
 • Система знает все возможные значения в колонках
 • Новые возможности: валидация запросов и умные предложения
             """)
@@ -89,7 +402,8 @@ def main():
 
         if user_input.lower() in ['schema', 'схема']:
             print("\n📋 СТРУКТУРА ТАБЛИЦЫ:")
-            print(prompt_builder.analyzer.generate_prompt_schema())
+            for analyzer in prompt_builder.catalog.analyzers.values():
+                print(analyzer.generate_prompt_schema())
             continue
 
         if user_input.lower() in ['examples', 'примеры']:
@@ -107,6 +421,68 @@ def main():
                 print(f"  {i}. {suggestion}")
             continue
 
+        if user_input.lower() in ['next', 'далее', 'prev', 'назад']:
+            forward = user_input.lower() in ['next', 'далее']
+            if pager is None:
+                print("Нет результата для просмотра: сначала задайте вопрос.")
+            elif (pager.next() if forward else pager.prev()):
+                print(pager.format_page())
+            else:
+                print("Это последняя страница." if forward else "Это первая страница.")
+            continue
+
+        if user_input.split()[0].lower() == 'export':
+            parts = user_input.split(maxsplit=2)
+            if pager is None:
+                print("Нет результата для выгрузки: сначала задайте вопрос.")
+            elif len(parts) < 2:
+                print(f"Использование: export <формат> <файл> (форматы: {', '.join(EXPORT_FORMATS)})")
+            else:
+                fmt, path = (parts[1], parts[2]) if len(parts) == 3 else (None, parts[1])
+                try:
+                    # Выгружается исходный запрос без LIMIT для показа: файл пишется порциями,
+                    # поэтому проверяется только стоимость
+                    decision = (cost_guard.check(conn, pager.source_sql, pager.params, limit_results=False)
+                                if cost_guard is not None else None)
+                    if decision is not None and decision['decision'] == 'reject':
+                        print(f"🛑 Выгрузка отклонена: {decision['reason']}")
+                    else:
+                        print(format_export_stats(export_query(conn, pager.source_sql, path, fmt, pager.params)))
+                except Exception as e:
+                    print(f"❌ Ошибка выгрузки: {e}")
+            continue
+
+        if user_input.lower() in ['reload', 'обновить']:
+            try:
+                if reload_data(conn, prompt_builder):
+                    enhanced_system_prompt = (prompt_builder.build_enhanced_system_prompt() if prompt_builder.is_analyzed
+                                              else prompt_builder.build_basic_system_prompt())
+                    if messages is not None:
+                        from langchain_core.messages import SystemMessage
+                        messages[0] = SystemMessage(content=enhanced_system_prompt)
+                    cost_guard = build_cost_guard(prompt_builder)
+                    print("✅ Статистика таблиц и системный промт обновлены")
+            except Exception as e:
+                print(f"❌ Ошибка при загрузке данных: {e}")
+            continue
+
+        if user_input.lower() in ['stats', 'статистика']:
+            print(pipeline_metrics.format_stats())
+            if speculator is not None:
+                print(speculator.format_stats())
+            if cost_guard is not None:
+                print(cost_guard.format_stats())
+            for wrapper in iter_wrappers(giga):
+                print(wrapper.format_stats())
+            print(token_accountant.format_stats())
+            continue
+
+        if user_input.lower().startswith('stats json'):
+            stats_path = user_input[10:].strip() or 'pipeline_stats.json'
+            pipeline_metrics.dump_json(stats_path)
+            print(f"💾 Метрики сохранены в файл: {stats_path}")
+            continue
+
         if user_input.lower().startswith('validate '):
             query_text = user_input[9:]  # Убираем 'validate '
             validation_result = prompt_builder.validate_and_suggest(query_text)
@@ -126,55 +502,20 @@ def main():
                     print(f"  {i}. {suggestion}")
             continue
 
-        # Валидация пользовательского ввода ПЕРЕД отправкой к GigaChat
-        if prompt_builder.is_analyzed:
-            validation_result = prompt_builder.validate_and_suggest(user_input)
-
-            if not validation_result['validation_passed']:
-                print("\n🔧 АВТОМАТИЧЕСКАЯ ОПТИМИЗАЦИЯ ЗАПРОСА:")
-                for warning in validation_result['warnings']:
-                    print(f"  • {warning}")
-
-                if validation_result['suggestions']:
-                    print("\n✅ ИСПОЛЬЗУЕТСЯ ОПТИМИЗИРОВАННЫЙ SQL:")
-                    # Берем первый рекомендуемый запрос и используем его
-                    recommended_query = validation_result['suggestions'][0]
-                    print(f"  {recommended_query}")
-
-                    # Заменяем пользовательский ввод на готовый SQL запрос
-                    user_input = f"Выполни этот SQL запрос: {recommended_query}"
-                    print("\n🚀 Запрос автоматически оптимизирован и готов к выполнению!")
-
-        try:
-            # Добавляем сообщение пользователя
-            messages.append(HumanMessage(content=user_input))
-            print("🤖 Анализирую запрос и создаю SQL...")
-
-            # Получаем ответ от GigaChat
-            response = giga.invoke(messages)
-            messages.append(response)
-
-            # Извлекаем SQL запрос
-            sql_query = extract_sql_query(response.content)
-
-            if sql_query:
-                # Выполняем запрос
-                success, results, columns = execute_sql_safely(conn, sql_query)
-
-                # Форматируем и выводим результаты
-                output = format_sql_results(success, results, columns, sql_query)
-                print(output)
-
-            else:
-                print("❌ Не удалось извлечь SQL запрос из ответа.")
-                print(f"🤖 Полный ответ: {response.content}")
-
-        except Exception as e:
-            print(f"❌ Ошибка при обработке запроса: {e}")
+        if messages is None:
+            from langchain_core.messages import SystemMessage
+            messages = [SystemMessage(content=enhanced_system_prompt)]
+        pager = process_user_query(user_input, messages, giga, conn, prompt_builder, speculator, cost_guard,
+                                   token_accountant)
 
     # Статистика и завершение
-    user_queries = len([m for m in messages if isinstance(m, HumanMessage)])
+    user_queries = len([m for m in messages or [] if m.type == 'human'])
     print(f"\n📊 Обработано запросов: {user_queries}")
+    if token_accountant.stats['requests']:
+        print(token_accountant.format_stats())
+    if speculator is not None:
+        speculator.close()
+        print(speculator.format_stats())
     conn.close()
     print("👋 До свидания!")
 
@@ -1,28 +1,93 @@
-import sqlite3
+import contextlib
+import io
 import pandas as pd
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from langchain_core.messages import HumanMessage, SystemMessage
 from authorization import authorization_gigachat
+from data_loader import get_data_version
+from db import open_connection, update_statistics
+from example_selector import ExampleSelector
+from golden_results import GoldenResultStore, compute_data_fingerprint
+from llm_client import control_generation
+from metrics import pipeline_metrics
 from prompt_builder import PromptBuilder
-from sql_utils import extract_sql_query, execute_sql_safely, compare_sql_queries
+from result_compare import compare_query_results
+from run_history import RunHistory, hash_prompt
+from sql_utils import extract_sql_query, compare_sql_queries
+from storage import load_frame, physical_table
+from suite_report import SuiteReport
 from test_questions_and_queries import TEST_CASES, TEST_CATEGORIES
+from token_usage import TokenAccountant
+
+# Тестер рабочего процесса run_sharded(): создается один раз на процесс
+_shard_tester = None
+
+
+def _init_shard_worker(options):
+    """Инициализирует тестер в рабочем процессе: свое соединение, PromptBuilder и модель"""
+    global _shard_tester
+    tester = SQLTester(**options)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ready = tester.setup(load_data=False)
+    if not ready:
+        raise RuntimeError("Не удалось инициализировать SQLTester в рабочем процессе")
+    _shard_tester = tester
+
+
+def _run_shard(shard):
+    """
+    Выполняет часть тестов в рабочем процессе
+
+    Args:
+        shard (list): [(номер теста в наборе, тест), ...]
+
+    Returns:
+        tuple: ([(номер, результат), ...], замеры этапов {этап: LatencyHistogram})
+    """
+    pipeline_metrics.reset()
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index, test_case in shard:
+            results.append((index, _shard_tester.run_single_test(test_case)))
+            if _shard_tester.pause_between_tests:
+                time.sleep(_shard_tester.pause_between_tests)
+    return results, pipeline_metrics.histograms
 
 
 class SQLTester:
     """Класс для тестирования генерации SQL запросов"""
 
-    def __init__(self, db_path='freelancer_earnings.db', table_name='freelancer_earnings'):
+    def __init__(self, db_path='freelancer_earnings.db', table_name='freelancer_earnings',
+                 llm=None, pause_between_tests=1, golden_path='golden_results.json',
+                 prompt_mode='static', examples_k=3, token_budget=None, output_format=None, max_tokens=512):
         self.db_path = db_path
         self.table_name = table_name
         self.conn = None
+        self.llm = llm  # Готовая чат-модель (например, ReplayChatModel); иначе GigaChat
+        self.pause_between_tests = pause_between_tests
+        self.golden_path = golden_path  # None - эталоны выполняются в каждом тесте
+        self.golden_store = None
+        self.prompt_mode = prompt_mode
+        self.examples_k = examples_k
+        self.token_budget = token_budget  # бюджет токенов промта (None - без ограничения)
+        self.token_accountant = TokenAccountant(token_budget)
+        self.output_format = output_format  # формат ответа модели ('sql', 'json'; None - без ограничения длины)
+        self.max_tokens = max_tokens
         self.giga = None
         self.prompt_builder = None
         self.test_results = []
 
-    def setup(self):
-        """Инициализация всех компонентов"""
+    def setup(self, load_data=True):
+        """
+        Инициализация всех компонентов
+
+        Args:
+            load_data (bool): загрузить CSV в базу (False - база уже подготовлена,
+                например, рабочими процессами run_sharded)
+        """
         print("🔧 Инициализация тестовой системы...")
 
         # Проверяем наличие CSV файла
@@ -31,24 +96,47 @@ class SQLTester:
             return False
 
         # Создаем/подключаемся к БД
-        self.conn = sqlite3.connect(self.db_path)
-        try:
-            df = pd.read_csv('freelancer_earnings_bd.csv')
-            df.to_sql(self.table_name, self.conn, if_exists='replace', index=False)
-            print(f"✅ База данных готова. Загружено {len(df)} записей.")
-        except Exception as e:
-            print(f"❌ Ошибка при загрузке данных: {e}")
-            return False
+        self.conn = open_connection(self.db_path, loader=load_data)
+        if load_data:
+            try:
+                with pipeline_metrics.stage('data_load'):
+                    df = pd.read_csv('freelancer_earnings_bd.csv')
+                    load_frame(self.conn, self.table_name, df)
+                    update_statistics(self.conn, physical_table(self.conn, self.table_name))
+                print(f"✅ База данных готова. Загружено {len(df)} записей.")
+            except Exception as e:
+                print(f"❌ Ошибка при загрузке данных: {e}")
+                return False
+
+        # Готовим эталонные результаты (пересчет только при изменении данных)
+        if self.golden_path:
+            self.golden_store = GoldenResultStore(self.golden_path)
+            # Версия данных учитывает дозагрузки в ту же базу (data_loader.ingest_csv)
+            fingerprint = (f"{compute_data_fingerprint('freelancer_earnings_bd.csv')}"
+                           f"-v{get_data_version(self.conn, self.table_name)}")
+            recomputed = self.golden_store.prepare(self.conn, TEST_CASES, fingerprint)
+            if recomputed:
+                print(f"✅ Эталонные результаты вычислены: {recomputed}")
+            else:
+                print("✅ Эталонные результаты загружены из кэша")
 
         # Инициализируем PromptBuilder
-        self.prompt_builder = PromptBuilder(self.db_path, self.table_name)
+        # Примеры подбираются без самого тестового вопроса (leave-one-out)
+        example_selector = ExampleSelector(history_path=None, k=self.examples_k, leave_one_out=True)
+        self.prompt_builder = PromptBuilder(self.db_path, self.table_name, prompt_mode=self.prompt_mode,
+                                            example_selector=example_selector, output_format=self.output_format)
         if not self.prompt_builder.analyze_and_prepare():
             print("❌ Не удалось проанализировать таблицу")
             return False
 
         # Инициализируем GigaChat
+        if self.llm is not None:
+            self.giga = control_generation(self.llm, self.output_format, self.max_tokens)
+            print(f"✅ Используется модель {type(self.llm).__name__}")
+            return True
+
         try:
-            self.giga = authorization_gigachat()
+            self.giga = control_generation(authorization_gigachat(), self.output_format, self.max_tokens)
             print("✅ GigaChat подключен")
         except Exception as e:
             print(f"❌ Ошибка подключения к GigaChat: {e}")
@@ -60,53 +148,71 @@ class SQLTester:
         """Выполняет один тест"""
         print(f"\n📝 Тест #{test_case['id']}: {test_case['question']}")
 
-        # Создаем системный промт
-        system_prompt = self.prompt_builder.build_enhanced_system_prompt()
+        # Создаем системный промт (в пределах бюджета токенов, если он задан)
+        with pipeline_metrics.stage('prompt_build'):
+            plan = self.token_accountant.fit(self.prompt_builder, test_case['question'])
+        prompt_hash = hash_prompt(plan['system_prompt'])
         messages = [
-            SystemMessage(content=system_prompt),
+            SystemMessage(content=plan['system_prompt']),
             HumanMessage(content=test_case['question'])
         ]
 
         start_time = time.time()
+        llm_time = 0.0
+        usage = None
 
         try:
             # Отправляем запрос к GigaChat
-            response = self.giga.invoke(messages)
+            llm_start = time.perf_counter()
+            with pipeline_metrics.stage('llm_invoke'):
+                response = self.giga.invoke(messages)
+            llm_time = time.perf_counter() - llm_start
+            usage = self.token_accountant.record(plan, response)
 
             # Извлекаем SQL
-            generated_sql = extract_sql_query(response.content)
+            with pipeline_metrics.stage('extract_sql'):
+                generated_sql = extract_sql_query(response.content)
             execution_time = time.time() - start_time
 
             if not generated_sql:
                 return self._create_result(test_case, None, 'no_sql_extracted',
-                                           execution_time, 'Не удалось извлечь SQL', response.content)
+                                           execution_time, 'Не удалось извлечь SQL', response.content,
+                                           llm_time=llm_time, prompt_hash=prompt_hash, usage=usage)
 
-            # Проверяем выполнение SQL
-            expected_success, expected_result, _ = execute_sql_safely(self.conn, test_case['expected_sql'])
-            generated_success, generated_result, _ = execute_sql_safely(self.conn, generated_sql)
+            # Сравниваем результат с сохраненным эталоном, иначе выполняем оба запроса
+            with pipeline_metrics.stage('execute_sql'):
+                result_check = None
+                if self.golden_store:
+                    result_check = self.golden_store.compare(self.conn, generated_sql, test_case['expected_sql'])
+                if result_check is None:
+                    result_check = compare_query_results(self.conn, generated_sql, test_case['expected_sql'])
 
             # Сравниваем запросы
             similarity_type, similarity_score = compare_sql_queries(
-                generated_sql, test_case['expected_sql'], self.table_name
+                generated_sql, test_case['expected_sql'], self.table_name, result_check=result_check
             )
 
-            if generated_success:
+            if not result_check['generated_error']:
                 status = 'success'
                 error = None
             else:
                 status = 'sql_error'
-                error = generated_result
+                error = result_check['generated_error']
 
-            return self._create_result(test_case, generated_sql, status,
-                                       execution_time, error, response.content,
-                                       similarity_score, similarity_type)
+            result = self._create_result(test_case, generated_sql, status,
+                                         execution_time, error, response.content,
+                                         similarity_score, similarity_type, llm_time, prompt_hash, usage)
+            result['result_match'] = result_check['equivalent']
+            return result
 
         except Exception as e:
             return self._create_result(test_case, None, 'exception',
-                                       time.time() - start_time, str(e))
+                                       time.time() - start_time, str(e), llm_time=llm_time,
+                                       prompt_hash=prompt_hash, usage=usage)
 
     def _create_result(self, test_case, generated_sql, status, execution_time,
-                       error=None, raw_response='', similarity_score=0, similarity_type=''):
+                       error=None, raw_response='', similarity_score=0, similarity_type='',
+                       llm_time=0.0, prompt_hash=None, usage=None):
         """Создает словарь с результатом теста"""
         return {
             'test_id': test_case['id'],
@@ -118,8 +224,12 @@ class SQLTester:
             'similarity_score': similarity_score,
             'similarity_type': similarity_type,
             'execution_time': execution_time,
+            'llm_time': llm_time,
+            'result_match': False,
             'error': error,
-            'raw_response': raw_response
+            'raw_response': raw_response,
+            'prompt_hash': prompt_hash,
+            'usage': usage  # токены запроса (TokenAccountant.record) или None без ответа модели
         }
 
     def run_all_tests(self, test_cases=None):
@@ -141,7 +251,58 @@ class SQLTester:
             self._print_test_result(result)
 
             # Пауза между запросами
-            time.sleep(1)
+            if self.pause_between_tests:
+                time.sleep(self.pause_between_tests)
+
+        return self.test_results
+
+    def run_sharded(self, test_cases=None, workers=None):
+        """
+        Запускает тесты в пуле процессов
+
+        Тесты распределяются по процессам по кругу; у каждого процесса свое
+        соединение с базой, PromptBuilder и модель (загрузка данных и эталоны
+        готовятся в setup() основного процесса). Результаты собираются в
+        test_results в исходном порядке тестов, замеры этапов объединяются,
+        поэтому generate_report() выводит то же, что и после run_all_tests().
+        """
+        if test_cases is None:
+            test_cases = TEST_CASES
+        workers = max(1, min(workers or os.cpu_count() or 1, len(test_cases)))
+
+        print(f"\n🚀 Запуск {len(test_cases)} тестов в {workers} процессах...")
+        print("=" * 70)
+
+        options = {
+            'db_path': self.db_path,
+            'table_name': self.table_name,
+            'llm': self.llm,
+            'pause_between_tests': self.pause_between_tests,
+            'golden_path': self.golden_path,
+            'prompt_mode': self.prompt_mode,
+            'examples_k': self.examples_k,
+            'token_budget': self.token_budget,
+            'output_format': self.output_format,
+            'max_tokens': self.max_tokens
+        }
+        indexed = list(enumerate(test_cases))
+        shards = [indexed[i::workers] for i in range(workers)]
+
+        results = [None] * len(test_cases)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_shard_worker,
+                                 initargs=(options,)) as pool:
+            futures = [pool.submit(_run_shard, shard) for shard in shards]
+            for future in as_completed(futures):
+                shard_results, histograms = future.result()
+                for index, result in shard_results:
+                    results[index] = result
+                pipeline_metrics.merge(histograms)
+
+        self.test_results = results
+        for i, result in enumerate(results, 1):
+            print(f"\nПрогресс: {i}/{len(test_cases)}")
+            print(f"\n📝 Тест #{result['test_id']}: {result['question']}")
+            self._print_test_result(result)
 
         return self.test_results
 
@@ -156,237 +317,20 @@ class SQLTester:
         else:
             print(f"💥 Исключение: {result.get('error', 'Неизвестная ошибка')}")
 
+    def build_report(self):
+        """Собирает отчет по результатам тестов за один проход (SuiteReport)"""
+        return SuiteReport.from_results(self.test_results, TEST_CATEGORIES, pipeline_metrics)
+
     def generate_report(self):
         """Генерирует отчет о тестировании"""
-        if not self.test_results:
-            print("❌ Нет результатов тестирования")
-            return
+        report = self.build_report()
+        print(report.format_text())
+        return report
 
-        print("\n" + "=" * 70)
-        print("📊 ОТЧЕТ О ТЕСТИРОВАНИИ")
-        print("=" * 70)
-
-        # Общая статистика
-        total = len(self.test_results)
-        by_status = {}
-        for result in self.test_results:
-            status = result['status']
-            by_status[status] = by_status.get(status, 0) + 1
-
-        print(f"Всего тестов: {total}")
-        print(f"✅ Успешных: {by_status.get('success', 0)} ({by_status.get('success', 0) / total * 100:.1f}%)")
-        print(f"❌ Ошибки SQL: {by_status.get('sql_error', 0)} ({by_status.get('sql_error', 0) / total * 100:.1f}%)")
-        print(
-            f"⚠️ Не извлечен SQL: {by_status.get('no_sql_extracted', 0)} ({by_status.get('no_sql_extracted', 0) / total * 100:.1f}%)")
-        print(f"💥 Исключения: {by_status.get('exception', 0)} ({by_status.get('exception', 0) / total * 100:.1f}%)")
-
-        # Статистика по категориям
-        self._print_category_stats()
-
-        # Средние показатели
-        self._print_average_metrics()
-
-        # Детали неуспешных тестов
-        self._print_failed_tests()
-
-        # Дополнительный анализ
-        self._print_error_analysis()
-        self._print_success_patterns()
-
-    def _print_category_stats(self):
-        """Выводит детализированную статистику по категориям с информацией об ошибках"""
-        print(f"\n📈 ДЕТАЛИЗИРОВАННАЯ СТАТИСТИКА ПО КАТЕГОРИЯМ:")
-
-        category_stats = {}
-        category_errors = {}
-
-        # Собираем статистику и ошибки по категориям
-        for result in self.test_results:
-            cat = result['category']
-            test_id = result['test_id']
-            status = result['status']
-
-            if cat not in category_stats:
-                category_stats[cat] = {'total': 0, 'success': 0, 'failed_tests': []}
-                category_errors[cat] = {'sql_error': 0, 'no_sql_extracted': 0, 'exception': 0}
-
-            category_stats[cat]['total'] += 1
-
-            if status == 'success':
-                category_stats[cat]['success'] += 1
-            else:
-                # Записываем информацию о неудачном тесте
-                category_stats[cat]['failed_tests'].append({
-                    'test_id': test_id,
-                    'status': status,
-                    'question': result['question'][:50] + "..." if len(result['question']) > 50 else result['question']
-                })
-
-                # Подсчитываем типы ошибок
-                if status in category_errors[cat]:
-                    category_errors[cat][status] += 1
-
-        # Выводим статистику
-        perfect_categories = []
-        problematic_categories = []
-
-        for category, stats in sorted(category_stats.items()):
-            success_rate = stats['success'] / stats['total'] * 100
-            cat_name = TEST_CATEGORIES.get(category, category)
-
-            if success_rate == 100.0:
-                perfect_categories.append((cat_name, stats))
-                print(f"  ✅ {cat_name}: {stats['success']}/{stats['total']} (100.0%)")
-            else:
-                problematic_categories.append((cat_name, stats, category_errors[category]))
-                print(f"  ❌ {cat_name}: {stats['success']}/{stats['total']} ({success_rate:.1f}%)")
-
-        # Детализация проблемных категорий
-        if problematic_categories:
-            print(f"\n🚨 ДЕТАЛИ ОШИБОК ПО ПРОБЛЕМНЫМ КАТЕГОРИЯМ:")
-
-            for cat_name, stats, errors in problematic_categories:
-                print(f"\n📋 {cat_name}:")
-
-                # Типы ошибок
-                error_types = []
-                for error_type, count in errors.items():
-                    if count > 0:
-                        error_names = {
-                            'sql_error': 'Ошибки SQL выполнения',
-                            'no_sql_extracted': 'Не извлечен SQL',
-                            'exception': 'Исключения системы'
-                        }
-                        error_types.append(f"{error_names.get(error_type, error_type)}: {count}")
-
-                if error_types:
-                    print(f"    Типы ошибок: {', '.join(error_types)}")
-
-                # Список неудачных тестов
-                print(f"    Неудачные тесты:")
-                for failed_test in stats['failed_tests']:
-                    status_icons = {
-                        'sql_error': '🔴',
-                        'no_sql_extracted': '🟡',
-                        'exception': '💥'
-                    }
-                    icon = status_icons.get(failed_test['status'], '❓')
-                    print(f"      {icon} Тест #{failed_test['test_id']}: {failed_test['question']}")
-
-        # Сводка
-        total_categories = len(category_stats)
-        perfect_count = len(perfect_categories)
-
-        print(f"\n📊 СВОДКА:")
-        print(f"  Всего категорий: {total_categories}")
-        print(f"  Идеальных категорий (100%): {perfect_count}")
-        print(f"  Проблемных категорий: {len(problematic_categories)}")
-
-        if perfect_count == total_categories:
-            print(f"  🎉 ВСЕ КАТЕГОРИИ РАБОТАЮТ ИДЕАЛЬНО!")
-        else:
-            print(f"  ⚠️  Требуется внимание к {len(problematic_categories)} категориям")
-
-    def _print_average_metrics(self):
-        """Выводит средние метрики"""
-        successful_results = [r for r in self.test_results if r['status'] == 'success']
-
-        if successful_results:
-            avg_similarity = sum(r['similarity_score'] for r in successful_results) / len(successful_results)
-            avg_time = sum(r['execution_time'] for r in successful_results) / len(successful_results)
-
-            print(f"\n⚡ СРЕДНИЕ ПОКАЗАТЕЛИ:")
-            print(f"  Средняя схожесть SQL: {avg_similarity:.1f}%")
-            print(f"  Среднее время выполнения: {avg_time:.2f}с")
-
-            # Дополнительный анализ схожести
-            if avg_similarity < 85:
-                print(f"  💡 Примечание: Схожесть {avg_similarity:.1f}% означает, что система генерирует")
-                print(f"     функционально правильные, но синтаксически различающиеся SQL запросы")
-
-    def _print_failed_tests(self):
-        """Выводит детали неуспешных тестов"""
-        failed_tests = [r for r in self.test_results if r['status'] != 'success']
-
-        if failed_tests:
-            print(f"\n❌ ДЕТАЛИ НЕУСПЕШНЫХ ТЕСТОВ:")
-            for result in failed_tests:
-                print(f"\nТест #{result['test_id']}: {result['question']}")
-                print(f"  Статус: {result['status']}")
-                if result.get('error'):
-                    print(f"  Ошибка: {result['error']}")
-                if result.get('generated_sql'):
-                    print(f"  Сгенерированный SQL: {result['generated_sql']}")
-                print(f"  Ожидаемый SQL: {result['expected_sql']}")
-
-    def _print_error_analysis(self):
-        """Дополнительный метод для анализа типов ошибок"""
-        print(f"\n🔍 АНАЛИЗ ТИПОВ ОШИБОК:")
-
-        error_analysis = {}
-        for result in self.test_results:
-            if result['status'] != 'success':
-                status = result['status']
-                if status not in error_analysis:
-                    error_analysis[status] = []
-                error_analysis[status].append(result)
-
-        if not error_analysis:
-            print("  ✅ Ошибок не обнаружено!")
-            return
-
-        for error_type, failed_tests in error_analysis.items():
-            error_names = {
-                'sql_error': '🔴 Ошибки выполнения SQL',
-                'no_sql_extracted': '🟡 Не удалось извлечь SQL',
-                'exception': '💥 Системные исключения'
-            }
-
-            print(f"\n{error_names.get(error_type, error_type)} ({len(failed_tests)} тестов):")
-
-            for test in failed_tests:
-                print(f"  • Тест #{test['test_id']}: {test['question']}")
-                if test.get('error'):
-                    print(f"    Ошибка: {test['error'][:100]}...")
-                if test.get('generated_sql'):
-                    print(f"    SQL: {test['generated_sql'][:80]}...")
-
-    def _print_success_patterns(self):
-        """Анализ паттернов успешных тестов"""
-        print(f"\n🎯 АНАЛИЗ УСПЕШНЫХ ПАТТЕРНОВ:")
-
-        successful_tests = [r for r in self.test_results if r['status'] == 'success']
-
-        if not successful_tests:
-            print("  ❌ Нет успешных тестов для анализа")
-            return
-
-        # Группируем по типам запросов
-        query_patterns = {}
-        for test in successful_tests:
-            sql = test.get('generated_sql', '').upper()
-
-            if 'GROUP BY' in sql:
-                pattern = 'Группировка'
-            elif 'COUNT(' in sql and 'CASE WHEN' in sql:
-                pattern = 'Процентные расчеты'
-            elif 'AVG(' in sql or 'MIN(' in sql or 'MAX(' in sql:
-                pattern = 'Агрегация'
-            elif 'WHERE' in sql and 'ORDER BY' in sql:
-                pattern = 'Фильтрация с сортировкой'
-            elif 'ORDER BY' in sql:
-                pattern = 'Простая сортировка'
-            else:
-                pattern = 'Другое'
-
-            if pattern not in query_patterns:
-                query_patterns[pattern] = 0
-            query_patterns[pattern] += 1
-
-        print("  Успешные паттерны:")
-        for pattern, count in sorted(query_patterns.items(), key=lambda x: x[1], reverse=True):
-            percentage = count / len(successful_tests) * 100
-            print(f"    • {pattern}: {count} тестов ({percentage:.1f}%)")
+    def save_report(self, path, report=None):
+        """Сохраняет отчет в JSON или CSV (по расширению файла)"""
+        (report or self.build_report()).save(path)
+        print(f"\n💾 Отчет сохранен в файл: {path}")
 
     def save_results_to_file(self, filename=None):
         """Сохраняет результаты в файл"""
@@ -418,6 +362,19 @@ class SQLTester:
 
         print(f"\n💾 Результаты сохранены в файл: {filename}")
 
+    def save_results_to_history(self, path='test_history.db', label=None):
+        """Сохраняет результаты в историю прогонов (для benchmark.py compare)"""
+        history = RunHistory(path)
+        try:
+            model = getattr(self.giga, 'model', None) or type(self.llm if self.llm is not None else self.giga).__name__
+            run_id = history.record_run(self.test_results, model=model, prompt_mode=self.prompt_mode,
+                                        label=label)
+        finally:
+            history.close()
+
+        print(f"\n🗄 Прогон #{run_id} сохранен в историю: {path}")
+        return run_id
+
     def cleanup(self):
         """Очистка ресурсов"""
         if self.conn:
@@ -429,7 +386,10 @@ def main():
     print("🧪 СИСТЕМА ТЕСТИРОВАНИЯ SQL ГЕНЕРАЦИИ")
     print("=" * 70)
 
-    tester = SQLTester()
+    output_format = os.environ.get('LLM_OUTPUT_FORMAT', 'sql')
+    tester = SQLTester(token_budget=int(os.environ.get('LLM_PROMPT_BUDGET', 0)) or None,
+                       output_format=None if output_format == 'off' else output_format,
+                       max_tokens=int(os.environ.get('LLM_MAX_TOKENS', 512)) or None)
 
     # Инициализация
     if not tester.setup():
@@ -437,11 +397,22 @@ def main():
         return
 
     try:
-        # Запуск тестов
-        tester.run_all_tests()
+        # Запуск тестов (TEST_WORKERS > 1 - в нескольких процессах)
+        workers = int(os.environ.get('TEST_WORKERS', '1'))
+        if workers > 1:
+            tester.run_sharded(workers=workers)
+        else:
+            tester.run_all_tests()
+
+        # Генерация отчета (TEST_REPORT=report.json или report.csv - сохранить в файл)
+        report = tester.generate_report()
+        for path in filter(None, os.environ.get('TEST_REPORT', '').split(',')):
+            tester.save_report(path.strip(), report)
 
-        # Генерация отчета
-        tester.generate_report()
+        # История прогонов (TEST_HISTORY_DB='' - не сохранять)
+        history_path = os.environ.get('TEST_HISTORY_DB', 'test_history.db')
+        if history_path:
+            tester.save_results_to_history(history_path)
 
         # Сохранение результатов
         save_results = input("\nСохранить результаты в файл? (y/n): ").lower()
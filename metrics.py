@@ -0,0 +1,222 @@
+"""
+Сбор метрик задержек по этапам конвейера обработки запросов
+"""
+
+import json
+import math
+import os
+import time
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек с логарифмическими корзинами.
+
+    Память не зависит от числа замеров: значение попадает в корзину
+    с относительной шириной precision, перцентили считаются по корзинам.
+    """
+
+    MIN_VALUE = 1e-7  # 100 нс - нижняя граница первой корзины
+
+    def __init__(self, precision=0.02):
+        self.precision = precision
+        self._log_growth = math.log(1 + precision)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        """Добавляет замер (в секундах)"""
+        value = max(seconds, self.MIN_VALUE)
+        index = int(math.log(value / self.MIN_VALUE) / self._log_growth)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Добавляет замеры другой гистограммы с той же точностью"""
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, p):
+        """Возвращает приближенное значение перцентиля p (0-100)"""
+        if not self.count:
+            return 0.0
+
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Середина корзины в логарифмической шкале
+                value = self.MIN_VALUE * math.exp((index + 0.5) * self._log_growth)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """Возвращает сводку по гистограмме"""
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.min or 0.0,
+            'max': self.max or 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99)
+        }
+
+
+class _StageTimer:
+    """Контекстный менеджер замера одного этапа"""
+
+    __slots__ = ('metrics', 'stage', 'start', 'elapsed')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.start = 0.0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.perf_counter() - self.start
+        self.metrics.record(self.stage, self.elapsed)
+        return False
+
+
+class _NullTimer:
+    """Пустой таймер для выключенного сбора метрик"""
+
+    __slots__ = ()
+    elapsed = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class PipelineMetrics:
+    """
+    Класс для сбора задержек по этапам конвейера: загрузка данных, анализ,
+    маршрутизация типовых вопросов, построение промта, вызов LLM, извлечение SQL,
+    валидация, проверка стоимости плана, выполнение и форматирование
+    """
+
+    STAGES = [
+        'data_load', 'analyze', 'routing', 'prompt_build', 'llm_invoke',
+        'extract_sql', 'validation', 'cost_guard', 'execute_sql', 'format_results'
+    ]
+
+    STAGE_NAMES = {
+        'data_load': 'Загрузка данных',
+        'analyze': 'Анализ колонок',
+        'routing': 'Маршрутизация',
+        'prompt_build': 'Построение промта',
+        'llm_invoke': 'Вызов GigaChat',
+        'extract_sql': 'Извлечение SQL',
+        'validation': 'Валидация запроса',
+        'cost_guard': 'Проверка стоимости',
+        'execute_sql': 'Выполнение SQL',
+        'format_results': 'Форматирование'
+    }
+
+    def __init__(self, enabled=True, precision=0.02):
+        self.enabled = enabled
+        self.precision = precision
+        self.histograms = {}
+
+    def stage(self, name):
+        """
+        Возвращает таймер для этапа name.
+
+        При выключенном сборе возвращается общий пустой таймер без замеров.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, name)
+
+    def record(self, name, seconds):
+        """Записывает замер этапа"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram(self.precision)
+        histogram.record(seconds)
+
+    def merge(self, histograms):
+        """Добавляет замеры, собранные в другом процессе ({этап: LatencyHistogram})"""
+        for name, other in histograms.items():
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram(self.precision)
+            histogram.merge(other)
+
+    def reset(self):
+        """Сбрасывает накопленные замеры"""
+        self.histograms = {}
+
+    def summary(self):
+        """Возвращает сводку по всем этапам в порядке конвейера"""
+        ordered = [s for s in self.STAGES if s in self.histograms]
+        ordered += sorted(s for s in self.histograms if s not in self.STAGES)
+        return {stage: self.histograms[stage].summary() for stage in ordered}
+
+    def to_json(self):
+        """Возвращает сводку в формате JSON"""
+        return json.dumps({
+            'enabled': self.enabled,
+            'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'stages': self.summary()
+        }, ensure_ascii=False, indent=2)
+
+    def dump_json(self, path):
+        """Сохраняет сводку в JSON файл"""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
+
+    def format_stats(self):
+        """Форматирует сводку для вывода в консоль"""
+        if not self.enabled:
+            return "Сбор метрик выключен (PIPELINE_METRICS=0)"
+
+        stats = self.summary()
+        if not stats:
+            return "Метрики еще не собраны"
+
+        output = ["\n⏱ ЗАДЕРЖКИ ПО ЭТАПАМ (мс):"]
+        header = f"{'Этап':<20} {'N':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"
+        output.append(header)
+        output.append("-" * len(header))
+
+        for stage, s in stats.items():
+            name = self.STAGE_NAMES.get(stage, stage)
+            output.append(
+                f"{name:<20} {s['count']:>5} {s['p50'] * 1000:>9.2f} {s['p95'] * 1000:>9.2f} "
+                f"{s['p99'] * 1000:>9.2f} {s['max'] * 1000:>9.2f}"
+            )
+
+        return "\n".join(output)
+
+
+# Глобальный сборщик метрик конвейера (выключается через PIPELINE_METRICS=0)
+pipeline_metrics = PipelineMetrics(enabled=os.environ.get('PIPELINE_METRICS', '1') != '0')
@@ -0,0 +1,255 @@
+"""
+Постраничный просмотр результатов запроса: keyset-пагинация и ленивое чтение курсора
+"""
+
+import re
+
+from result_compare import find_top_level_clause
+
+
+def _quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _split_top_level(text, separator=','):
+    """Разбивает текст по разделителю вне скобок и кавычек"""
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, ch in enumerate(text):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"', '`', '['):
+            quote = ']' if ch == '[' else ch
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [part.strip() for part in parts]
+
+
+class ResultPager:
+    """
+    Класс для постраничного просмотра результата SELECT запроса.
+
+    В памяти хранится только текущая страница. Для запросов с ORDER BY по
+    колонкам результата используется keyset-пагинация: исходный запрос
+    оборачивается подзапросом, и следующая страница выбирается условием
+    (ключи сортировки, остальные колонки) >= (граница), а строки, уже
+    показанные на предыдущих страницах (полные дубликаты границы), пропускаются.
+    Остальные запросы читаются курсором через fetchmany(); для возврата
+    назад запрос выполняется заново с пропуском строк.
+    """
+
+    _DIRECTION = re.compile(r'\s+(ASC|DESC)\s*$', re.IGNORECASE)
+    _IDENTIFIER = re.compile(r'^(?:(?:\w+|"[^"]+")\.)?(\w+|"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\])$')
+
+    def __init__(self, conn, sql, params=None, page_size=20, first_page=None, source_sql=None):
+        """
+        Args:
+            conn: соединение SQLite
+            sql (str): SELECT запрос
+            params: параметры запроса
+            page_size (int): строк на странице
+            first_page (list or None): уже полученные строки начала результата
+                (например, из спекулятивного выполнения) - первая страница
+                берется из них без повторного запроса
+            source_sql (str or None): исходный запрос, если sql - его переписанная
+                версия (например, с LIMIT от QueryCostGuard); по умолчанию sql
+        """
+        self.conn = conn
+        self.sql = sql.strip().rstrip(';').strip()
+        self.source_sql = source_sql.strip().rstrip(';').strip() if source_sql else self.sql
+        self.params = tuple(params or ())
+        self.page_size = page_size
+        self.page = []
+        self.page_index = -1
+        self.offset = 0
+        self.has_next = True
+        self.columns = self._describe()
+        self.order = self._parse_order()
+        self.mode = 'keyset' if self.order else 'cursor'
+        self._starts = []  # начало каждой просмотренной страницы: (граница, пропуск, смещение)
+        self._cursor = None
+        self._cursor_offset = 0
+
+        if first_page is not None:
+            self._starts.append((None, 0, 0))
+            self.page = list(first_page[:page_size])
+            self.page_index = 0
+            self.has_next = len(first_page) > page_size
+
+    def _describe(self):
+        cursor = self.conn.execute(f"SELECT * FROM (\n{self.sql}\n) LIMIT 0", self.params)
+        return [d[0] for d in cursor.description]
+
+    def _parse_order(self):
+        """
+        Возвращает [(индекс колонки, 'ASC'|'DESC'), ...] для keyset-пагинации
+        или None, если сортировку нельзя выразить через колонки результата
+        """
+        position = find_top_level_clause(self.sql, 'ORDER BY')
+        lowered = [c.lower() for c in self.columns]
+        if position < 0 or len(set(lowered)) != len(lowered):
+            return None
+
+        clause = self.sql[position:]
+        clause = clause[re.match(r'ORDER\s+BY\s+', clause, re.IGNORECASE).end():]
+        for keyword in ('LIMIT', 'OFFSET'):
+            end = find_top_level_clause(clause, keyword)
+            if end >= 0:
+                clause = clause[:end]
+
+        order = []
+        for term in _split_top_level(clause):
+            direction = self._DIRECTION.search(term)
+            expression = term[:direction.start()].strip() if direction else term
+            direction = direction.group(1).upper() if direction else 'ASC'
+
+            if expression.isdigit():
+                index = int(expression) - 1
+                if not 0 <= index < len(self.columns):
+                    return None
+            else:
+                identifier = self._IDENTIFIER.match(expression)
+                if not identifier:
+                    return None
+                name = identifier.group(1).strip('"`[]').replace('""', '"').lower()
+                if name not in lowered:
+                    return None
+                index = lowered.index(name)
+
+            if all(index != i for i, _ in order):
+                order.append((index, direction))
+
+        # Остальные колонки - для однозначного порядка строк с равными ключами
+        tiebreak = order[-1][1] if order else 'ASC'
+        order += [(i, tiebreak) for i in range(len(self.columns)) if all(i != j for j, _ in order)]
+        return order
+
+    def _keyset_query(self, boundary, limit):
+        """Строит запрос страницы, начинающейся с границы boundary (включительно)"""
+        names = [_quote_identifier(self.columns[i]) for i, _ in self.order]
+        order_by = ", ".join(f"{name} {direction}" for name, (_, direction) in zip(names, self.order))
+        where = ""
+        params = list(self.params)
+
+        if boundary is not None:
+            values = [boundary[i] for i, _ in self.order]
+            if all(direction == 'ASC' for _, direction in self.order) and None not in values:
+                # NULL сортируется первым, поэтому строки с NULL уже остались позади границы
+                where = f" WHERE ({', '.join(names)}) >= ({', '.join('?' * len(names))})"
+                params += values
+            else:
+                # (k1 после ?) OR (k1 IS ? AND k2 после ?) OR ... OR (все IS ?) с учетом NULL
+                terms = []
+                for i, (name, (_, direction)) in enumerate(zip(names, self.order)):
+                    if direction == 'ASC':
+                        after = f"{name} > ?" if values[i] is not None else f"{name} IS NOT NULL"
+                    elif values[i] is not None:
+                        after = f"({name} < ? OR {name} IS NULL)"
+                    else:
+                        continue
+                    terms.append(" AND ".join([f"{n} IS ?" for n in names[:i]] + [after]))
+                    params += values[:i] + ([values[i]] if values[i] is not None else [])
+                terms.append(" AND ".join(f"{n} IS ?" for n in names))
+                params += values
+                where = " WHERE " + " OR ".join(f"({term})" for term in terms)
+
+        sql = f"SELECT * FROM (\n{self.sql}\n){where} ORDER BY {order_by} LIMIT {limit}"
+        return sql, params
+
+    def _fetch_keyset(self, boundary, skip):
+        sql, params = self._keyset_query(boundary, skip + self.page_size + 1)
+        cursor = self.conn.execute(sql, params)
+        while skip:
+            skip -= len(cursor.fetchmany(min(skip, 1000)))
+        return cursor.fetchall()
+
+    def _fetch_cursor(self, offset):
+        if self._cursor is None or self._cursor_offset != offset:
+            self._cursor = self.conn.execute(self.sql, self.params)
+            self._cursor_offset = 0
+            while self._cursor_offset < offset:
+                skipped = self._cursor.fetchmany(min(1000, offset - self._cursor_offset))
+                if not skipped:
+                    break
+                self._cursor_offset += len(skipped)
+
+        rows = self._cursor.fetchmany(self.page_size)
+        self._cursor_offset += len(rows)
+        return rows
+
+    def _load(self, index):
+        """Загружает страницу index (начала страниц запоминаются при движении вперед)"""
+        if index == len(self._starts):
+            if index == 0:
+                start = (None, 0, 0)
+            else:
+                boundary = self.page[-1]
+                duplicates = 0
+                for row in reversed(self.page):
+                    if row != boundary:
+                        break
+                    duplicates += 1
+                previous_boundary, previous_skip, _ = self._starts[-1]
+                if duplicates == len(self.page) and previous_boundary == boundary:
+                    duplicates += previous_skip
+                start = (boundary, duplicates, self.offset + len(self.page))
+            self._starts.append(start)
+
+        boundary, skip, offset = self._starts[index]
+        if self.mode == 'keyset':
+            rows = self._fetch_keyset(boundary, skip)
+            self.has_next = len(rows) > self.page_size
+            rows = rows[:self.page_size]
+        else:
+            rows = self._fetch_cursor(offset)
+            self.has_next = len(rows) == self.page_size
+
+        self.page = rows
+        self.page_index = index
+        self.offset = offset
+        return rows
+
+    def next(self):
+        """Возвращает следующую страницу ([] - если строк больше нет)"""
+        if self.page_index >= 0 and not self.has_next:
+            return []
+        rows = self._load(self.page_index + 1)
+        if not rows and self.page_index > 0:
+            self._starts.pop()
+            self._load(self.page_index - 1)
+            self.has_next = False
+            return []
+        return rows
+
+    def prev(self):
+        """Возвращает предыдущую страницу ([] - если это первая страница)"""
+        if self.page_index <= 0:
+            return []
+        return self._load(self.page_index - 1)
+
+    def format_page(self):
+        """Форматирует текущую страницу с подсказками навигации"""
+        if not self.page:
+            return "Запрос выполнен, но результатов не найдено."
+
+        header = " | ".join(self.columns)
+        lines = [header, "-" * len(header)]
+        lines += [" | ".join(str(item) for item in row) for row in self.page]
+
+        hints = []
+        if self.has_next:
+            hints.append("'next' - следующая")
+        if self.page_index > 0:
+            hints.append("'prev' - предыдущая")
+        footer = f"\nСтраница {self.page_index + 1}, строки {self.offset + 1}-{self.offset + len(self.page)}"
+        lines.append(footer + (f" ({', '.join(hints)})" if hints else ""))
+        return "\n".join(lines)
@@ -2,38 +2,13 @@
 Утилиты для построения промтов на основе анализа структуры таблиц
 """
 
-from table_analyzer import TableAnalyzer
+from example_selector import ExampleSelector
+from intent_router import IntentRouter
+from schema_catalog import SchemaCatalog
 
 
-class PromptBuilder:
-    """
-    Класс для создания оптимизированных промтов на основе анализа данных
-    """
-
-    def __init__(self, db_path, table_name):
-        self.analyzer = TableAnalyzer(db_path, table_name)
-        self.is_analyzed = False
-
-    def analyze_and_prepare(self):
-        """Анализирует таблицу и подготавливает данные для промтов"""
-        if self.analyzer.connect():
-            self.analyzer.analyze_column_values()
-            self.is_analyzed = True
-            self.analyzer.disconnect()
-            return True
-        return False
-
-    def build_enhanced_system_prompt(self):
-        """Создает расширенный системный промт с анализом данных"""
-        if not self.is_analyzed:
-            return self.build_basic_system_prompt()
-
-        base_prompt = self.build_basic_system_prompt()
-        return self.analyzer.get_enhanced_system_prompt(base_prompt)
-
-    def build_basic_system_prompt(self):
-        """Создает базовый системный промт"""
-        return """Создавай только SQL запросы для SQLite базы данных по запросу пользователя.
+# Базовые правила генерации SQL (общая часть статического и поискового промтов)
+PROMPT_RULES = """Создавай только SQL запросы для SQLite базы данных по запросу пользователя.
 Отвечай только SQL запросом без дополнительных объяснений.
 
 КРИТИЧЕСКИЕ ПРАВИЛА - ВСЕГДА СОБЛЮДАЙ:
@@ -72,9 +47,10 @@ class PromptBuilder:
       ROUND(AVG(CASE WHEN Payment_Method = 'Crypto' THEN Earnings_USD END) - 
             AVG(CASE WHEN Payment_Method != 'Crypto' THEN Earnings_USD END), 2) AS Difference
       FROM freelancer_earnings
-   ❌ WITH crypto_earners AS (...) - НЕ используй CTE для простых сравнений!
+   ❌ WITH crypto_earners AS (...) - НЕ используй CTE для простых сравнений!"""
 
-ШАБЛОНЫ ЗАПРОСОВ:
+# Фиксированный блок шаблонов статического промта
+PROMPT_TEMPLATES = """ШАБЛОНЫ ЗАПРОСОВ:
 
 Топ-10 по заработку:
 SELECT * FROM freelancer_earnings ORDER BY Earnings_USD DESC LIMIT 10
@@ -108,14 +84,196 @@ FROM freelancer_earnings
 SELECT Client_Region, ROUND(AVG(Earnings_USD), 2) AS Average_Earnings, 
 COUNT(*) AS Count, ROUND(MIN(Earnings_USD), 2) AS Min_Earnings, 
 ROUND(MAX(Earnings_USD), 2) AS Max_Earnings FROM freelancer_earnings 
-GROUP BY Client_Region ORDER BY Average_Earnings DESC
+GROUP BY Client_Region ORDER BY Average_Earnings DESC"""
 
-ЗАПОМНИ:
+PROMPT_REMINDERS = """ЗАПОМНИ:
 - Не добавляй лишние слова к алиасам
 - Всегда добавляй LIMIT 10 после GROUP BY
 - Всегда используй ROUND(..., 2) для числовых агрегаций
 - Используй простые CASE WHEN для сравнений, не WITH/CTE"""
 
+# Формат ответа при ограничении длины генерации (GenerationControlChatModel):
+# стоп-последовательность срабатывает после закрывающего маркера блока кода
+OUTPUT_FORMATS = {
+    'sql': "ФОРМАТ ОТВЕТА: один блок ```sql ... ``` без пояснений до и после него.",
+    'json': 'ФОРМАТ ОТВЕТА: только JSON объект {"sql": "<SQL запрос>"} без пояснений и без блока кода.'
+}
+
+
+def join_prompt_parts(parts):
+    """Собирает промт из частей build_prompt_parts()"""
+    return "".join(text for _, text in parts)
+
+
+class PromptBuilder:
+    """
+    Класс для создания оптимизированных промтов на основе анализа данных
+    """
+
+    PROMPT_MODES = ('static', 'retrieval')
+    SCHEMA_DETAILS = ('full', 'schema', 'names')  # от полной схемы к самой короткой
+
+    def __init__(self, db_path, table_name, tables=None, descriptions=None, max_schema_tables=3,
+                 prompt_mode='static', example_selector=None, use_intent_router=True, output_format=None):
+        """
+        Args:
+            db_path (str): путь к базе данных
+            table_name (str): основная таблица
+            tables (list or None): все таблицы каталога (по умолчанию только основная)
+            descriptions (dict or None): описания таблиц и колонок для поиска схем
+            max_schema_tables (int): сколько схем таблиц включать в промт
+            prompt_mode (str): 'static' - все шаблоны в каждом промте,
+                'retrieval' - только k примеров, похожих на вопрос
+            example_selector (ExampleSelector or None): источник примеров для режима 'retrieval'
+            use_intent_router (bool): отвечать на типовые вопросы по шаблонам без GigaChat
+            output_format (str or None): требование к формату ответа из OUTPUT_FORMATS
+                ('sql' - только блок кода, 'json' - {"sql": ...}); None - без требования
+        """
+        if prompt_mode not in self.PROMPT_MODES:
+            raise ValueError(f"Неизвестный режим промта: {prompt_mode}")
+        if output_format is not None and output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Неизвестный формат ответа: {output_format}")
+        table_names = list(tables) if tables else [table_name]
+        if table_name not in table_names:
+            table_names.insert(0, table_name)
+
+        self.catalog = SchemaCatalog(db_path, table_names, descriptions, max_schema_tables)
+        self.analyzer = self.catalog.analyzers[table_name]
+        self.prompt_mode = prompt_mode
+        self._example_selector = example_selector
+        self.use_intent_router = use_intent_router
+        self.output_format = output_format
+        self.intent_router = None
+        self.is_analyzed = False
+
+    @property
+    def is_multi_table(self):
+        return self.catalog.is_multi_table
+
+    @property
+    def is_question_specific(self):
+        """Зависит ли системный промт от вопроса (несколько таблиц или подбор примеров)"""
+        return self.is_multi_table or self.prompt_mode == 'retrieval'
+
+    @property
+    def example_selector(self):
+        """Индекс примеров (создается при первом обращении)"""
+        if self._example_selector is None:
+            self._example_selector = ExampleSelector()
+        return self._example_selector
+
+    def analyze_and_prepare(self):
+        """Анализирует таблицы и подготавливает данные для промтов"""
+        analyzed = self.catalog.analyze()
+        self.is_analyzed = self.analyzer.table_name in analyzed
+        if self.is_analyzed and self.use_intent_router:
+            # Маршрутизатору нужны значения текстовых колонок - их профили считаются одним пакетом
+            self.analyzer.profile_columns(
+                [column for column, info in self.analyzer.column_info.items() if not info['is_numeric']]
+            )
+            self.intent_router = IntentRouter(self.analyzer.table_name, self.analyzer.column_info)
+        return self.is_analyzed
+
+    def refresh_analysis(self, reanalyze=False):
+        """
+        Обновляет индекс схем и маршрутизатор после загрузки новых данных
+
+        Args:
+            reanalyze (bool): проанализировать таблицы заново (после полной
+                перезагрузки); иначе профили колонок уже обновлены по новым
+                строкам через TableAnalyzer.append_rows()
+        """
+        if reanalyze:
+            for analyzer in self.catalog.analyzers.values():
+                analyzer.column_info = {}
+                analyzer.summaries = None
+                analyzer.profiled_columns = 0
+            return self.analyze_and_prepare()
+
+        self.catalog.build_index()
+        if self.intent_router is not None:
+            self.intent_router = IntentRouter(self.analyzer.table_name, self.analyzer.column_info)
+        return self.is_analyzed
+
+    def route_question(self, question):
+        """Возвращает готовый SQL (RouteMatch) для типового вопроса или None"""
+        if self.intent_router is None:
+            return None
+        return self.intent_router.route(question)
+
+    def build_enhanced_system_prompt(self, question=None, schema_detail='full'):
+        """
+        Создает расширенный системный промт с анализом данных
+
+        Для нескольких таблиц в промт попадают только схемы, относящиеся к вопросу,
+        в режиме 'retrieval' - только похожие на вопрос примеры.
+        """
+        return join_prompt_parts(self.build_prompt_parts(question, schema_detail))
+
+    def build_prompt_parts(self, question=None, schema_detail='full'):
+        """
+        Части системного промта по компонентам (для учета токенов)
+
+        Args:
+            question (str or None): вопрос для подбора схем и примеров
+            schema_detail (str): детализация схемы из SCHEMA_DETAILS: 'full' - схема
+                и списки значений, 'schema' - без списков значений,
+                'names' - без значений колонок
+
+        Returns:
+            list: [(компонент, текст), ...]; компоненты - 'rules', 'examples',
+                'schema', 'values'; join_prompt_parts() собирает из них промт
+        """
+        if schema_detail not in self.SCHEMA_DETAILS:
+            raise ValueError(f"Неизвестная детализация схемы: {schema_detail}")
+
+        parts = None
+        if self.prompt_mode == 'retrieval' and question:
+            parts = self._retrieval_parts(question)
+        if parts is None:
+            parts = self._basic_parts()
+        if self.output_format is not None:
+            parts.append(('rules', f"\n\n{OUTPUT_FORMATS[self.output_format]}"))
+
+        if not self.is_analyzed:
+            return parts
+
+        include_values = schema_detail == 'full'
+        max_values = 0 if schema_detail == 'names' else 30
+        if self.is_multi_table:
+            schema_parts = self.catalog.schema_prompt_parts(question, include_values, max_values)
+            component, text = schema_parts[0]
+            return parts + [(component, "\n\n" + text)] + schema_parts[1:]
+
+        parts.append(('schema', f"\n\n{self.analyzer.generate_prompt_schema(max_values)}\n"))
+        values = self.analyzer.generate_system_prompt_addition(include_rules=False)
+        if values:
+            if include_values:
+                parts.append(('values', values))
+            parts.append(('rules', "\n" + "\n".join(self.analyzer.VALUE_RULES)))
+        return parts
+
+    def _basic_parts(self):
+        return [('rules', PROMPT_RULES), ('examples', f"\n\n{PROMPT_TEMPLATES}"), ('rules', f"\n\n{PROMPT_REMINDERS}")]
+
+    def _retrieval_parts(self, question):
+        """Части промта с k похожими на вопрос примерами (None - примеров нет)"""
+        examples = self.example_selector.select(question)
+        if not examples:
+            return None
+
+        examples_block = self.example_selector.format_examples(examples)
+        return [('rules', PROMPT_RULES), ('examples', f"\n\nПОХОЖИЕ ПРИМЕРЫ:\n\n{examples_block}"),
+                ('rules', f"\n\n{PROMPT_REMINDERS}")]
+
+    def build_basic_system_prompt(self):
+        """Создает базовый системный промт"""
+        return join_prompt_parts(self._basic_parts())
+
+    def build_retrieval_system_prompt(self, question):
+        """Создает системный промт с k наиболее похожими на вопрос примерами вместо всех шаблонов"""
+        return join_prompt_parts(self._retrieval_parts(question) or self._basic_parts())
+
     def get_table_summary(self):
         """Возвращает краткую сводку о таблице"""
         if not self.is_analyzed:
@@ -0,0 +1,290 @@
+"""
+Проверка стоимости SQL запроса по плану выполнения (EXPLAIN QUERY PLAN) перед запуском
+"""
+
+import math
+import re
+import sqlite3
+import time
+
+from result_compare import has_top_level_clause
+
+
+class QueryCostGuard:
+    """
+    Класс для оценки стоимости запроса до его выполнения.
+
+    План EXPLAIN QUERY PLAN разбирается в дерево; стоимость считается в
+    "прочитанных строках" по числу строк таблиц из анализатора:
+    - SCAN таблицы - все строки, SEARCH по индексу - log2(N) плюс найденные
+      строки (доля 1/число уникальных значений колонки для равенства);
+    - соседние SCAN/SEARCH одного уровня - вложенные циклы (соединения),
+      стоимость перемножается;
+    - USE TEMP B-TREE (ORDER BY, GROUP BY, DISTINCT) - сортировка N*log2(N);
+    - коррелированный подзапрос выполняется для каждой строки внешнего цикла.
+
+    Запрос дороже max_cost отклоняется. Если план потоковый (без сортировок),
+    в запросе нет LIMIT и с LIMIT limit_rows он укладывается в бюджет -
+    запрос переписывается с LIMIT. Так же переписываются запросы, которые
+    вернут больше max_result_rows строк (если порог задан).
+    """
+
+    DECISIONS = ('allow', 'rewrite', 'reject')
+
+    _SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+    _SEARCH = re.compile(r'^SEARCH (?:TABLE )?(\w+)(?: USING (.*))?')
+    _CONDITION = re.compile(r'\((.*)\)\s*$')
+    _SOURCE = re.compile(r'(?:\bFROM|\bJOIN|,)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+    _AGGREGATE = re.compile(r'\b(?:COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(', re.IGNORECASE)
+    _SQL_WORDS = {'WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'CROSS', 'NATURAL', 'ON', 'USING',
+                  'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'UNION', 'EXCEPT', 'INTERSECT', 'WINDOW'}
+
+    def __init__(self, row_counts=None, distinct_counts=None, max_cost=5e7, max_result_rows=10000,
+                 limit_rows=1000, default_rows=1000, range_selectivity=1 / 3, where_selectivity=0.25,
+                 distinct_lookup=None):
+        """
+        Args:
+            row_counts (dict): {таблица: число строк}
+            distinct_counts (dict): {(таблица, колонка): число уникальных значений}
+            max_cost (float): бюджет стоимости; дороже - отклонение или LIMIT
+            max_result_rows (int or None): сколько строк результата допустимо без LIMIT;
+                None - число строк не ограничивается (результат читается постранично)
+            limit_rows (int): LIMIT, добавляемый при переписывании
+            default_rows (int): число строк неизвестной таблицы или подзапроса
+            range_selectivity (float): доля строк для диапазонного условия индекса
+            where_selectivity (float): доля строк, проходящих WHERE (для оценки результата)
+            distinct_lookup (callable or None): (таблица, колонка) -> число уникальных
+                значений для колонок, которых нет в distinct_counts (результат запоминается)
+        """
+        self.row_counts = {name.lower(): rows for name, rows in (row_counts or {}).items()}
+        self.distinct_counts = {(t.lower(), c.lower()): n for (t, c), n in (distinct_counts or {}).items()}
+        self.max_cost = max_cost
+        self.max_result_rows = max_result_rows
+        self.limit_rows = limit_rows
+        self.default_rows = default_rows
+        self.range_selectivity = range_selectivity
+        self.where_selectivity = where_selectivity
+        self.distinct_lookup = distinct_lookup
+        self.stats = {
+            'checked': 0,
+            'allowed': 0,
+            'rewritten': 0,
+            'rejected': 0,
+            'errors': 0,
+            'plan_time': 0.0,
+            'max_cost_seen': 0.0
+        }
+
+    @classmethod
+    def from_catalog(cls, catalog, **kwargs):
+        """Создает проверку по статистике проанализированных таблиц SchemaCatalog"""
+        row_counts = {}
+        distinct_counts = {}
+        columns = {}
+        for table, analyzer in catalog.analyzers.items():
+            if not analyzer.column_info:
+                continue
+            row_counts[table] = max(info['total_count'] for info in analyzer.column_info.values())
+            for column, info in analyzer.column_info.items():
+                if info.is_profiled:
+                    distinct_counts[(table, column)] = info['unique_count']
+                else:
+                    columns[(table.lower(), column.lower())] = info
+
+        # Остальные колонки профилируются, только когда план действительно ищет по ним
+        return cls(row_counts, distinct_counts,
+                   distinct_lookup=lambda table, column: columns[(table, column)]['unique_count']
+                   if (table, column) in columns else None,
+                   **kwargs)
+
+    def explain(self, conn, sql, params=None):
+        """Возвращает план запроса: [(id, parent, detail), ...]"""
+        cursor = conn.execute(f"EXPLAIN QUERY PLAN {sql.strip().rstrip(';')}", params or ())
+        return [(row[0], row[1], row[3]) for row in cursor.fetchall()]
+
+    def _sources(self, sql):
+        """Сопоставляет псевдонимы таблиц их именам"""
+        sources = {}
+        for match in self._SOURCE.finditer(sql):
+            table, alias = match.group(1).lower(), (match.group(2) or '').lower()
+            if table in self.row_counts:
+                sources[table] = table
+                if alias and alias.upper() not in self._SQL_WORDS:
+                    sources[alias] = table
+        return sources
+
+    def _table_rows(self, name, sources, materialized):
+        name = name.lower()
+        if name in materialized:
+            return materialized[name]
+        table = sources.get(name, name)
+        return self.row_counts.get(table, self.default_rows)
+
+    def _search_rows(self, name, using, rows, sources):
+        """Оценивает число строк, найденных по индексу"""
+        if 'PRIMARY KEY' in using and not re.search(r'[<>]', using):
+            return 1
+        condition = self._CONDITION.search(using)
+        if not condition:
+            return max(1.0, rows * self.range_selectivity)
+
+        table = sources.get(name.lower(), name.lower())
+        matched = float(rows)
+        for term in condition.group(1).split(' AND '):
+            column = re.match(r'\s*(\w+)', term)
+            if '=' in term and not re.search(r'[<>]', term):
+                distinct = self._distinct(table, column.group(1).lower()) if column else None
+                matched /= distinct or 10
+            else:
+                matched *= self.range_selectivity
+        return max(1.0, matched)
+
+    def _distinct(self, table, column):
+        key = (table, column)
+        if key not in self.distinct_counts and self.distinct_lookup is not None:
+            self.distinct_counts[key] = self.distinct_lookup(table, column)
+        return self.distinct_counts.get(key)
+
+    def _estimate_node(self, node, children, sources, materialized, counters):
+        """Возвращает (стоимость, строк на выходе, потоковый ли план) для узла плана"""
+        cost = 0.0
+        loop_rows = 1.0
+        streaming = True
+        loops = 0
+
+        for child_id, detail in children.get(node, []):
+            scan = self._SCAN.match(detail)
+            search = self._SEARCH.match(detail)
+
+            if detail.startswith('SCAN CONSTANT ROW'):
+                continue
+            elif scan:
+                rows = self._table_rows(scan.group(1), sources, materialized)
+                cost += loop_rows * rows
+                loop_rows *= rows
+                loops += 1
+                counters['full_scans'] += 1
+            elif search:
+                name, using = search.group(1), search.group(2) or ''
+                rows = self._table_rows(name, sources, materialized)
+                if 'AUTOMATIC' in using:
+                    cost += rows * math.log2(rows + 1)  # построение временного индекса
+                    counters['automatic_indexes'] += 1
+                matched = self._search_rows(name, using, rows, sources)
+                cost += loop_rows * (math.log2(rows + 1) + matched)
+                loop_rows *= matched
+                loops += 1
+            elif detail.startswith('USE TEMP B-TREE'):
+                cost += loop_rows * math.log2(loop_rows + 1)
+                streaming = False
+                counters['temp_btrees'] += 1
+                if 'GROUP BY' in detail or 'DISTINCT' in detail:
+                    loop_rows = max(1.0, math.sqrt(loop_rows))
+            elif detail.startswith('CORRELATED'):
+                sub_cost, _, _ = self._estimate_node(child_id, children, sources, materialized, counters)
+                cost += loop_rows * sub_cost
+                counters['correlated_subqueries'] += 1
+            elif detail.startswith(('MATERIALIZE', 'CO-ROUTINE')):
+                sub_cost, sub_rows, _ = self._estimate_node(child_id, children, sources, materialized, counters)
+                cost += sub_cost
+                name = detail.split()[-1].lower()
+                materialized[name] = sub_rows
+            else:
+                # Некоррелированные подзапросы, части UNION и прочие узлы выполняются один раз
+                sub_cost, sub_rows, sub_streaming = self._estimate_node(child_id, children, sources,
+                                                                        materialized, counters)
+                cost += sub_cost
+                streaming = streaming and sub_streaming
+                if detail.startswith(('COMPOUND', 'LEFT-MOST', 'UNION', 'EXCEPT', 'INTERSECT')):
+                    loop_rows = sub_rows if loops == 0 and loop_rows == 1.0 else loop_rows + sub_rows
+                    if 'TEMP B-TREE' in detail:
+                        streaming = False
+
+        counters['joins'] += max(0, loops - 1)
+        return cost, loop_rows, streaming
+
+    def estimate(self, conn, sql, params=None):
+        """
+        Оценивает стоимость запроса по плану выполнения
+
+        Returns:
+            dict: cost, result_rows, streaming, full_scans, temp_btrees,
+                correlated_subqueries, joins, automatic_indexes, plan
+        """
+        plan = self.explain(conn, sql, params)
+        children = {}
+        for node_id, parent, detail in plan:
+            children.setdefault(parent, []).append((node_id, detail))
+
+        counters = {'full_scans': 0, 'temp_btrees': 0, 'correlated_subqueries': 0,
+                    'joins': 0, 'automatic_indexes': 0}
+        cost, rows, streaming = self._estimate_node(0, children, self._sources(sql), {}, counters)
+
+        if re.search(r'\bWHERE\b', sql, re.IGNORECASE):
+            rows = max(1.0, rows * self.where_selectivity)
+        if self._AGGREGATE.search(sql) and not has_top_level_clause(sql, 'GROUP BY'):
+            rows = 1.0
+
+        estimate = {'cost': cost, 'result_rows': rows, 'streaming': streaming, 'plan': [d for _, _, d in plan]}
+        estimate.update(counters)
+        return estimate
+
+    def check(self, conn, sql, params=None, limit_results=True):
+        """
+        Решает, выполнять ли запрос
+
+        Args:
+            limit_results (bool): переписывать ли запрос с LIMIT; False - только
+                проверка стоимости (для выгрузки, которая читает результат порциями):
+                запрос дороже бюджета отклоняется, остальные выполняются целиком
+
+        Returns:
+            dict: decision ('allow', 'rewrite', 'reject'), sql (исходный или с LIMIT),
+                reason и оценка estimate (None, если план построить не удалось)
+        """
+        self.stats['checked'] += 1
+        start = time.perf_counter()
+        try:
+            estimate = self.estimate(conn, sql, params)
+        except sqlite3.Error as e:
+            # Ошибку в самом запросе покажет обычное выполнение
+            self.stats['errors'] += 1
+            self.stats['allowed'] += 1
+            return {'decision': 'allow', 'sql': sql, 'reason': f"план не построен: {e}", 'estimate': None}
+        finally:
+            self.stats['plan_time'] += time.perf_counter() - start
+
+        cost, rows = estimate['cost'], estimate['result_rows']
+        self.stats['max_cost_seen'] = max(self.stats['max_cost_seen'], cost)
+        can_limit = (limit_results and sql.strip().upper().startswith(('SELECT', 'WITH'))
+                     and not has_top_level_clause(sql, 'LIMIT'))
+
+        if cost > self.max_cost:
+            limited_cost = cost * min(1.0, self.limit_rows / max(rows, 1.0)) / self.where_selectivity
+            if can_limit and estimate['streaming'] and limited_cost <= self.max_cost:
+                decision = self._decision('rewrite', sql, estimate,
+                                          f"стоимость {cost:.3g} > {self.max_cost:.3g}, добавлен LIMIT {self.limit_rows}")
+            else:
+                decision = self._decision('reject', sql, estimate,
+                                          f"стоимость {cost:.3g} > {self.max_cost:.3g}")
+        elif can_limit and self.max_result_rows is not None and rows > self.max_result_rows:
+            decision = self._decision('rewrite', sql, estimate,
+                                      f"ожидается ~{rows:.0f} строк, добавлен LIMIT {self.limit_rows}")
+        else:
+            decision = self._decision('allow', sql, estimate, '')
+
+        return decision
+
+    def _decision(self, decision, sql, estimate, reason):
+        self.stats[{'allow': 'allowed', 'rewrite': 'rewritten', 'reject': 'rejected'}[decision]] += 1
+        if decision == 'rewrite':
+            sql = f"SELECT * FROM (\n{sql.strip().rstrip(';')}\n) LIMIT {self.limit_rows}"
+        return {'decision': decision, 'sql': sql, 'reason': reason, 'estimate': estimate}
+
+    def format_stats(self):
+        """Форматирует статистику решений"""
+        stats = self.stats
+        return (f"🛡️ Проверка стоимости: проверено {stats['checked']}, разрешено {stats['allowed']}, "
+                f"с LIMIT {stats['rewritten']}, отклонено {stats['rejected']}, "
+                f"без плана {stats['errors']}, время {stats['plan_time'] * 1000:.1f} мс, "
+                f"макс. стоимость {stats['max_cost_seen']:.3g} (бюджет {self.max_cost:.3g})")
@@ -0,0 +1,259 @@
+"""
+Сравнение SQL запросов по результатам выполнения
+
+Строки читаются из курсора порциями, поэтому память не зависит от размера результата:
+- с учетом порядка - два курсора читаются синхронно и сравниваются построчно;
+- без учета порядка - для каждого результата считается 128-битный мультимножественный
+  хэш (сумма 128-битных хэшей строк, каждая 64-битная половина - по модулю 2^64),
+  не зависящий от порядка строк.
+
+Построчное сравнение допускает разницу чисел в пределах допуска (math.isclose).
+Хэш так не умеет: числа перед хэшированием округляются, и значения по разные
+стороны границы округления (0.1234564999 и 0.1234565) считаются разными.
+"""
+
+import hashlib
+import math
+
+MASK64 = (1 << 64) - 1
+ORDERED_MULTIPLIER = 0x100000001B3  # Множитель полиномиального хэша (FNV-1a prime)
+
+
+def _normalize_value(value, float_digits):
+    """Приводит значение к каноническому виду для хэширования"""
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return repr(value)
+        value = round(value, float_digits) + 0.0  # + 0.0 убирает -0.0
+        if value.is_integer() and abs(value) < 2 ** 53:
+            return int(value)
+    return value
+
+
+def _row_hash(row, float_digits):
+    """Возвращает 128-битный хэш строки в виде двух 64-битных чисел"""
+    normalized = tuple(_normalize_value(v, float_digits) for v in row)
+    digest = hashlib.blake2b(repr(normalized).encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+def _values_equal(left, right, tolerance):
+    """Сравнивает значения с допуском для чисел с плавающей точкой"""
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)) \
+            and (isinstance(left, float) or isinstance(right, float)):
+        return math.isclose(left, right, rel_tol=tolerance, abs_tol=tolerance)
+    return left == right
+
+
+def tolerance_to_digits(tolerance):
+    """
+    Переводит допуск в число знаков округления для хэширования
+
+    Используется отпечатками ResultDigest (сравнение без учета порядка, эталоны
+    GoldenResultStore). Округление делит числа на интервалы: близкие значения
+    по разные стороны границы интервала дают разные хэши, хотя разница между
+    ними меньше допуска.
+    """
+    if tolerance <= 0:
+        return 15
+    return max(0, min(15, round(-math.log10(tolerance))))
+
+
+class ResultDigest:
+    """
+    Компактный отпечаток результата запроса.
+
+    ordered=True - полиномиальный хэш, чувствительный к порядку строк;
+    ordered=False - мультимножественный хэш (сумма хэшей строк).
+    Числа с плавающей точкой округляются до float_digits знаков, поэтому
+    значения у границы округления могут не совпасть (см. tolerance_to_digits).
+    """
+
+    def __init__(self, ordered=False, float_digits=6):
+        self.ordered = ordered
+        self.float_digits = float_digits
+        self.count = 0
+        self.columns = 0
+        self._low = 0
+        self._high = 0
+
+    def add(self, row):
+        """Добавляет строку в отпечаток"""
+        low, high = _row_hash(row, self.float_digits)
+        if self.ordered:
+            self._low = (self._low * ORDERED_MULTIPLIER + low) & MASK64
+            self._high = (self._high * ORDERED_MULTIPLIER + high) & MASK64
+        else:
+            self._low = (self._low + low) & MASK64
+            self._high = (self._high + high) & MASK64
+        self.count += 1
+
+    def hexdigest(self):
+        """Возвращает отпечаток в виде строки"""
+        kind = 'o' if self.ordered else 'u'
+        return f"{kind}{self.columns}:{self.count}:{self._low:016x}{self._high:016x}"
+
+    def __eq__(self, other):
+        return isinstance(other, ResultDigest) and self.hexdigest() == other.hexdigest()
+
+    def __hash__(self):
+        return hash(self.hexdigest())
+
+
+def iter_query_rows(cursor, batch_size=1000):
+    """Построчно отдает результат выполненного запроса, читая курсор порциями"""
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield from batch
+
+
+def find_top_level_clause(sql, clause):
+    """Возвращает позицию конструкции верхнего уровня ('ORDER BY', 'LIMIT'...) или -1"""
+    words = clause.upper().split()
+    depth = 0
+    quote = None
+    upper = sql.upper()
+    i = 0
+
+    while i < len(upper):
+        ch = upper[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif depth == 0 and upper.startswith(words[0], i) and (i == 0 or not upper[i - 1].isalnum()):
+            rest = upper[i:]
+            for word in words:
+                rest = rest.lstrip()
+                if not rest.startswith(word):
+                    break
+                rest = rest[len(word):]
+            else:
+                if not rest or not (rest[0].isalnum() or rest[0] == '_'):
+                    return i
+        i += 1
+
+    return -1
+
+
+def has_top_level_clause(sql, clause):
+    """Проверяет, есть ли в запросе конструкция верхнего уровня ('ORDER BY', 'LIMIT'...)"""
+    return find_top_level_clause(sql, clause) >= 0
+
+
+def is_ordered_query(sql):
+    """Проверяет, есть ли в запросе ORDER BY верхнего уровня"""
+    return has_top_level_clause(sql, 'ORDER BY')
+
+
+def digest_query(conn, sql, ordered=False, float_digits=6, batch_size=1000):
+    """
+    Выполняет запрос и считает отпечаток его результата
+
+    Returns:
+        tuple: (digest: ResultDigest or None, error_message: str or None)
+    """
+    digest = ResultDigest(ordered, float_digits)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        digest.columns = len(cursor.description) if cursor.description else 0
+        for row in iter_query_rows(cursor, batch_size):
+            digest.add(row)
+    except Exception as e:
+        return None, str(e)
+    return digest, None
+
+
+def compare_query_results(conn, generated_sql, expected_sql, ordered=None,
+                          float_tolerance=1e-6, batch_size=1000):
+    """
+    Сравнивает результаты выполнения двух запросов
+
+    Args:
+        conn: соединение с базой данных
+        generated_sql (str): сгенерированный запрос
+        expected_sql (str): эталонный запрос
+        ordered (bool or None): учитывать порядок строк; None - если в эталоне есть ORDER BY
+        float_tolerance (float): допуск для чисел с плавающей точкой; без учета
+            порядка числа округляются до tolerance_to_digits(float_tolerance) знаков
+        batch_size (int): размер порции чтения из курсора
+
+    Returns:
+        dict: equivalent, ordered, rows_compared, reason, generated_error, expected_error
+    """
+    if ordered is None:
+        ordered = is_ordered_query(expected_sql)
+
+    result = {
+        'equivalent': False,
+        'ordered': ordered,
+        'rows_compared': 0,
+        'reason': None,
+        'generated_error': None,
+        'expected_error': None
+    }
+
+    if not ordered:
+        digits = tolerance_to_digits(float_tolerance)
+        generated, result['generated_error'] = digest_query(conn, generated_sql, False, digits, batch_size)
+        expected, result['expected_error'] = digest_query(conn, expected_sql, False, digits, batch_size)
+
+        if generated is None or expected is None:
+            result['reason'] = 'execution_error'
+        elif generated.columns != expected.columns:
+            result['reason'] = 'column_count'
+        elif generated.count != expected.count:
+            result['reason'] = 'row_count'
+            result['rows_compared'] = min(generated.count, expected.count)
+        else:
+            result['rows_compared'] = generated.count
+            result['equivalent'] = generated == expected
+            result['reason'] = None if result['equivalent'] else 'values'
+        return result
+
+    # С учетом порядка: синхронное чтение двух курсоров
+    cursors = {}
+    for key, sql in (('generated', generated_sql), ('expected', expected_sql)):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            cursors[key] = cursor
+        except Exception as e:
+            result[f'{key}_error'] = str(e)
+
+    if len(cursors) < 2:
+        result['reason'] = 'execution_error'
+        return result
+
+    generated_cursor, expected_cursor = cursors['generated'], cursors['expected']
+    if len(generated_cursor.description or []) != len(expected_cursor.description or []):
+        result['reason'] = 'column_count'
+        return result
+
+    generated_rows = iter_query_rows(generated_cursor, batch_size)
+    expected_rows = iter_query_rows(expected_cursor, batch_size)
+    missing = object()
+
+    while True:
+        generated_row = next(generated_rows, missing)
+        expected_row = next(expected_rows, missing)
+
+        if generated_row is missing and expected_row is missing:
+            result['equivalent'] = True
+            return result
+        if generated_row is missing or expected_row is missing:
+            result['reason'] = 'row_count'
+            return result
+        if not all(_values_equal(g, e, float_tolerance) for g, e in zip(generated_row, expected_row)):
+            result['reason'] = 'values'
+            return result
+
+        result['rows_compared'] += 1
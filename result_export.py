@@ -0,0 +1,236 @@
+"""
+Потоковая выгрузка результатов запроса в CSV, JSONL и Parquet
+"""
+
+import csv
+import importlib.util
+import itertools
+import json
+import os
+import time
+
+# Parquet доступен только при установленном pyarrow; сам pyarrow импортируется
+# при первой выгрузке в Parquet, чтобы не замедлять запуск
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+EXPORT_FORMATS = ('csv', 'jsonl') + (('parquet',) if HAS_PYARROW else ())
+
+_EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.parquet': 'parquet'}
+
+
+def detect_format(path):
+    """Определяет формат выгрузки по расширению файла"""
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+class _CSVWriter:
+    def __init__(self, path, columns):
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+
+    def write(self, rows):
+        # BLOB - шестнадцатеричной строкой, как в JSONL, а не repr b'...';
+        # типы порции собираются без цикла Python, порции без BLOB пишутся как есть
+        if bytes in set(map(type, itertools.chain.from_iterable(rows))):
+            rows = [[value.hex() if isinstance(value, bytes) else value for value in row] for row in rows]
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class _JSONLWriter:
+    def __init__(self, path, columns):
+        self._file = open(path, 'w', encoding='utf-8')
+        self._columns = columns
+
+    def write(self, rows):
+        columns = self._columns
+        self._file.write("".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default) + "\n"
+            for row in rows
+        ))
+
+    def close(self):
+        self._file.close()
+
+
+def _text(value):
+    if value is None:
+        return None
+    return value.hex() if isinstance(value, bytes) else str(value)
+
+
+class _ParquetWriter:
+    """
+    Пишет каждую порцию строк отдельной группой строк Parquet
+
+    SQLite не типизирует результат запроса, поэтому следующая порция может
+    не уложиться в типы уже записанных колонок (целые, затем дробные; NULL,
+    затем текст). Тогда типы расширяются (null -> int64 -> double -> string,
+    смешанные значения - string), записанные группы строк по одной
+    переписываются в файл с новой схемой, и запись продолжается. Каждая
+    колонка расширяется не более трех раз.
+    """
+
+    def __init__(self, path, columns):
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._path = path
+        self._columns = columns
+        self._writer = None
+        self._schema = None
+        self.rewrites = 0
+
+    def _array(self, values):
+        """Колонка порции с типом, выведенным pyarrow; смешанные значения - строки"""
+        pa = self._pa
+        try:
+            return pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+            return pa.array([_text(value) for value in values], pa.string())
+
+    def _widen(self, current, new):
+        """Общий тип колонки для уже записанного типа current и типа порции new"""
+        pa = self._pa
+        if current == new or pa.types.is_null(new):
+            return current
+        if pa.types.is_null(current):
+            return new
+        numeric = (pa.types.is_integer, pa.types.is_floating)
+        if any(check(current) for check in numeric) and any(check(new) for check in numeric):
+            return pa.float64()
+        return pa.string()
+
+    def _convert(self, array, target):
+        pa = self._pa
+        if array.type == target:
+            return array
+        if pa.types.is_string(target):
+            return pa.array([_text(value) for value in array.to_pylist()], pa.string())
+        return array.cast(target)
+
+    def _table(self, arrays):
+        return self._pa.Table.from_arrays(
+            [self._convert(array, field.type) for array, field in zip(arrays, self._schema)],
+            schema=self._schema
+        )
+
+    def _rewrite(self, schema):
+        """Переписывает записанные группы строк в файл со схемой schema"""
+        pq = self._pq
+        self._writer.close()
+        previous = self._path + '.tmp'
+        os.replace(self._path, previous)
+        self._schema = schema
+        self._writer = pq.ParquetWriter(self._path, schema)
+        try:
+            written = pq.ParquetFile(previous)
+            for i in range(written.num_row_groups):
+                self._writer.write_table(self._table(written.read_row_group(i).columns))
+        finally:
+            os.remove(previous)
+        self.rewrites += 1
+
+    def write(self, rows):
+        pa, pq = self._pa, self._pq
+        arrays = [self._array([row[i] for row in rows]) for i in range(len(self._columns))]
+
+        if self._writer is None:
+            # Колонки из одних NULL остаются типа null, пока следующая порция не уточнит тип
+            self._schema = pa.schema([pa.field(column, array.type) for column, array in zip(self._columns, arrays)])
+            self._writer = pq.ParquetWriter(self._path, self._schema)
+        else:
+            schema = pa.schema([
+                pa.field(field.name, self._widen(field.type, array.type))
+                for field, array in zip(self._schema, arrays)
+            ])
+            if not schema.equals(self._schema):
+                self._rewrite(schema)
+
+        self._writer.write_table(self._table(arrays))
+
+    def close(self):
+        pa, pq = self._pa, self._pq
+        if self._writer is None:
+            pq.write_table(pa.table({column: pa.array([], pa.string()) for column in self._columns}),
+                           self._path)
+        else:
+            self._writer.close()
+
+
+_WRITERS = {'csv': _CSVWriter, 'jsonl': _JSONLWriter, 'parquet': _ParquetWriter}
+
+
+def export_query(conn, sql, path, fmt=None, params=None, batch_size=10000):
+    """
+    Выполняет запрос и пишет результат в файл порциями по batch_size строк
+
+    В памяти одновременно находится только одна порция, поэтому выгрузка
+    миллионов строк идет с постоянным расходом памяти.
+
+    Args:
+        conn: соединение SQLite
+        sql (str): SELECT запрос
+        path (str): путь к файлу
+        fmt (str or None): 'csv', 'jsonl' или 'parquet' (по умолчанию - по расширению)
+        params: параметры запроса
+        batch_size (int): строк в порции
+
+    Returns:
+        dict: format, path, rows, batches, seconds, rows_per_sec, bytes,
+            schema_rewrites (сколько раз Parquet переписан с расширенными типами)
+    """
+    fmt = (fmt or detect_format(path) or '').lower()
+    if fmt not in _WRITERS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt or path}. Доступны: {', '.join(EXPORT_FORMATS)}")
+    if fmt == 'parquet' and not HAS_PYARROW:
+        raise RuntimeError("Для выгрузки в Parquet установите pyarrow: pip install pyarrow")
+
+    start = time.perf_counter()
+    cursor = conn.execute(sql, params or ())
+    columns = [d[0] for d in cursor.description] if cursor.description else []
+
+    writer = _WRITERS[fmt](path, columns)
+    rows = 0
+    batches = 0
+    try:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            writer.write(batch)
+            rows += len(batch)
+            batches += 1
+    finally:
+        writer.close()
+        cursor.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        'format': fmt,
+        'path': path,
+        'rows': rows,
+        'batches': batches,
+        'seconds': seconds,
+        'rows_per_sec': rows / seconds if seconds else 0.0,
+        'bytes': os.path.getsize(path),
+        'schema_rewrites': getattr(writer, 'rewrites', 0)
+    }
+
+
+def format_export_stats(stats):
+    """Форматирует итог выгрузки"""
+    speed = f"{stats['rows_per_sec']:,.0f}".replace(',', ' ')
+    return (f"💾 Выгружено {stats['rows']} строк в {stats['path']} ({stats['format']}, "
+            f"{stats['bytes'] / 1024 / 1024:.1f} МБ) за {stats['seconds']:.2f}с - {speed} строк/с")
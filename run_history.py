@@ -0,0 +1,341 @@
+"""
+История тестовых прогонов в SQLite и поиск регрессий между прогонами
+
+Каждый прогон SQLTester сохраняется с хэшем коммита и хэшем промтов, по
+каждому тесту - статус, совпадение результата, сходство и время. Сравнение
+прогона с базовым (одним или несколькими) проверяет задержки критерием
+Манна-Уитни, а долю успешных тестов - z-критерием для двух долей; регрессией
+считается изменение, значимое на уровне alpha и превышающее порог.
+"""
+
+import hashlib
+import math
+import subprocess
+from datetime import datetime
+
+from db import open_connection
+
+
+LATENCY_METRICS = ('execution_time', 'llm_time')
+ACCURACY_METRICS = ('success', 'result_match')
+
+
+def get_commit_hash():
+    """Возвращает короткий хэш текущего коммита"""
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def hash_prompt(text):
+    """Короткий хэш текста промта"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def _normal_sf(z):
+    """P(Z > z) для стандартного нормального распределения"""
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def mann_whitney_greater(baseline, candidate):
+    """
+    Односторонний критерий Манна-Уитни: значения candidate больше baseline
+
+    Используется нормальное приближение с поправкой на связи и на
+    непрерывность (достаточно точно уже при 10+ значениях в выборках).
+
+    Returns:
+        tuple: (U для candidate, p-value)
+    """
+    n1, n2 = len(candidate), len(baseline)
+    if not n1 or not n2:
+        return 0.0, 1.0
+
+    values = sorted([(v, 0) for v in candidate] + [(v, 1) for v in baseline])
+    n = n1 + n2
+    rank_sum = 0.0
+    ties = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and values[j + 1][0] == values[i][0]:
+            j += 1
+        rank = (i + j) / 2 + 1
+        size = j - i + 1
+        ties += size ** 3 - size
+        rank_sum += rank * sum(1 for k in range(i, j + 1) if values[k][1] == 0)
+        i = j + 1
+
+    u = rank_sum - n1 * (n1 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return u, _normal_sf(z)
+
+
+def two_proportion_lower(baseline_hits, baseline_total, candidate_hits, candidate_total):
+    """
+    Односторонний z-критерий для двух долей: доля candidate ниже baseline
+
+    Returns:
+        tuple: (z, p-value)
+    """
+    if not baseline_total or not candidate_total:
+        return 0.0, 1.0
+    pooled = (baseline_hits + candidate_hits) / (baseline_total + candidate_total)
+    se = math.sqrt(pooled * (1 - pooled) * (1 / baseline_total + 1 / candidate_total))
+    if se == 0:
+        return 0.0, 1.0
+    z = (baseline_hits / baseline_total - candidate_hits / candidate_total) / se
+    return z, _normal_sf(z)
+
+
+class RunHistory:
+    """
+    Класс для хранения результатов тестовых прогонов в SQLite
+    """
+
+    def __init__(self, path='test_history.db'):
+        self.path = path
+        self.conn = open_connection(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TEXT NOT NULL,
+                commit_hash TEXT,
+                prompt_hash TEXT,
+                model TEXT,
+                prompt_mode TEXT,
+                label TEXT,
+                tests INTEGER NOT NULL,
+                successes INTEGER NOT NULL,
+                matches INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS test_runs (
+                run_id INTEGER NOT NULL REFERENCES runs(run_id),
+                position INTEGER NOT NULL,
+                test_id INTEGER NOT NULL,
+                category TEXT,
+                status TEXT NOT NULL,
+                result_match INTEGER NOT NULL,
+                similarity_score REAL,
+                execution_time REAL,
+                llm_time REAL,
+                prompt_hash TEXT,
+                PRIMARY KEY (run_id, position)
+            );
+        """)
+
+    def record_run(self, results, commit_hash=None, model=None, prompt_mode=None, label=None):
+        """
+        Сохраняет прогон
+
+        Args:
+            results (list): результаты SQLTester.run_single_test()
+            commit_hash (str or None): хэш коммита (по умолчанию - текущий)
+            model (str or None): модель
+            prompt_mode (str or None): режим промта
+            label (str or None): произвольная метка прогона
+
+        Returns:
+            int: номер прогона
+        """
+        # Хэш прогона - по хэшам промтов всех тестов (в порядке тестов)
+        prompt_hashes = [result.get('prompt_hash') or '' for result in results]
+        prompt_hash = hash_prompt("\n".join(prompt_hashes))
+
+        with self.conn:
+            cursor = self.conn.execute("""
+                INSERT INTO runs (started_at, commit_hash, prompt_hash, model, prompt_mode, label,
+                                  tests, successes, matches)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), commit_hash or get_commit_hash(),
+                  prompt_hash, model, prompt_mode, label, len(results),
+                  sum(result['status'] == 'success' for result in results),
+                  sum(bool(result.get('result_match')) for result in results)))
+            run_id = cursor.lastrowid
+            self.conn.executemany("""
+                INSERT INTO test_runs (run_id, position, test_id, category, status, result_match,
+                                       similarity_score, execution_time, llm_time, prompt_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(run_id, position, result['test_id'], result.get('category'), result['status'],
+                   int(bool(result.get('result_match'))), result.get('similarity_score'),
+                   result.get('execution_time'), result.get('llm_time'), result.get('prompt_hash'))
+                  for position, result in enumerate(results)])
+        return run_id
+
+    def list_runs(self, limit=20):
+        """Последние прогоны (новые первыми)"""
+        cursor = self.conn.execute("SELECT * FROM runs ORDER BY run_id DESC LIMIT ?", (limit,))
+        columns = [d[0] for d in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def latest_run_ids(self, count=2):
+        """Номера последних count прогонов (старые первыми)"""
+        rows = self.conn.execute("SELECT run_id FROM runs ORDER BY run_id DESC LIMIT ?", (count,)).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def get_run(self, run_id):
+        """Прогон с результатами тестов или None"""
+        cursor = self.conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        run = dict(zip([d[0] for d in cursor.description], row))
+
+        cursor = self.conn.execute("SELECT * FROM test_runs WHERE run_id = ? ORDER BY position", (run_id,))
+        columns = [d[0] for d in cursor.description]
+        run['results'] = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return run
+
+    def compare(self, baseline_ids, candidate_id, alpha=0.05, latency_threshold=0.1, accuracy_threshold=0.0):
+        """
+        Сравнивает прогон с базовыми прогонами
+
+        Результаты нескольких базовых прогонов объединяются в одну выборку.
+
+        Args:
+            baseline_ids (list): номера базовых прогонов
+            candidate_id (int): номер проверяемого прогона
+            alpha (float): уровень значимости
+            latency_threshold (float): минимальный относительный рост медианы задержки
+            accuracy_threshold (float): минимальное падение доли успешных тестов
+
+        Returns:
+            dict: baseline, candidate, latency, accuracy, flipped (тесты, успешные во всех
+                базовых прогонах и неуспешные в проверяемом), regressions
+        """
+        baselines = [self.get_run(run_id) for run_id in baseline_ids]
+        candidate = self.get_run(candidate_id)
+        missing = [run_id for run_id, run in zip(list(baseline_ids) + [candidate_id], baselines + [candidate])
+                   if run is None]
+        if missing:
+            raise ValueError(f"Прогоны не найдены: {', '.join(map(str, missing))}")
+
+        baseline_results = [result for run in baselines for result in run['results']]
+        candidate_results = candidate['results']
+        regressions = []
+
+        latency = {}
+        for metric in LATENCY_METRICS:
+            before = [r[metric] for r in baseline_results if r[metric] is not None]
+            after = [r[metric] for r in candidate_results if r[metric] is not None]
+            u, p_value = mann_whitney_greater(before, after)
+            before_median = _median(before)
+            after_median = _median(after)
+            change = (after_median - before_median) / before_median if before_median else 0.0
+            regression = p_value < alpha and change > latency_threshold
+            latency[metric] = {
+                'baseline_median': before_median,
+                'candidate_median': after_median,
+                'change': change,
+                'u': u,
+                'p_value': p_value,
+                'regression': regression
+            }
+            if regression:
+                regressions.append(metric)
+
+        accuracy = {}
+        for metric in ACCURACY_METRICS:
+            before = [_is_hit(r, metric) for r in baseline_results]
+            after = [_is_hit(r, metric) for r in candidate_results]
+            z, p_value = two_proportion_lower(sum(before), len(before), sum(after), len(after))
+            before_rate = sum(before) / len(before) if before else 0.0
+            after_rate = sum(after) / len(after) if after else 0.0
+            regression = p_value < alpha and before_rate - after_rate > accuracy_threshold
+            accuracy[metric] = {
+                'baseline_rate': before_rate,
+                'candidate_rate': after_rate,
+                'z': z,
+                'p_value': p_value,
+                'regression': regression
+            }
+            if regression:
+                regressions.append(metric)
+
+        always_passed = None
+        for run in baselines:
+            passed = {r['test_id'] for r in run['results'] if r['status'] == 'success'}
+            always_passed = passed if always_passed is None else always_passed & passed
+        flipped = sorted({r['test_id'] for r in candidate_results
+                          if r['test_id'] in always_passed and r['status'] != 'success'})
+
+        return {
+            'baseline': [{k: v for k, v in run.items() if k != 'results'} for run in baselines],
+            'candidate': {k: v for k, v in candidate.items() if k != 'results'},
+            'alpha': alpha,
+            'latency_threshold': latency_threshold,
+            'accuracy_threshold': accuracy_threshold,
+            'latency': latency,
+            'accuracy': accuracy,
+            'flipped': flipped,
+            'regressions': regressions
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+def _median(values):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def _is_hit(result, metric):
+    if metric == 'success':
+        return result['status'] == 'success'
+    return bool(result[metric])
+
+
+def format_runs(runs):
+    """Форматирует список прогонов"""
+    if not runs:
+        return "История прогонов пуста."
+    lines = ["  №  | дата                | коммит   | промт        | успех | совпало | метка"]
+    for run in runs:
+        lines.append(f"  {run['run_id']:<3}| {run['started_at']} | {run['commit_hash'] or '-':<8} | "
+                     f"{run['prompt_hash'] or '-':<12} | {run['successes']:>2}/{run['tests']:<2} | "
+                     f"{run['matches']:>2}/{run['tests']:<4} | {run['label'] or ''}")
+    return "\n".join(lines)
+
+
+def format_comparison(comparison):
+    """Форматирует итог сравнения прогонов"""
+    candidate = comparison['candidate']
+    baseline_ids = ", ".join(str(run['run_id']) for run in comparison['baseline'])
+    baseline_commits = ", ".join(sorted({run['commit_hash'] or '-' for run in comparison['baseline']}))
+    baseline_prompts = {run['prompt_hash'] for run in comparison['baseline']}
+
+    lines = [
+        f"📊 Прогон {candidate['run_id']} (коммит {candidate['commit_hash']}) "
+        f"против базовых {baseline_ids} (коммит {baseline_commits})",
+        f"  Промты: {'не изменились' if baseline_prompts == {candidate['prompt_hash']} else 'изменились'}",
+        f"  Задержки (медиана, критерий Манна-Уитни, порог +{comparison['latency_threshold']:.0%}):"
+    ]
+    for metric, stats in comparison['latency'].items():
+        mark = "❌ регрессия" if stats['regression'] else "✅"
+        lines.append(f"    {metric}: {stats['baseline_median']:.3f}с -> {stats['candidate_median']:.3f}с "
+                     f"({stats['change']:+.1%}, p={stats['p_value']:.4f}) {mark}")
+
+    lines.append(f"  Точность (z-критерий для долей, порог -{comparison['accuracy_threshold']:.0%}):")
+    for metric, stats in comparison['accuracy'].items():
+        mark = "❌ регрессия" if stats['regression'] else "✅"
+        lines.append(f"    {metric}: {stats['baseline_rate']:.1%} -> {stats['candidate_rate']:.1%} "
+                     f"(p={stats['p_value']:.4f}) {mark}")
+
+    if comparison['flipped']:
+        lines.append(f"  Перестали проходить тесты: {', '.join(f'#{t}' for t in comparison['flipped'])}")
+
+    if comparison['regressions']:
+        lines.append(f"❌ Найдены регрессии (alpha={comparison['alpha']}): {', '.join(comparison['regressions'])}")
+    else:
+        lines.append(f"✅ Значимых регрессий нет (alpha={comparison['alpha']})")
+    return "\n".join(lines)
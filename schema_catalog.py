@@ -0,0 +1,134 @@
+"""
+Каталог таблиц с поиском схем, относящихся к вопросу пользователя
+"""
+
+from metrics import pipeline_metrics
+from table_analyzer import TableAnalyzer
+from text_index import TfidfIndex
+
+
+class SchemaCatalog:
+    """
+    Класс для профилирования нескольких таблиц и отбора релевантных схем.
+
+    По описаниям таблиц и колонок (названия, описания, частые значения)
+    строится локальный индекс TF-IDF. В промт попадают только таблицы,
+    наиболее близкие к вопросу: не больше max_tables и не длиннее
+    max_schema_chars символов, поэтому размер промта не растет вместе с каталогом.
+    """
+
+    def __init__(self, db_path, table_names, descriptions=None, max_tables=3, max_schema_chars=6000):
+        self.db_path = db_path
+        self.analyzers = {name: TableAnalyzer(db_path, name) for name in table_names}
+        self.descriptions = descriptions or {}
+        self.max_tables = max_tables
+        self.max_schema_chars = max_schema_chars
+        self.index = None
+
+    @property
+    def is_multi_table(self):
+        return len(self.analyzers) > 1
+
+    def analyze(self):
+        """Анализирует все таблицы каталога и строит индекс; возвращает список проанализированных"""
+        analyzed = []
+        for name, analyzer in self.analyzers.items():
+            if not analyzer.connect():
+                continue
+            with pipeline_metrics.stage('analyze'):
+                analyzer.analyze_column_values()
+            analyzer.disconnect()
+            if analyzer.column_info:
+                analyzed.append(name)
+
+        self.build_index()
+        return analyzed
+
+    def build_index(self):
+        """Строит индекс по описаниям таблиц и колонок"""
+        index = TfidfIndex()
+
+        for table, analyzer in self.analyzers.items():
+            description = self.descriptions.get(table, {})
+            column_descriptions = description.get('columns', {})
+
+            index.add(('table', table), " ".join(
+                [table, description.get('description', '')] + list(analyzer.column_info)
+            ))
+
+            # Значения текстовых колонок - из их профилей, посчитанных одним пакетом
+            analyzer.profile_columns([column for column, info in analyzer.column_info.items()
+                                      if not info['is_numeric']])
+            for column, info in analyzer.column_info.items():
+                values = [] if info['is_numeric'] else [str(v) for v in info['unique_values'][:20]]
+                index.add(('column', table, column), " ".join(
+                    [column, column_descriptions.get(column, '')] + values
+                ))
+
+        self.index = index
+
+    def rank_tables(self, question, columns_per_table=3):
+        """
+        Ранжирует таблицы по близости к вопросу
+
+        Оценка таблицы - близость ее описания плюс сумма близостей
+        нескольких лучших колонок.
+        """
+        if self.index is None or not question:
+            return list(self.analyzers)
+
+        table_scores = {}
+        column_scores = {}
+        for doc_id, score, _ in self.index.query(question, k=len(self.index), min_score=0.0):
+            table = doc_id[1]
+            if doc_id[0] == 'table':
+                table_scores[table] = table_scores.get(table, 0.0) + score
+            else:
+                column_scores.setdefault(table, []).append(score)
+
+        for table, scores in column_scores.items():
+            best = sorted(scores, reverse=True)[:columns_per_table]
+            table_scores[table] = table_scores.get(table, 0.0) + sum(best)
+
+        ranked = sorted(table_scores, key=lambda t: table_scores[t], reverse=True)
+        return ranked or list(self.analyzers)
+
+    def select_tables(self, question):
+        """Возвращает таблицы для промта (не больше max_tables)"""
+        return self.rank_tables(question)[:self.max_tables]
+
+    def build_schema_prompt(self, question=None, include_values=True, max_values=30):
+        """Собирает схемы релевантных таблиц в пределах max_schema_chars"""
+        return "".join(text for _, text in self.schema_prompt_parts(question, include_values, max_values))
+
+    def schema_prompt_parts(self, question=None, include_values=True, max_values=30):
+        """
+        Части промта со схемами релевантных таблиц по компонентам
+
+        Args:
+            question (str or None): вопрос для отбора таблиц
+            include_values (bool): добавлять списки возможных значений колонок
+            max_values (int): сколько значений перечислять в схеме колонки
+
+        Returns:
+            list: [(компонент 'schema', 'values' или 'rules', текст), ...]
+        """
+        parts = []
+        used = 0
+
+        for table in self.select_tables(question):
+            analyzer = self.analyzers[table]
+            schema = analyzer.generate_prompt_schema(max_values)
+            values = "\n" + analyzer.generate_system_prompt_addition(False) if include_values else ""
+            size = len(schema) + len(values)
+            if parts and used + size > self.max_schema_chars:
+                break
+            parts.append(('schema', ("\n\n" if parts else "") + schema))
+            if values:
+                parts.append(('values', values))
+            used += size
+
+        parts.append(('rules', ("\n\n" if parts else "") +
+                      "ОБЯЗАТЕЛЬНО используй только эти таблицы и точные значения при формировании WHERE условий.\n"
+                      "Используй SQLite синтаксис и ROUND() для округления числовых результатов."))
+        return parts
@@ -0,0 +1,212 @@
+"""
+Спекулятивное выполнение вероятных SQL запросов, пока GigaChat формирует ответ
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from data_loader import get_data_version
+from db import open_connection
+from sql_utils import normalize_sql
+
+
+class SpeculativeExecutor:
+    """
+    Класс для фонового выполнения запросов-кандидатов во время вызова LLM.
+
+    start() запускает кандидатов (подсказки PromptBuilder) в отдельном потоке
+    со своим соединением. Результаты кэшируются по версии данных
+    (get_data_version) и нормализованному SQL: если GigaChat вернул один из
+    кандидатов, lookup() отдает готовый результат (или дожидается уже
+    выполняющегося запроса). Когда загрузка данных меняет версию, кэш
+    сбрасывается. cancel() прерывает невостребованные кандидаты через
+    sqlite3.Connection.interrupt().
+
+    Как и ResultPager, кандидат читает только первую страницу результата и
+    одну строку сверх нее (признак следующей страницы), поэтому кэш занимает
+    не больше max_cached * (page_size + 1) строк.
+    """
+
+    def __init__(self, db_path, max_candidates=3, max_cached=64, page_size=20):
+        self.db_path = db_path
+        self.max_candidates = max_candidates
+        self.max_cached = max_cached
+        self.page_size = page_size
+        self._cache = OrderedDict()  # (версия данных, нормализованный SQL) -> (success, results, columns)
+        self._version = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._conn = None
+        self._cancelled = threading.Event()
+        self._pending = []
+        self._running = None
+        self._done = threading.Condition(self._lock)
+        self.stats = {
+            'rounds': 0,
+            'launched': 0,
+            'completed': 0,
+            'cancelled': 0,
+            'cached_reused': 0,
+            'hits': 0,
+            'misses': 0,
+            'invalidated': 0,
+            'speculative_time': 0.0
+        }
+
+    def _key(self, sql):
+        return self._version, normalize_sql(sql)
+
+    def _check_version(self):
+        """Сбрасывает кэш, если данные изменились после прошлого раунда"""
+        conn = open_connection(self.db_path)
+        try:
+            version = get_data_version(conn)
+        except sqlite3.Error:
+            version = self._version
+        finally:
+            conn.close()
+
+        with self._lock:
+            if version != self._version:
+                self.stats['invalidated'] += len(self._cache)
+                self._cache.clear()
+                self._version = version
+
+    def start(self, candidates):
+        """Запускает фоновое выполнение кандидатов (только SELECT), не дожидаясь результата"""
+        self.cancel()
+        self._check_version()
+
+        queue = []
+        seen = set()
+        for sql in candidates:
+            if not sql or not sql.strip().upper().startswith('SELECT'):
+                continue
+            key = self._key(sql)
+            if key in seen:
+                continue
+            seen.add(key)
+            queue.append((key, sql))
+            if len(queue) >= self.max_candidates:
+                break
+
+        with self._lock:
+            self.stats['rounds'] += 1
+            self.stats['cached_reused'] += sum(key in self._cache for key, _ in queue)
+            self._pending = [(key, sql) for key, sql in queue if key not in self._cache]
+            if not self._pending:
+                return
+            self._cancelled.clear()
+
+        self._thread = threading.Thread(target=self._run, name='speculative-sql', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        conn = open_connection(self.db_path, check_same_thread=False)
+        with self._lock:
+            self._conn = conn
+        try:
+            while not self._cancelled.is_set():
+                with self._lock:
+                    if not self._pending:
+                        break
+                    key, sql = self._pending.pop(0)
+                    self._running = key
+                    self.stats['launched'] += 1
+
+                start = time.perf_counter()
+                result = self._execute(conn, sql)
+                elapsed = time.perf_counter() - start
+
+                with self._lock:
+                    self.stats['speculative_time'] += elapsed
+                    self._running = None
+                    if self._cancelled.is_set() and not result[0]:
+                        self.stats['cancelled'] += 1
+                    else:
+                        self.stats['completed'] += 1
+                        self._store(key, result)
+                    self._done.notify_all()
+        finally:
+            with self._lock:
+                self._conn = None
+                self._running = None
+                self._done.notify_all()
+            conn.close()
+
+    def _execute(self, conn, sql):
+        """Первые page_size + 1 строк запроса: (success, строки или ошибка, колонки)"""
+        try:
+            cursor = conn.execute(sql)
+            try:
+                rows = cursor.fetchmany(self.page_size + 1)
+                columns = [d[0] for d in cursor.description] if cursor.description else []
+            finally:
+                cursor.close()
+            return True, rows, columns
+        except Exception as e:
+            return False, str(e), []
+
+    def _store(self, key, result):
+        self._cache[key] = result
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    def lookup(self, sql, timeout=None):
+        """
+        Возвращает (success, results, columns) для SQL, если он был выполнен спекулятивно
+
+        results - не больше page_size + 1 первых строк результата.
+
+        Если этот запрос как раз выполняется в фоне, результат дожидается
+        (не дольше timeout секунд). Иначе - None, и запрос выполняется обычным образом.
+        """
+        key = self._key(sql)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._cache[key]
+
+            if self._running == key:
+                self._done.wait_for(lambda: self._running != key, timeout)
+                if key in self._cache:
+                    self.stats['hits'] += 1
+                    return self._cache[key]
+
+            self.stats['misses'] += 1
+            return None
+
+    def cancel(self):
+        """Прерывает невостребованные кандидаты текущего раунда"""
+        with self._lock:
+            self._cancelled.set()
+            self.stats['cancelled'] += len(self._pending)
+            self._pending = []
+            if self._running is not None and self._conn is not None:
+                self._conn.interrupt()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """Останавливает фоновый поток"""
+        self.cancel()
+
+    @property
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def format_stats(self):
+        """Форматирует статистику спекулятивного выполнения"""
+        stats = self.stats
+        return (f"⚡ Спекулятивное выполнение: попаданий {stats['hits']}/{stats['hits'] + stats['misses']} "
+                f"({self.hit_rate * 100:.1f}%), запущено {stats['launched']}, "
+                f"отменено {stats['cancelled']}, из кэша {stats['cached_reused']}, "
+                f"сброшено при смене данных {stats['invalidated']}, "
+                f"фоновое время {stats['speculative_time'] * 1000:.1f} мс")
@@ -2,38 +2,325 @@
 Общие утилиты для работы с SQL запросами
 """
 
+import json
 import re
 import sqlite3
 
+from result_compare import compare_query_results
+
+
+class SQLStreamExtractor:
+    """
+    Потоковое извлечение SQL запроса из ответа GigaChat за один проход.
+
+    Текст подается порциями через feed(); запрос возвращается, как только он
+    полностью получен:
+    - блок кода ```sql ... ``` (или без языка) - при закрывающем маркере;
+      блоки на другом языке (```python) пропускаются;
+    - запрос без маркеров (SELECT, WITH, INSERT, UPDATE, DELETE), начинающийся
+      с новой строки - при ';', пустой строке или начале блока кода.
+    Запрос внутри текста (не с начала строки) считается запасным вариантом:
+    он возвращается из finish(), если блок кода так и не встретился. Из
+    запасных вариантов выбирается самый надежный: запрос после двоеточия
+    ("Запрос: SELECT ...") - SELECT/WITH, затем INSERT/UPDATE/DELETE, затем
+    SELECT/WITH посреди фразы ("выполните SELECT ..."). INSERT/UPDATE/DELETE
+    посреди фразы ("I will update you") запросом не считаются.
+    Каждый символ просматривается один раз, между порциями хранится только
+    короткий хвост для распознавания ключевых слов и маркеров.
+    """
+
+    KEYWORDS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+    QUERY_KEYWORDS = ('SELECT', 'WITH')
+
+    # Шаблоны начинаются с набора символов: так re быстро пропускает обычный текст
+    _TEXT_EVENT = re.compile(
+        r'[`sSwWiIuUdD](?:(?<=`)``|(?<!\w.)(?:(?<=[sS])(?i:elect)|(?<=[wW])(?i:ith)'
+        r'|(?<=[iI])(?i:nsert)|(?<=[uU])(?i:pdate)|(?<=[dD])(?i:elete))(?!\w))'
+    )
+    _BARE_EVENT = re.compile(r"""['";`\n](?:(?<=`)``|(?<=\n)[ \t\r]*\n|(?<=['";]))""")
+    _FENCE_SQL_TAG = re.compile(r'[ \t]*sql\b', re.IGNORECASE)
+    _FENCE_INFO = re.compile(r'[ \t]*([A-Za-z][\w+#.-]*)[ \t\r]*')
+    _MAX_KEYWORD = 6
+    _MAX_FENCE_INFO = 32
+
+    def __init__(self):
+        self.sql = None
+        self.complete = False
+        self.chars_seen = 0
+        self._state = 'text'
+        self._context = ''  # символ перед необработанным хвостом (для границы слова)
+        self._pending = ''  # необработанный хвост предыдущей порции
+        self._parts = []  # уже прочитанные части захватываемого запроса
+        self._quote = None
+        self._line_start = True
+        self._after_colon = False
+        self._bare_line_start = False
+        self._bare_rank = 0
+        self._fallback = None
+        self._fallback_rank = 0
+
+    def feed(self, chunk):
+        """Добавляет порцию текста; возвращает SQL, если он уже полностью получен"""
+        if self.complete or not chunk:
+            return self.sql
+        self.chars_seen += len(chunk)
+        self._process(self._context + self._pending + chunk, len(self._context), final=False)
+        return self.sql
+
+    def finish(self):
+        """Завершает поток и возвращает извлеченный SQL (или None)"""
+        if not self.complete:
+            self._process(self._context + self._pending, len(self._context), final=True)
+            self._pending = ''
+            if not self.complete and self._fallback:
+                self.sql = self._fallback
+                self.complete = True
+        return self.sql
+
+    def _process(self, text, pos, final):
+        """Обрабатывает текст с позиции pos до конца или до нехватки данных"""
+        self._cap = pos
+        while not self.complete:
+            if self._state == 'text':
+                pos, waiting = self._scan_text(text, pos, final)
+            elif self._state == 'fence_info':
+                pos, waiting = self._scan_fence_info(text, pos, final)
+            elif self._state == 'fence_body':
+                pos, waiting = self._scan_fence_body(text, pos, final)
+            elif self._state == 'fence_skip':
+                pos, waiting = self._scan_fence_skip(text, pos, final)
+            else:
+                pos, waiting = self._scan_bare(text, pos, final)
+
+            if waiting:
+                break
+
+        if self.complete:
+            self._parts = []
+            return
+
+        # Сохраняем захваченную часть и необработанный хвост до следующей порции
+        if self._state in ('bare', 'fence_body') and self._cap < pos:
+            self._parts.append(text[self._cap:pos])
+        self._context = text[pos - 1] if pos > 0 else self._context
+        self._pending = text[pos:]
+
+    def _advance_line_state(self, text, start, end):
+        """
+        Обновляет признаки 'только пробелы с начала строки' и 'последний
+        непробельный символ - двоеточие' для текста [start:end]
+        """
+        segment = text[start:end]
+        newline = segment.rfind('\n')
+        if newline >= 0:
+            self._line_start = not segment[newline + 1:].strip()
+        elif segment.strip():
+            self._line_start = False
+        if segment.strip():
+            self._after_colon = segment.rstrip().endswith(':')
+
+    def _finish_capture(self, text, end):
+        """Возвращает захваченный текст запроса до позиции end"""
+        content = ''.join(self._parts) + text[self._cap:end]
+        self._parts = []
+        return content.strip().rstrip(';')
+
+    def _emit(self, sql):
+        self.sql = sql
+        self.complete = True
+
+    def _scan_text(self, text, pos, final):
+        match = self._TEXT_EVENT.search(text, pos)
+        if match is None:
+            keep = len(text) if final else max(pos, len(text) - self._MAX_KEYWORD)
+            self._advance_line_state(text, pos, keep)
+            return keep, True
+
+        token = match.group(0)
+        if token != '```' and not final and match.end() >= len(text):
+            # Ключевое слово в конце порции может оказаться началом другого слова
+            self._advance_line_state(text, pos, match.start())
+            return match.start(), True
+
+        self._advance_line_state(text, pos, match.start())
+
+        if token == '```':
+            self._state = 'fence_info'
+            return match.end(), False
+
+        # Надежность запасного варианта: после двоеточия SELECT/WITH - 3, остальные - 2;
+        # посреди фразы SELECT/WITH - 1, а INSERT/UPDATE/DELETE ("I will update you")
+        # и строчное with ("with rating" - часть фразы, а не начало CTE) - не запрос
+        is_query = token.upper() in self.QUERY_KEYWORDS
+        if self._line_start or self._after_colon:
+            rank = 3 if is_query else 2
+        elif is_query and token != 'with':
+            rank = 1
+        else:
+            self._line_start = False
+            self._after_colon = False
+            return match.end(), False
+
+        self._state = 'bare'
+        self._bare_line_start = self._line_start
+        self._bare_rank = rank
+        self._quote = None
+        self._cap = match.start()
+        return match.end(), False
+
+    def _scan_fence_info(self, text, pos, final):
+        newline = text.find('\n', pos)
+        if newline < 0 and not final and len(text) - pos < self._MAX_FENCE_INFO:
+            return pos, True
+
+        line_end = newline if newline >= 0 else len(text)
+        line = text[pos:line_end]
+
+        sql_tag = self._FENCE_SQL_TAG.match(line)
+        info = self._FENCE_INFO.fullmatch(line)
+        if sql_tag:
+            content_start = pos + sql_tag.end()
+        elif info and info.group(1).upper() not in self.KEYWORDS:
+            # Блок на другом языке (```python, ```json) - не SQL
+            self._state = 'fence_skip'
+            return line_end, False
+        else:
+            content_start = pos
+
+        self._state = 'fence_body'
+        self._cap = content_start
+        return content_start, False
+
+    def _scan_fence_skip(self, text, pos, final):
+        end = text.find('```', pos)
+        if end < 0:
+            if final:
+                self._state = 'text'
+                return len(text), True
+            return max(pos, len(text) - 2), True
+
+        self._state = 'text'
+        self._line_start = False
+        self._after_colon = False
+        return end + 3, False
+
+    def _scan_fence_body(self, text, pos, final):
+        end = text.find('```', pos)
+        if end < 0:
+            if final:
+                # Незакрытый блок кода (например, ответ обрезан по длине)
+                sql = self._finish_capture(text, len(text))
+                if sql:
+                    self._emit(sql)
+                self._state = 'text'
+                return len(text), True
+            return max(pos, len(text) - 2), True
+
+        sql = self._finish_capture(text, end)
+        if sql:
+            self._emit(sql)
+        self._state = 'text'
+        self._line_start = False
+        return end + 3, False
+
+    def _scan_bare(self, text, pos, final):
+        while True:
+            if self._quote:
+                end = text.find(self._quote, pos)
+                if end < 0:
+                    if final:
+                        return self._end_bare(text, len(text), len(text), True)
+                    return len(text), True
+                self._quote = None
+                pos = end + 1
+                continue
+
+            match = self._BARE_EVENT.search(text, pos)
+            if match is None:
+                if final:
+                    return self._end_bare(text, len(text), len(text), True)
+                keep = len(text) - 2
+                newline = text.rfind('\n', pos)
+                if newline >= 0 and not text[newline + 1:].strip():
+                    keep = min(keep, newline)
+                return max(pos, keep), True
+
+            token = match.group(0)
+            if token in ("'", '"'):
+                self._quote = token
+                pos = match.end()
+            elif token == ';':
+                return self._end_bare(text, match.start(), match.end(), False)
+            else:
+                # Начало блока кода или пустая строка завершают запрос
+                return self._end_bare(text, match.start(), match.start(), token != '```')
+
+    def _end_bare(self, text, end, resume, line_start):
+        """Завершает запрос без маркеров"""
+        sql = self._finish_capture(text, end)
+        self._state = 'text'
+        self._line_start = line_start
+
+        self._after_colon = False
+
+        if self._bare_line_start:
+            self._emit(sql)
+        elif self._fallback is None or self._bare_rank > self._fallback_rank:
+            self._fallback = sql
+            self._fallback_rank = self._bare_rank
+        return resume, False
+
+
+def parse_sql_json(text):
+    """
+    Извлекает SQL из структурированного ответа {"sql": "..."} (в том числе в блоке ```json)
+
+    Returns:
+        str or None: запрос или None, если ответ не такой JSON объект
+    """
+    start = text.find('{')
+    end = text.rfind('}')
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    sql = data.get('sql') if isinstance(data, dict) else None
+    if not isinstance(sql, str) or not sql.strip():
+        return None
+    return sql.strip().rstrip(';')
+
 
 def extract_sql_query(text):
     """
-    Извлекает SQL запрос из текста ответа GigaChat
+    Извлекает SQL запрос из текста ответа GigaChat (блок кода, запрос без
+    маркеров или JSON объект {"sql": "..."})
     """
-    # Упрощенный подход - ищем SQL между маркерами или ключевые слова
-    sql_match = re.search(r'```(?:sql)?\s*(.*?)\s*```', text, re.DOTALL | re.IGNORECASE)
-    if sql_match:
-        return sql_match.group(1).strip().rstrip(';')
+    if not text:
+        return None
 
-    # Если не нашли в блоке кода, ищем SQL команды
-    for keyword in ['SELECT', 'INSERT', 'UPDATE', 'DELETE']:
-        pattern = f'({keyword}.*?)(?:;|$)'
-        match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
-        if match:
-            return match.group(1).strip().rstrip(';')
+    if '"sql"' in text:
+        sql = parse_sql_json(text)
+        if sql:
+            return sql
 
-    return None
+    extractor = SQLStreamExtractor()
+    extractor.feed(text)
+    return extractor.finish()
 
 
-def execute_sql_safely(conn, query):
+def execute_sql_safely(conn, query, params=None):
     """
     Безопасно выполняет SQL запрос
+
+    params - значения для плейсхолдеров '?' (параметризованные запросы IntentRouter)
     """
     try:
         cursor = conn.cursor()
-        cursor.execute(query)
+        cursor.execute(query, params or ())
 
-        if query.upper().strip().startswith('SELECT'):
+        if query.upper().strip().startswith(('SELECT', 'WITH')):
             results = cursor.fetchall()
             columns = [desc[0] for desc in cursor.description] if cursor.description else []
             return True, results, columns
@@ -64,9 +351,13 @@ def normalize_sql(sql):
     return normalized.strip()
 
 
-def compare_sql_queries(generated_sql, expected_sql, table_name):
+def compare_sql_queries(generated_sql, expected_sql, table_name, conn=None, result_check=None):
     """
     Сравнивает сгенерированный и ожидаемый SQL запросы
+
+    Если передано соединение conn (или готовый результат compare_query_results),
+    запросы сравниваются по результатам выполнения: совпавшие наборы строк дают
+    "result_match", различающиеся - "result_mismatch" с текстовой оценкой схожести.
     """
     gen_norm = normalize_sql(generated_sql).lower()
     exp_norm = normalize_sql(expected_sql).lower()
@@ -75,6 +366,13 @@ def compare_sql_queries(generated_sql, expected_sql, table_name):
     if gen_norm == exp_norm:
         return "exact_match", 100
 
+    # Сравнение по результатам выполнения
+    if result_check is None and conn is not None:
+        result_check = compare_query_results(conn, generated_sql, expected_sql)
+
+    if result_check is not None and result_check['equivalent']:
+        return "result_match", 100
+
     # Подсчет схожести по ключевым элементам
     elements = {
         'select': 15,
@@ -98,6 +396,9 @@ def compare_sql_queries(generated_sql, expected_sql, table_name):
 
     similarity_percent = min(100, (score / max_score) * 100)
 
+    if result_check is not None and not result_check['expected_error']:
+        return "result_mismatch", similarity_percent
+
     if similarity_percent >= 80:
         return "high_similarity", similarity_percent
     elif similarity_percent >= 60:
@@ -106,16 +407,19 @@ def compare_sql_queries(generated_sql, expected_sql, table_name):
         return "low_similarity", similarity_percent
 
 
-def format_sql_results(success, results, columns, query, limit_rows=20):
+def format_sql_results(success, results, columns, query, limit_rows=20, has_more=False):
     """
     Форматирует результаты выполнения SQL запроса
+
+    has_more=True - results содержит только первую страницу результата
+    (ResultPager), остальные строки доступны командой 'next'.
     """
     if not success:
         return f"❌ Ошибка выполнения SQL запроса: {results}"
 
     output = [f"\n📝 SQL запрос: {query}"]
 
-    if query.upper().strip().startswith('SELECT'):
+    if query.upper().strip().startswith(('SELECT', 'WITH')):
         if not results:
             output.append("Запрос выполнен, но результатов не найдено.")
         else:
@@ -132,10 +436,14 @@ def format_sql_results(success, results, columns, query, limit_rows=20):
             for i, row in enumerate(results[:limit_rows]):
                 output.append(" | ".join(str(item) for item in row))
 
-            if len(results) > limit_rows:
-                output.append(f"... и ещё {len(results) - limit_rows} строк")
+            if has_more:
+                output.append("... есть ещё строки ('next' - следующая страница)")
+                output.append(f"\nПоказано записей: {min(len(results), limit_rows)}")
+            else:
+                if len(results) > limit_rows:
+                    output.append(f"... и ещё {len(results) - limit_rows} строк")
 
-            output.append(f"\nВсего записей: {len(results)}")
+                output.append(f"\nВсего записей: {len(results)}")
     else:
         output.append(f"Запрос выполнен успешно. Затронуто записей: {results}")
 
@@ -0,0 +1,318 @@
+"""
+Схема хранения загружаемых таблиц: типизированные STRICT колонки и словари значений
+
+df.to_sql() сам выбирает типы колонок и хранит повторяющиеся строки
+(платформа, категория работ, регион, способ оплаты) в каждой записи.
+Типизированная схема хранения:
+- данные лежат в STRICT таблице "<таблица>__data", типы колонок (INTEGER,
+  REAL, TEXT, ANY) берутся из типов колонок DataFrame;
+- текстовые колонки с небольшим числом различных значений хранятся как
+  INTEGER ссылки на таблицы-словари "<таблица>__dict__<колонка>" (id, value);
+- представление (VIEW) с исходным именем таблицы и исходными именами колонок
+  раскодирует значения, поэтому сгенерированный SQL не меняется.
+
+Значения словарей до CASE_MAX_VALUES штук встроены в представление выражением
+CASE: раскодирование не обращается к словарю, SQLite вычисляет выражение только
+для колонок, которые использует запрос, и план запроса не меняется (внутри
+представления таблица данных названа именем представления, так что
+QueryCostGuard видит знакомое имя таблицы). Большие словари раскодируются
+коррелированным подзапросом.
+
+Строки добавляются только через insert_rows() (загрузчик data_loader): он
+кодирует значения и пересоздает представление, если в словари добавились
+значения. Представление доступно только для чтения, как и сгенерированный SQL.
+Схема описана в таблице _storage_schema. TYPED_STORAGE=0 возвращает прежнюю
+схему (обычная таблица, как у to_sql).
+"""
+
+import os
+import sqlite3
+
+
+SCHEMA_TABLE = '_storage_schema'
+DICTIONARY_MAX_VALUES = 1000  # больше различных значений - колонка хранится как есть
+DICTIONARY_MAX_RATIO = 0.5    # и не больше этой доли от числа строк
+CASE_MAX_VALUES = 64          # словари до этого размера встраиваются в представление
+
+# STRICT таблицы появились в SQLite 3.37; в старых версиях типы задают только приоритет
+STRICT = sqlite3.sqlite_version_info >= (3, 37, 0)
+
+
+def _quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def typed_storage_enabled():
+    """Используется ли типизированная схема (TYPED_STORAGE=0 отключает ее)"""
+    return os.environ.get('TYPED_STORAGE', '1') != '0'
+
+
+def data_table(table):
+    """Имя таблицы с данными типизированной схемы"""
+    return f"{table}__data"
+
+
+def dictionary_table(table, column):
+    """Имя таблицы-словаря колонки"""
+    return f"{table}__dict__{column}"
+
+
+def frame_rows(frame):
+    """Строки DataFrame для executemany (NaN -> NULL, типы numpy -> Python)"""
+    return list(frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None))
+
+
+def plan_columns(frame, max_values=DICTIONARY_MAX_VALUES, max_ratio=DICTIONARY_MAX_RATIO):
+    """
+    Выбирает тип хранения колонок по DataFrame
+
+    Returns:
+        list: [{'name', 'type', 'dictionary'}, ...] в порядке колонок
+    """
+    columns = []
+    for name in frame.columns:
+        series = frame[name]
+        values = series.dropna()
+        kind = series.dtype.kind
+        if kind in 'iub':
+            column_type = 'INTEGER'
+        elif kind == 'f':
+            column_type = 'REAL'
+        elif kind == 'O' and len(values) and values.map(type).eq(str).all():
+            column_type = 'TEXT'
+        else:
+            column_type = 'ANY'  # пустая или смешанная колонка: значения хранятся как есть
+
+        dictionary = False
+        if column_type == 'TEXT':
+            distinct = values.nunique()
+            dictionary = distinct <= max_values and distinct <= max_ratio * len(series)
+        columns.append({'name': str(name), 'type': column_type, 'dictionary': bool(dictionary)})
+    return columns
+
+
+def read_columns(conn, table):
+    """Колонки типизированной схемы таблицы (пустой список - схема не типизированная)"""
+    try:
+        cursor = conn.execute(f"""
+            SELECT column_name, column_type, dictionary FROM {SCHEMA_TABLE}
+            WHERE table_name = ? ORDER BY position
+        """, (table,))
+    except sqlite3.OperationalError:
+        return []  # таблица схемы еще не создавалась
+    return [{'name': name, 'type': column_type, 'dictionary': bool(dictionary)}
+            for name, column_type, dictionary in cursor.fetchall()]
+
+
+def storage_layout(conn, table):
+    """'typed', 'plain' или None, если таблицы нет"""
+    if read_columns(conn, table):
+        return 'typed'
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ? AND type IN ('table', 'view')",
+                       (table,)).fetchone()
+    return 'plain' if row else None
+
+
+def physical_table(conn, table):
+    """Таблица, в которой лежат строки (для ANALYZE и подсчета строк)"""
+    return data_table(table) if read_columns(conn, table) else table
+
+
+def drop_storage(conn, table):
+    """Удаляет таблицу или представление вместе с таблицей данных и словарями"""
+    for column in read_columns(conn, table):
+        if column['dictionary']:
+            conn.execute(f"DROP TABLE IF EXISTS {_quote_identifier(dictionary_table(table, column['name']))}")
+    conn.execute(f"DROP TABLE IF EXISTS {_quote_identifier(data_table(table))}")
+
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ? AND type IN ('table', 'view')",
+                       (table,)).fetchone()
+    if row:
+        conn.execute(f"DROP {row[0].upper()} {_quote_identifier(table)}")
+    try:
+        conn.execute(f"DELETE FROM {SCHEMA_TABLE} WHERE table_name = ?", (table,))
+    except sqlite3.OperationalError:
+        pass
+
+
+def create_storage(conn, table, frame, typed=None):
+    """
+    Пересоздает таблицу по колонкам DataFrame
+
+    Args:
+        conn: соединение SQLite (транзакцией управляет вызывающий код)
+        table (str): имя таблицы (в типизированной схеме - имя представления)
+        frame: DataFrame, по которому выбираются типы колонок
+        typed (bool or None): типизированная схема (None - по TYPED_STORAGE)
+
+    Returns:
+        list: колонки типизированной схемы (пустой список для обычной таблицы)
+    """
+    typed = typed_storage_enabled() if typed is None else typed
+    drop_storage(conn, table)
+    if not typed:
+        import pandas as pd
+
+        conn.execute(pd.io.sql.get_schema(frame, table))
+        return []
+
+    columns = plan_columns(frame)
+    strict = " STRICT" if STRICT else ""
+
+    definitions = []
+    for column in columns:
+        name = _quote_identifier(column['name'])
+        if column['dictionary']:
+            lookup = _quote_identifier(dictionary_table(table, column['name']))
+            conn.execute(f"CREATE TABLE {lookup} (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE){strict}")
+            definitions.append(f"{name} INTEGER")
+        elif STRICT or column['type'] != 'ANY':
+            definitions.append(f"{name} {column['type']}")
+        else:
+            definitions.append(name)  # без STRICT тип ANY дал бы колонке числовую приоритетность
+
+    conn.execute(f"CREATE TABLE {_quote_identifier(data_table(table))} ({', '.join(definitions)}){strict}")
+    _create_view(conn, table, columns)
+
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} (
+            table_name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            column_name TEXT NOT NULL,
+            column_type TEXT NOT NULL,
+            dictionary INTEGER NOT NULL,
+            PRIMARY KEY (table_name, position)
+        )
+    """)
+    conn.executemany(f"INSERT INTO {SCHEMA_TABLE} VALUES (?, ?, ?, ?, ?)",
+                     [(table, i, c['name'], c['type'], int(c['dictionary'])) for i, c in enumerate(columns)])
+    return columns
+
+
+def _create_view(conn, table, columns):
+    """(Пере)создает представление, раскодирующее словари"""
+    view = _quote_identifier(table)
+    select = []
+    for column in columns:
+        name = _quote_identifier(column['name'])
+        if not column['dictionary']:
+            select.append(f"{view}.{name}")
+            continue
+        lookup = _quote_identifier(dictionary_table(table, column['name']))
+        values = conn.execute(f"SELECT id, value FROM {lookup} ORDER BY id LIMIT ?",
+                              (CASE_MAX_VALUES + 1,)).fetchall()
+        if not values:
+            decode = "NULL"
+        elif len(values) <= CASE_MAX_VALUES:
+            branches = " ".join(f"WHEN {code} THEN '{value.replace(chr(39), chr(39) * 2)}'"
+                                for code, value in values)
+            decode = f"CASE {view}.{name} {branches} END"
+        else:
+            decode = f"(SELECT value FROM {lookup} WHERE id = {view}.{name})"
+        select.append(f"{decode} AS {name}")
+
+    conn.execute(f"DROP VIEW IF EXISTS {view}")
+    conn.execute(f"CREATE VIEW {view} AS SELECT {', '.join(select)} "
+                 f"FROM {_quote_identifier(data_table(table))} AS {view}")
+
+
+def insert_rows(conn, table, rows):
+    """
+    Добавляет строки в таблицу
+
+    В типизированной схеме значения словарных колонок заменяются кодами
+    (новые значения дописываются в словари) и строки пишутся в таблицу
+    данных; если словари пополнились, представление пересоздается с новыми
+    значениями.
+
+    Args:
+        conn: соединение SQLite (транзакцией управляет вызывающий код)
+        table (str): имя таблицы
+        rows (list): кортежи значений в порядке колонок таблицы
+
+    Returns:
+        int: число добавленных строк
+    """
+    if not rows:
+        return 0
+
+    columns = read_columns(conn, table)
+    target = data_table(table) if columns else table
+    if any(column['dictionary'] for column in columns):
+        values = [list(column) for column in zip(*rows)]
+        added = 0
+        for i, column in enumerate(columns):
+            if column['dictionary']:
+                values[i], new = _encode(conn, dictionary_table(table, column['name']), values[i])
+                added += new
+        rows = list(zip(*values))
+        if added:
+            _create_view(conn, table, columns)
+
+    placeholders = ", ".join("?" * len(rows[0]))
+    conn.executemany(f"INSERT INTO {_quote_identifier(target)} VALUES ({placeholders})", rows)
+    return len(rows)
+
+
+def _encode(conn, lookup, values):
+    """
+    Заменяет значения кодами словаря lookup, дописывая в него новые значения
+
+    Returns:
+        tuple: (коды, число новых значений словаря)
+    """
+    codes = dict(conn.execute(f"SELECT value, id FROM {_quote_identifier(lookup)}").fetchall())
+    # Как и колонка TEXT обычной таблицы, словарь хранит числа в текстовом виде
+    values = [value if value is None or type(value) is str else str(value) for value in values]
+    new = sorted(set(values).difference(codes, [None]))
+    if new:
+        next_id = max(codes.values(), default=0) + 1
+        added = {value: next_id + i for i, value in enumerate(new)}
+        conn.executemany(f"INSERT INTO {_quote_identifier(lookup)} (id, value) VALUES (?, ?)",
+                         [(code, value) for value, code in added.items()])
+        codes.update(added)
+    codes[None] = None
+    return [codes[value] for value in values], len(new)
+
+
+def load_frame(conn, table, frame, typed=None):
+    """
+    Пересоздает таблицу и загружает в нее DataFrame одной транзакцией
+
+    Замена df.to_sql(table, conn, if_exists='replace', index=False) с учетом схемы хранения.
+
+    Returns:
+        int: число загруженных строк
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN")
+    try:
+        create_storage(conn, table, frame, typed)
+        count = insert_rows(conn, table, frame_rows(frame))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return count
+
+
+def storage_size(conn, table):
+    """
+    Размер таблицы на диске по dbstat (байты) или None, если dbstat недоступен
+
+    В типизированной схеме учитываются таблица данных, словари и их индексы.
+    """
+    names = [table]
+    columns = read_columns(conn, table)
+    if columns:
+        names = [data_table(table)] + [dictionary_table(table, c['name']) for c in columns if c['dictionary']]
+    placeholders = ", ".join("?" * len(names))
+    try:
+        row = conn.execute(f"""
+            SELECT SUM(pgsize) FROM dbstat WHERE name IN ({placeholders})
+               OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN ({placeholders}))
+        """, names + names).fetchone()
+    except sqlite3.OperationalError:
+        return None  # SQLite собран без SQLITE_ENABLE_DBSTAT_VTAB
+    return row[0]
@@ -0,0 +1,207 @@
+"""
+Заглушка чат-модели, воспроизводящая записанные ответы GigaChat без сети
+"""
+
+import json
+import random
+import re
+import threading
+import time
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from token_usage import estimate_tokens
+
+
+def _normalize_question(text):
+    """Нормализует текст вопроса для поиска записанного ответа"""
+    return re.sub(r'\s+', ' ', text or '').strip().lower()
+
+
+class ReplayChatModel:
+    """
+    Чат-модель, возвращающая записанные ответы по тексту вопроса.
+
+    Поддерживает тот же вызов invoke(messages), что и GigaChat, и имитирует
+    задержку сети: фиксированную, со случайным разбросом (с фиксированным seed),
+    пропорциональную длине ответа или записанную в файле результатов. Для
+    проверки сроков ответа и дублирования запросов доля tail_rate ответов
+    задерживается еще на tail_latency секунд, а доля error_rate вызовов
+    завершается ConnectionError.
+
+    Параметры вызова max_tokens и stop (если supports_stop) применяются к
+    записанному ответу так же, как их применяет модель при генерации. stream()
+    возвращает ответ порциями по stream_chunk_chars символов: задержка до первой
+    порции, затем per_token_latency на каждый токен порции.
+    """
+
+    DEFAULT_RESPONSE = "Не могу сформировать SQL запрос для этого вопроса."
+
+    def __init__(self, responses, latency=0.0, jitter=0.0, per_token_latency=0.0,
+                 recorded_latencies=None, latency_scale=1.0, default_response=None, seed=0,
+                 per_prompt_token_latency=0.0, tail_rate=0.0, tail_latency=0.0, error_rate=0.0,
+                 supports_stop=True, stream_chunk_chars=16):
+        self.responses = {_normalize_question(q): r for q, r in responses.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.per_token_latency = per_token_latency
+        self.per_prompt_token_latency = per_prompt_token_latency
+        self.recorded_latencies = {_normalize_question(q): t for q, t in (recorded_latencies or {}).items()}
+        self.latency_scale = latency_scale
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.error_rate = error_rate
+        self.supports_stop = supports_stop
+        self.stream_chunk_chars = stream_chunk_chars
+        self.default_response = default_response if default_response is not None else self.DEFAULT_RESPONSE
+        self.calls = 0
+        self.misses = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Блокировку нельзя передать в другой процесс - она создается заново
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_test_cases(cls, test_cases, **kwargs):
+        """Создает модель, отвечающую эталонным SQL из тестовых случаев"""
+        responses = {t['question']: f"```sql\n{t['expected_sql']}\n```" for t in test_cases}
+        return cls(responses, **kwargs)
+
+    @classmethod
+    def from_results_file(cls, filename, replay_latency=True, **kwargs):
+        """
+        Создает модель из файла test_results_*.txt (save_results_to_file).
+
+        Сгенерированный SQL каждого теста становится ответом модели, а время
+        выполнения - записанной задержкой (если replay_latency=True).
+        """
+        responses = {}
+        latencies = {}
+        question = None
+        sql_lines = None
+
+        field_prefixes = ('Категория:', 'Статус:', 'Ожидаемый SQL:', 'Схожесть:',
+                          'Время выполнения:', 'Ошибка:', '-----')
+
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+
+                if sql_lines is not None and (line.startswith(field_prefixes) or line.startswith('Тест #')):
+                    responses[question] = "```sql\n" + "\n".join(sql_lines).strip() + "\n```"
+                    sql_lines = None
+
+                test_match = re.match(r'Тест #\d+: (.*)', line)
+                if test_match:
+                    question = test_match.group(1)
+                elif line.startswith('Сгенерированный SQL:') and question:
+                    sql_lines = [line[len('Сгенерированный SQL:'):].strip()]
+                elif sql_lines is not None:
+                    sql_lines.append(line)
+                elif line.startswith('Время выполнения:') and question:
+                    latencies[question] = float(line.split(':', 1)[1].strip().rstrip('с'))
+
+        if sql_lines is not None and question:
+            responses[question] = "```sql\n" + "\n".join(sql_lines).strip() + "\n```"
+
+        if replay_latency:
+            kwargs.setdefault('recorded_latencies', latencies)
+        return cls(responses, **kwargs)
+
+    @classmethod
+    def from_json(cls, filename, **kwargs):
+        """Загружает записанные ответы из JSON файла {вопрос: ответ}"""
+        with open(filename, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), **kwargs)
+
+    def save_json(self, filename):
+        """Сохраняет записанные ответы в JSON файл"""
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.responses, f, ensure_ascii=False, indent=2)
+
+    def _last_question(self, messages):
+        """Возвращает текст последнего сообщения пользователя"""
+        for message in reversed(messages):
+            if getattr(message, 'type', None) == 'human':
+                return message.content
+        return messages[-1].content if messages else ''
+
+    def _delay_for(self, key, content, messages=()):
+        """Вычисляет имитируемую задержку ответа"""
+        if key in self.recorded_latencies:
+            delay = self.recorded_latencies[key] * self.latency_scale
+        else:
+            delay = self.latency
+        with self._lock:
+            if self.jitter:
+                delay += self._random.uniform(-self.jitter, self.jitter)
+            if self.tail_rate and self._random.random() < self.tail_rate:
+                delay += self.tail_latency
+        delay += self.per_token_latency * estimate_tokens(content)
+        if self.per_prompt_token_latency:
+            delay += self.per_prompt_token_latency * sum(estimate_tokens(m.content) for m in messages)
+        return max(delay, 0.0)
+
+    def _limit(self, content, kwargs):
+        """Обрезает ответ по stop и max_tokens из параметров вызова"""
+        if self.supports_stop:
+            for stop in kwargs.get('stop') or ():
+                position = content.find(stop)
+                if position >= 0:
+                    content = content[:position]
+        max_tokens = kwargs.get('max_tokens')
+        if max_tokens and estimate_tokens(content) > max_tokens:
+            content = content[:max_tokens * 4]
+        return content
+
+    def _respond(self, messages, kwargs):
+        """Возвращает (ответ, имитируемая задержка, завершится ли вызов ошибкой)"""
+        key = _normalize_question(self._last_question(messages))
+
+        with self._lock:
+            self.calls += 1
+            content = self.responses.get(key)
+            if content is None:
+                self.misses += 1
+                content = self.default_response
+
+        content = self._limit(content, kwargs)
+        delay = self._delay_for(key, content, messages)
+        with self._lock:
+            failed = bool(self.error_rate) and self._random.random() < self.error_rate
+            self.errors += failed
+        return content, delay, failed
+
+    def invoke(self, messages, **kwargs):
+        """Возвращает записанный ответ на последний вопрос пользователя"""
+        content, delay, failed = self._respond(messages, kwargs)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise ConnectionError("имитация ошибки модели")
+
+        return AIMessage(content=content)
+
+    def stream(self, messages, **kwargs):
+        """Возвращает записанный ответ порциями (AIMessageChunk)"""
+        content, delay, failed = self._respond(messages, kwargs)
+        first_chunk_delay = delay - self.per_token_latency * estimate_tokens(content)
+        if first_chunk_delay > 0:
+            time.sleep(first_chunk_delay)
+        if failed:
+            raise ConnectionError("имитация ошибки модели")
+
+        for start in range(0, len(content), self.stream_chunk_chars):
+            chunk = content[start:start + self.stream_chunk_chars]
+            if self.per_token_latency:
+                time.sleep(self.per_token_latency * estimate_tokens(chunk))
+            yield AIMessageChunk(content=chunk)
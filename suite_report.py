@@ -0,0 +1,396 @@
+"""
+Сводный отчет по результатам тестового прогона SQLTester
+
+Результаты обходятся один раз: по ходу прохода накапливаются счетчики
+статусов и категорий, средние показатели, гистограммы задержек, корзины
+ошибок и паттерны успешных запросов. Готовый отчет выводится текстом или
+сохраняется в JSON и CSV.
+"""
+
+import csv
+import json
+import os
+import math
+import re
+
+from token_usage import TokenAccountant
+
+
+STATUSES = ('success', 'sql_error', 'no_sql_extracted', 'exception')
+
+ERROR_NAMES = {
+    'sql_error': 'Ошибки SQL выполнения',
+    'no_sql_extracted': 'Не извлечен SQL',
+    'exception': 'Исключения системы'
+}
+
+ERROR_TITLES = {
+    'sql_error': '🔴 Ошибки выполнения SQL',
+    'no_sql_extracted': '🟡 Не удалось извлечь SQL',
+    'exception': '💥 Системные исключения'
+}
+
+STATUS_ICONS = {
+    'sql_error': '🔴',
+    'no_sql_extracted': '🟡',
+    'exception': '💥'
+}
+
+PERCENTILES = (50, 90, 95, 99)
+
+_QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"")
+_NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+
+def percentiles(values):
+    """Точные перцентили PERCENTILES (по рангу), среднее и максимум"""
+    ordered = sorted(values)
+    count = len(ordered)
+    summary = {f'p{p}': ordered[max(1, math.ceil(p / 100 * count)) - 1] if count else 0.0 for p in PERCENTILES}
+    summary.update(count=count, mean=sum(ordered) / count if count else 0.0, max=ordered[-1] if count else 0.0)
+    return summary
+
+
+def query_pattern(sql):
+    """Тип успешного запроса для анализа паттернов"""
+    sql = (sql or '').upper()
+    if 'GROUP BY' in sql:
+        return 'Группировка'
+    if 'COUNT(' in sql and 'CASE WHEN' in sql:
+        return 'Процентные расчеты'
+    if 'AVG(' in sql or 'MIN(' in sql or 'MAX(' in sql:
+        return 'Агрегация'
+    if 'WHERE' in sql and 'ORDER BY' in sql:
+        return 'Фильтрация с сортировкой'
+    if 'ORDER BY' in sql:
+        return 'Простая сортировка'
+    return 'Другое'
+
+
+def error_bucket(error):
+    """Текст ошибки без конкретных значений: одинаковые по сути ошибки попадают в одну корзину"""
+    text = _NUMBER.sub('N', _QUOTED.sub("'…'", str(error or '').strip()))
+    return text[:100] or 'без описания'
+
+
+class SuiteReport:
+    """
+    Класс для сбора отчета по результатам тестов за один проход
+
+    Для вывода в тексте списки неуспешных тестов ограничены detail_limit
+    строками на раздел; в JSON попадают все номера тестов.
+    """
+
+    def __init__(self, categories=None, metrics=None, detail_limit=20):
+        """
+        Args:
+            categories (dict or None): названия категорий {категория: название}
+            metrics: PipelineMetrics с задержками по этапам (None - без них)
+            detail_limit (int): сколько неуспешных тестов показывать в каждом разделе текста
+        """
+        self.categories = categories or {}
+        self.metrics = metrics
+        self.detail_limit = detail_limit
+        self.total = 0
+        self.by_status = {}
+        self.category_stats = {}
+        self.successful = 0
+        self.similarity_sum = 0.0
+        self.execution_time_sum = 0.0
+        self.llm_time_sum = 0.0
+        self.result_matches = 0
+        self.execution_times = []
+        self.llm_times = []
+        self._latency = None
+        self.failed = []
+        self.failed_by_status = {}
+        self.errors = {}
+        self.patterns = {}
+        self.tokens = TokenAccountant()
+
+    @classmethod
+    def from_results(cls, results, categories=None, metrics=None, detail_limit=20):
+        """Строит отчет по списку результатов"""
+        report = cls(categories, metrics, detail_limit)
+        for result in results:
+            report.add(result)
+        return report
+
+    def add(self, result):
+        """Добавляет результат теста"""
+        status = result['status']
+        self.total += 1
+        self.by_status[status] = self.by_status.get(status, 0) + 1
+
+        category = result['category']
+        stats = self.category_stats.get(category)
+        if stats is None:
+            stats = self.category_stats[category] = {
+                'total': 0, 'success': 0, 'errors': {'sql_error': 0, 'no_sql_extracted': 0, 'exception': 0},
+                'failed_tests': []
+            }
+        stats['total'] += 1
+
+        execution_time = result.get('execution_time') or 0.0
+        llm_time = result.get('llm_time') or 0.0
+        if result.get('usage'):
+            self.tokens.add(result['usage'])
+        self.execution_times.append(execution_time)
+        self.llm_times.append(llm_time)
+        self._latency = None
+
+        if status == 'success':
+            stats['success'] += 1
+            self.successful += 1
+            self.similarity_sum += result['similarity_score']
+            self.execution_time_sum += execution_time
+            self.llm_time_sum += llm_time
+            if result.get('result_match'):
+                self.result_matches += 1
+            pattern = query_pattern(result.get('generated_sql'))
+            self.patterns[pattern] = self.patterns.get(pattern, 0) + 1
+        else:
+            stats['failed_tests'].append(result)
+            if status in stats['errors']:
+                stats['errors'][status] += 1
+            self.failed.append(result)
+            self.failed_by_status.setdefault(status, []).append(result)
+            bucket = (status, error_bucket(result.get('error')))
+            self.errors[bucket] = self.errors.get(bucket, 0) + 1
+
+    def category_name(self, category):
+        return self.categories.get(category, category)
+
+    @property
+    def latency(self):
+        """Перцентили времени выполнения и времени ответа модели по всем тестам"""
+        if self._latency is None:
+            self._latency = {
+                'execution_time': percentiles(self.execution_times),
+                'llm_time': percentiles(self.llm_times)
+            }
+        return self._latency
+
+    def to_dict(self):
+        """Отчет в виде словаря (для JSON)"""
+        successful = self.successful
+        report = {
+            'total': self.total,
+            'by_status': {status: self.by_status.get(status, 0) for status in STATUSES} | self.by_status,
+            'success_rate': self.by_status.get('success', 0) / self.total if self.total else 0.0,
+            'categories': {
+                category: {
+                    'name': self.category_name(category),
+                    'total': stats['total'],
+                    'success': stats['success'],
+                    'success_rate': stats['success'] / stats['total'],
+                    'errors': dict(stats['errors']),
+                    'failed_tests': [r['test_id'] for r in stats['failed_tests']]
+                }
+                for category, stats in sorted(self.category_stats.items())
+            },
+            'averages': {
+                'successful': successful,
+                'similarity': self.similarity_sum / successful if successful else 0.0,
+                'execution_time': self.execution_time_sum / successful if successful else 0.0,
+                'llm_time': self.llm_time_sum / successful if successful else 0.0,
+                'result_matches': self.result_matches
+            },
+            'latency': self.latency,
+            'errors': [
+                {'status': status, 'error': error, 'count': count}
+                for (status, error), count in sorted(self.errors.items(), key=lambda x: -x[1])
+            ],
+            'patterns': dict(sorted(self.patterns.items(), key=lambda x: x[1], reverse=True))
+        }
+        if self.tokens.stats['requests']:
+            report['tokens'] = self.tokens.summary()
+        if self.metrics is not None and self.metrics.enabled:
+            report['stages'] = self.metrics.summary()
+        return report
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def csv_rows(self):
+        """Строки CSV: по строке на категорию и итоговая строка"""
+        rows = [['category', 'name', 'total', 'success', 'success_rate', 'sql_error', 'no_sql_extracted',
+                 'exception']]
+        totals = {'sql_error': 0, 'no_sql_extracted': 0, 'exception': 0}
+        for category, stats in sorted(self.category_stats.items()):
+            errors = stats['errors']
+            rows.append([category, self.category_name(category), stats['total'], stats['success'],
+                         round(stats['success'] / stats['total'], 4), errors['sql_error'],
+                         errors['no_sql_extracted'], errors['exception']])
+            for status in totals:
+                totals[status] += errors[status]
+        rows.append(['ALL', 'Все категории', self.total, self.by_status.get('success', 0),
+                     round(self.by_status.get('success', 0) / self.total, 4) if self.total else 0.0,
+                     totals['sql_error'], totals['no_sql_extracted'], totals['exception']])
+        return rows
+
+    def save(self, path):
+        """Сохраняет отчет в JSON или CSV (по расширению файла)"""
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                csv.writer(f).writerows(self.csv_rows())
+        elif extension == '.json':
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.to_json())
+        else:
+            raise ValueError(f"Неизвестный формат отчета: {path}. Доступны: .json, .csv")
+        return path
+
+    def _limited(self, items):
+        """Первые detail_limit элементов и число пропущенных"""
+        return items[:self.detail_limit], max(0, len(items) - self.detail_limit)
+
+    def format_text(self):
+        """Текстовый отчет"""
+        if not self.total:
+            return "❌ Нет результатов тестирования"
+
+        lines = ["\n" + "=" * 70, "📊 ОТЧЕТ О ТЕСТИРОВАНИИ", "=" * 70]
+        lines += self._format_summary()
+        lines += self._format_categories()
+        lines += self._format_averages()
+        if self.tokens.stats['requests']:
+            lines.append("\n" + self.tokens.format_stats())
+        if self.metrics is not None and self.metrics.enabled:
+            lines.append(self.metrics.format_stats())
+        lines += self._format_failed_tests()
+        lines += self._format_errors()
+        lines += self._format_patterns()
+        return "\n".join(lines)
+
+    def _format_summary(self):
+        total = self.total
+        by_status = self.by_status
+        return [
+            f"Всего тестов: {total}",
+            f"✅ Успешных: {by_status.get('success', 0)} ({by_status.get('success', 0) / total * 100:.1f}%)",
+            f"❌ Ошибки SQL: {by_status.get('sql_error', 0)} ({by_status.get('sql_error', 0) / total * 100:.1f}%)",
+            f"⚠️ Не извлечен SQL: {by_status.get('no_sql_extracted', 0)} "
+            f"({by_status.get('no_sql_extracted', 0) / total * 100:.1f}%)",
+            f"💥 Исключения: {by_status.get('exception', 0)} ({by_status.get('exception', 0) / total * 100:.1f}%)"
+        ]
+
+    def _format_categories(self):
+        lines = [f"\n📈 ДЕТАЛИЗИРОВАННАЯ СТАТИСТИКА ПО КАТЕГОРИЯМ:"]
+        problematic = []
+
+        for category, stats in sorted(self.category_stats.items()):
+            success_rate = stats['success'] / stats['total'] * 100
+            cat_name = self.category_name(category)
+            if success_rate == 100.0:
+                lines.append(f"  ✅ {cat_name}: {stats['success']}/{stats['total']} (100.0%)")
+            else:
+                problematic.append((cat_name, stats))
+                lines.append(f"  ❌ {cat_name}: {stats['success']}/{stats['total']} ({success_rate:.1f}%)")
+
+        if problematic:
+            lines.append(f"\n🚨 ДЕТАЛИ ОШИБОК ПО ПРОБЛЕМНЫМ КАТЕГОРИЯМ:")
+            for cat_name, stats in problematic:
+                lines.append(f"\n📋 {cat_name}:")
+                error_types = [f"{ERROR_NAMES.get(error_type, error_type)}: {count}"
+                               for error_type, count in stats['errors'].items() if count > 0]
+                if error_types:
+                    lines.append(f"    Типы ошибок: {', '.join(error_types)}")
+
+                lines.append(f"    Неудачные тесты:")
+                shown, hidden = self._limited(stats['failed_tests'])
+                for result in shown:
+                    question = result['question']
+                    question = question[:50] + "..." if len(question) > 50 else question
+                    icon = STATUS_ICONS.get(result['status'], '❓')
+                    lines.append(f"      {icon} Тест #{result['test_id']}: {question}")
+                if hidden:
+                    lines.append(f"      ... и еще {hidden}")
+
+        total_categories = len(self.category_stats)
+        perfect_count = total_categories - len(problematic)
+        lines += [
+            f"\n📊 СВОДКА:",
+            f"  Всего категорий: {total_categories}",
+            f"  Идеальных категорий (100%): {perfect_count}",
+            f"  Проблемных категорий: {len(problematic)}"
+        ]
+        if perfect_count == total_categories:
+            lines.append(f"  🎉 ВСЕ КАТЕГОРИИ РАБОТАЮТ ИДЕАЛЬНО!")
+        else:
+            lines.append(f"  ⚠️  Требуется внимание к {len(problematic)} категориям")
+        return lines
+
+    def _format_averages(self):
+        if not self.successful:
+            return []
+
+        successful = self.successful
+        avg_similarity = self.similarity_sum / successful
+        lines = [
+            f"\n⚡ СРЕДНИЕ ПОКАЗАТЕЛИ:",
+            f"  Средняя схожесть SQL: {avg_similarity:.1f}%",
+            f"  Среднее время выполнения: {self.execution_time_sum / successful:.2f}с",
+            f"  Среднее время ответа GigaChat: {self.llm_time_sum / successful:.2f}с",
+            "  Время выполнения (все тесты): " + ", ".join(
+                f"p{p} {self.latency['execution_time'][f'p{p}']:.2f}с" for p in PERCENTILES),
+            f"  Совпадение результатов с эталоном: {self.result_matches}/{successful}"
+        ]
+        if avg_similarity < 85:
+            lines.append(f"  💡 Примечание: Схожесть {avg_similarity:.1f}% означает, что система генерирует")
+            lines.append(f"     функционально правильные, но синтаксически различающиеся SQL запросы")
+        return lines
+
+    def _format_failed_tests(self):
+        if not self.failed:
+            return []
+
+        lines = [f"\n❌ ДЕТАЛИ НЕУСПЕШНЫХ ТЕСТОВ:"]
+        shown, hidden = self._limited(self.failed)
+        for result in shown:
+            lines.append(f"\nТест #{result['test_id']}: {result['question']}")
+            lines.append(f"  Статус: {result['status']}")
+            if result.get('error'):
+                lines.append(f"  Ошибка: {result['error']}")
+            if result.get('generated_sql'):
+                lines.append(f"  Сгенерированный SQL: {result['generated_sql']}")
+            lines.append(f"  Ожидаемый SQL: {result['expected_sql']}")
+        if hidden:
+            lines.append(f"\n... и еще {hidden} неуспешных тестов (полный список - в JSON отчете)")
+        return lines
+
+    def _format_errors(self):
+        lines = [f"\n🔍 АНАЛИЗ ТИПОВ ОШИБОК:"]
+        if not self.failed:
+            lines.append("  ✅ Ошибок не обнаружено!")
+            return lines
+
+        for error_type, failed_tests in self.failed_by_status.items():
+            lines.append(f"\n{ERROR_TITLES.get(error_type, error_type)} ({len(failed_tests)} тестов):")
+            shown, hidden = self._limited(failed_tests)
+            for test in shown:
+                lines.append(f"  • Тест #{test['test_id']}: {test['question']}")
+                if test.get('error'):
+                    lines.append(f"    Ошибка: {test['error'][:100]}...")
+                if test.get('generated_sql'):
+                    lines.append(f"    SQL: {test['generated_sql'][:80]}...")
+            if hidden:
+                lines.append(f"  ... и еще {hidden}")
+
+        lines.append(f"\n  Частые ошибки:")
+        for (status, error), count in sorted(self.errors.items(), key=lambda x: -x[1])[:self.detail_limit]:
+            lines.append(f"    {STATUS_ICONS.get(status, '❓')} {count} x {error}")
+        return lines
+
+    def _format_patterns(self):
+        lines = [f"\n🎯 АНАЛИЗ УСПЕШНЫХ ПАТТЕРНОВ:"]
+        if not self.successful:
+            lines.append("  ❌ Нет успешных тестов для анализа")
+            return lines
+
+        lines.append("  Успешные паттерны:")
+        for pattern, count in sorted(self.patterns.items(), key=lambda x: x[1], reverse=True):
+            percentage = count / self.successful * 100
+            lines.append(f"    • {pattern}: {count} тестов ({percentage:.1f}%)")
+        return lines
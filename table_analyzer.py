@@ -1,23 +1,89 @@
 import sqlite3
 from collections import Counter
-import statistics
+
+from column_stats import ColumnSummary
+from db import open_connection
+
+
+def _quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class ColumnProfile(dict):
+    """
+    Сведения о колонке (словарь с ключами type, is_numeric, total_count,
+    unique_count, unique_values, range).
+
+    При регистрации колонки заполняются только дешевые ключи; при первом
+    обращении к недостающему ключу анализатор считает полный профиль колонки
+    и сохраняет его в этом же словаре.
+    """
+
+    def __init__(self, analyzer, column, info):
+        super().__init__(info)
+        self._analyzer = analyzer
+        self._column = column
+
+    @property
+    def is_profiled(self):
+        return self._analyzer is None
+
+    def load(self):
+        """Дополняет сведения полным профилем колонки (один раз)"""
+        if self._analyzer is not None:
+            self._analyzer.profile_columns([self._column])
+        return self
+
+    def _apply(self, profile):
+        self.update(profile)
+        self._analyzer = None
+
+    def __missing__(self, key):
+        if self._analyzer is None or key not in TableAnalyzer.PROFILE_KEYS:
+            raise KeyError(key)
+        return self.load()[key]
 
 
 class TableAnalyzer:
     """
     Класс для анализа таблиц в базе данных SQLite.
+
+    analyze_column_values() только регистрирует колонки: PRAGMA table_info,
+    число непустых значений (один проход по таблице на все колонки) и тип -
+    по объявленному типу или по первым 100 значениям. Полный профиль
+    (число уникальных, диапазон, значения) считается при первом обращении и
+    запоминается; профили нескольких колонок считаются вместе за два прохода
+    по таблице, а не за отдельный проход на каждую колонку.
+
+    append_rows() обновляет статистику после добавления строк за время,
+    пропорциональное порции: профили пересчитываются из объединяемых сводок
+    колонок (ColumnSummary).
     """
 
+    PROFILE_KEYS = ('type', 'is_numeric', 'total_count', 'unique_count', 'unique_values', 'range')
+    NUMERIC_TYPES = ('INT', 'REAL', 'FLOA', 'DOUB', 'NUM', 'DEC')
+    MAX_COLUMNS_PER_QUERY = 200
+
+    # Правила, завершающие список возможных значений
+    VALUE_RULES = (
+        "\nОБЯЗАТЕЛЬНО используй только эти точные значения при формировании WHERE условий.",
+        "Используй SQLite синтаксис и ROUND() для округления числовых результатов."
+    )
+
     def __init__(self, db_path, table_name):
         self.db_path = db_path
         self.table_name = table_name
         self.connection = None
         self.column_info = {}
+        self.limit_per_column = 50
+        self.profiled_columns = 0
+        self.table_columns = []
+        self.summaries = None
 
     def connect(self):
         """Устанавливает соединение с базой данных"""
         try:
-            self.connection = sqlite3.connect(self.db_path)
+            self.connection = open_connection(self.db_path)
             return True
         except sqlite3.Error as e:
             print(f"Ошибка подключения к базе данных: {e}")
@@ -29,70 +95,252 @@ class TableAnalyzer:
             self.connection.close()
             self.connection = None
 
-    def analyze_column_values(self, limit_per_column=50):
+    def analyze_column_values(self, limit_per_column=50, lazy=True):
         """
-        Анализирует уникальные значения в каждой колонке
+        Регистрирует колонки таблицы (полные профили - по требованию)
+
+        Args:
+            limit_per_column (int): сколько значений текстовой колонки сохранять
+            lazy (bool): False - сразу посчитать полные профили всех колонок
         """
         if not self.connection:
             return
 
+        self.limit_per_column = limit_per_column
+        table = _quote_identifier(self.table_name)
         try:
             cursor = self.connection.cursor()
 
             # Получаем информацию о колонках
-            cursor.execute(f"PRAGMA table_info({self.table_name})")
-            table_info = cursor.fetchall()
+            cursor.execute(f"PRAGMA table_info({table})")
+            table_info = [(col_info[1], col_info[2]) for col_info in cursor.fetchall()]
+            self.table_columns = table_info
 
-            for col_info in table_info:
-                column_name = col_info[1]
-                column_type = col_info[2]
+            counts = self._aggregate(cursor, [f"COUNT({_quote_identifier(name)})" for name, _ in table_info])
 
-                # Получаем все значения из колонки
-                cursor.execute(f"SELECT {column_name} FROM {self.table_name} WHERE {column_name} IS NOT NULL")
-                values = [row[0] for row in cursor.fetchall()]
-
-                if not values:
+            for (column_name, column_type), total_count in zip(table_info, counts):
+                if not total_count:
                     continue
 
-                # Определяем тип данных
-                is_numeric = self._is_numeric_column(values)
-
-                # Подсчитываем уникальные значения
-                unique_values = list(set(values))
-                value_counts = Counter(values)
+                if self._has_numeric_type(column_type):
+                    is_numeric = True
+                else:
+                    column = _quote_identifier(column_name)
+                    cursor.execute(f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL LIMIT 100")
+                    is_numeric = self._is_numeric_column([row[0] for row in cursor.fetchall()])
 
-                self.column_info[column_name] = {
+                self.column_info[column_name] = ColumnProfile(self, column_name, {
                     'type': column_type,
                     'is_numeric': is_numeric,
-                    'total_count': len(values),
-                    'unique_count': len(unique_values),
-                    'unique_values': [],
-                    'range': None
-                }
-
-                if is_numeric:
-                    # Для числовых колонок сохраняем диапазон
-                    numeric_values = [float(v) for v in values]
-                    self.column_info[column_name]['range'] = {
-                        'min': min(numeric_values),
-                        'max': max(numeric_values),
-                        'mean': statistics.mean(numeric_values)
-                    }
-                    # Сохраняем уникальные значения только если их немного
-                    if len(unique_values) <= 20:
-                        self.column_info[column_name]['unique_values'] = sorted(unique_values)
-                else:
-                    # Для текстовых колонок сохраняем уникальные значения
-                    if len(unique_values) <= limit_per_column:
-                        self.column_info[column_name]['unique_values'] = sorted(unique_values)
-                    else:
-                        # Если много значений, берем самые частые
-                        top_values = value_counts.most_common(limit_per_column)
-                        self.column_info[column_name]['unique_values'] = [v for v, _ in top_values]
+                    'total_count': total_count
+                })
+
+            if not lazy:
+                self.profile_columns(list(self.column_info))
 
         except sqlite3.Error as e:
             print(f"Ошибка анализа колонок: {e}")
 
+    def _has_numeric_type(self, column_type):
+        return any(marker in (column_type or '').upper() for marker in self.NUMERIC_TYPES)
+
+    def _aggregate(self, cursor, expressions):
+        """Вычисляет агрегаты за проход по таблице (по MAX_COLUMNS_PER_QUERY выражений)"""
+        values = []
+        for i in range(0, len(expressions), self.MAX_COLUMNS_PER_QUERY):
+            chunk = expressions[i:i + self.MAX_COLUMNS_PER_QUERY]
+            cursor.execute(f"SELECT {', '.join(chunk)} FROM {_quote_identifier(self.table_name)}")
+            values.extend(cursor.fetchone())
+        return values
+
+    def profile_columns(self, column_names):
+        """
+        Считает и запоминает полные профили колонок, которые еще не профилированы
+
+        Первый проход - агрегаты SQL по числовым колонкам (число уникальных,
+        диапазон), второй - частоты значений текстовых колонок и числовых
+        колонок с небольшим числом уникальных значений.
+        """
+        pending = [name for name in dict.fromkeys(column_names)
+                   if name in self.column_info and not self.column_info[name].is_profiled]
+        if not pending:
+            return
+
+        connection = self.connection or open_connection(self.db_path)
+        try:
+            cursor = connection.cursor()
+
+            numeric = [name for name in pending if self.column_info[name]['is_numeric']]
+            expressions = []
+            for name in numeric:
+                column = _quote_identifier(name)
+                expressions += [f"COUNT(DISTINCT {column})", f"MIN(CAST({column} AS REAL))",
+                                f"MAX(CAST({column} AS REAL))", f"AVG(CAST({column} AS REAL))"]
+            aggregates = iter(self._aggregate(cursor, expressions))
+
+            profiles = {name: {'unique_values': [], 'range': None} for name in pending}
+            for name in numeric:
+                # Для числовых колонок сохраняем диапазон
+                unique_count, low, high, mean = (next(aggregates) for _ in range(4))
+                profiles[name].update(unique_count=unique_count, range={'min': low, 'max': high, 'mean': mean})
+
+            # Числовые колонки - все значения, если их не больше 20; текстовые - все или самые частые
+            with_values = [name for name in pending if name not in numeric or profiles[name]['unique_count'] <= 20]
+            for name, values in zip(with_values, self._collect_values(cursor, with_values)):
+                profiles[name]['unique_count'] = len(values)
+                if len(values) <= self.limit_per_column or name in numeric:
+                    profiles[name]['unique_values'] = sorted(values)
+                else:
+                    # Если много значений, берем самые частые
+                    profiles[name]['unique_values'] = [v for v, _ in values.most_common(self.limit_per_column)]
+        finally:
+            if connection is not self.connection:
+                connection.close()
+
+        for name in pending:
+            self.column_info[name]._apply(profiles[name])
+        self.profiled_columns += len(pending)
+
+    def _collect_values(self, cursor, column_names):
+        """Частоты непустых значений колонок (Counter на колонку) за один проход по таблице"""
+        counters = []
+        for i in range(0, len(column_names), self.MAX_COLUMNS_PER_QUERY):
+            chunk = column_names[i:i + self.MAX_COLUMNS_PER_QUERY]
+            chunk_counters = [Counter() for _ in chunk]
+            cursor.execute(f"SELECT {', '.join(_quote_identifier(name) for name in chunk)} "
+                           f"FROM {_quote_identifier(self.table_name)}")
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    break
+                for counter, values in zip(chunk_counters, zip(*rows)):
+                    counter.update(values)
+            for counter in chunk_counters:
+                counter.pop(None, None)
+            counters.extend(chunk_counters)
+        return counters
+
+    def profile_all(self):
+        """Считает полные профили всех колонок"""
+        self.profile_columns(list(self.column_info))
+
+    def compute_summaries(self):
+        """Строит объединяемые сводки всех колонок таблицы за один проход по ней"""
+        names = [name for name, _ in self.table_columns]
+        summaries = {}
+        connection = self.connection or open_connection(self.db_path)
+        try:
+            cursor = connection.cursor()
+            for i in range(0, len(names), self.MAX_COLUMNS_PER_QUERY):
+                chunk = names[i:i + self.MAX_COLUMNS_PER_QUERY]
+                cursor.execute(f"SELECT {', '.join(_quote_identifier(name) for name in chunk)} "
+                               f"FROM {_quote_identifier(self.table_name)}")
+                while True:
+                    rows = cursor.fetchmany(10000)
+                    if not rows:
+                        break
+                    for name, values in zip(chunk, zip(*rows)):
+                        self._add_to_summary(summaries, name, values)
+        finally:
+            if connection is not self.connection:
+                connection.close()
+        return summaries
+
+    def _add_to_summary(self, summaries, name, values):
+        """Добавляет значения колонки к ее сводке (сводка создается при первых непустых значениях)"""
+        if name not in summaries:
+            present = [v for v in values if v is not None]
+            if not present:
+                return
+            if name in self.column_info:
+                is_numeric = self.column_info[name]['is_numeric']
+            else:
+                column_type = dict(self.table_columns).get(name)
+                is_numeric = self._has_numeric_type(column_type) or self._is_numeric_column(present)
+            summaries[name] = ColumnSummary(is_numeric)
+        summaries[name].add_values(values)
+
+    def append_rows(self, rows):
+        """
+        Обновляет статистику после добавления строк в таблицу
+
+        Время пропорционально размеру порции: сводка порции объединяется со
+        сводками колонок, и профили пересчитываются из сводок. При первом
+        вызове сводки строятся по всей таблице (строки уже должны быть в ней).
+
+        Args:
+            rows (list): добавленные строки - кортежи в порядке колонок таблицы или словари
+        """
+        if self.summaries is None:
+            self.summaries = self.compute_summaries()
+            self._apply_summaries(self.summaries)
+            return
+
+        names = [name for name, _ in self.table_columns]
+        if rows and isinstance(rows[0], dict):
+            rows = [tuple(row.get(name) for name in names) for row in rows]
+        if not rows:
+            return
+
+        batch = {}
+        for name, values in zip(names, zip(*rows)):
+            self._add_to_summary(batch, name, values)
+        for name, summary in batch.items():
+            if name in self.summaries:
+                self.summaries[name].merge(summary)
+            else:
+                self.summaries[name] = summary
+        self._apply_summaries(batch)
+
+    def _apply_summaries(self, names):
+        """Пересчитывает профили колонок names из их сводок"""
+        for name in names:
+            summary = self.summaries[name]
+            if name not in self.column_info:
+                column_type = dict(self.table_columns).get(name)
+                self.column_info[name] = ColumnProfile(self, name, {
+                    'type': column_type, 'is_numeric': summary.is_numeric
+                })
+
+            info = self.column_info[name]
+            unique_count = summary.unique_count
+            profile = {'total_count': summary.count, 'unique_count': unique_count,
+                       'unique_values': [], 'range': None}
+            if summary.is_numeric:
+                profile['range'] = {'min': summary.min, 'max': summary.max, 'mean': summary.sum / summary.count}
+                if summary.frequencies is not None and unique_count <= 20:
+                    profile['unique_values'] = sorted(summary.frequencies)
+            elif summary.frequencies is None:
+                # Частоты не отслеживаются (слишком много значений) - остаются прежние частые значения
+                profile['unique_values'] = info.get('unique_values', [])
+            elif unique_count <= self.limit_per_column:
+                profile['unique_values'] = sorted(summary.frequencies)
+            else:
+                profile['unique_values'] = [v for v, _ in summary.frequencies.most_common(self.limit_per_column)]
+
+            if not info.is_profiled:
+                self.profiled_columns += 1
+            info._apply(profile)
+
+    def verify_summaries(self):
+        """
+        Сравнивает инкрементально обновленные сводки с посчитанными заново
+
+        Returns:
+            dict: {колонка: [расхождения]} - пустой, если сводки совпадают
+        """
+        fresh = self.compute_summaries()
+        current = self.summaries or {}
+        problems = {}
+        for name in set(fresh) | set(current):
+            if name not in fresh or name not in current:
+                problems[name] = ["колонка есть только в одной из сводок"]
+                continue
+            differences = current[name].differences(fresh[name])
+            if differences:
+                problems[name] = differences
+        return problems
+
     def _is_numeric_column(self, values):
         """Определяет, является ли колонка числовой"""
         if not values:
@@ -114,19 +362,29 @@ class TableAnalyzer:
 
     def get_categorical_columns(self):
         """Возвращает список категориальных колонок"""
+        # Числовая колонка категориальная, если уникальных значений немного - нужны их профили
+        self.profile_columns(self.get_numeric_columns())
         return [col for col, info in self.column_info.items()
-                if not info['is_numeric'] or info['unique_count'] <= 50]
+                if not info['is_numeric'] or ('unique_count' in info and info['unique_count'] <= 50)]
 
     def get_numeric_columns(self):
         """Возвращает список числовых колонок"""
         return [col for col, info in self.column_info.items()
                 if info['is_numeric']]
 
-    def generate_prompt_schema(self):
-        """Генерирует схему таблицы для промта"""
+    def generate_prompt_schema(self, max_values=30):
+        """
+        Генерирует схему таблицы для промта
+
+        Args:
+            max_values (int): сколько значений категориальной колонки перечислять
+                (0 - только число уникальных значений)
+        """
         if not self.column_info:
             return "Анализ таблицы не проведён"
 
+        # Схема перечисляет все колонки - их профили считаются одним пакетом
+        self.profile_all()
         result = [f"ТАБЛИЦА: {self.table_name}\n"]
 
         # Категориальные колонки
@@ -135,8 +393,8 @@ class TableAnalyzer:
             result.append("КАТЕГОРИАЛЬНЫЕ КОЛОНКИ:")
             for col in categorical:
                 info = self.column_info[col]
-                if info['unique_values']:
-                    values_str = ", ".join(str(v) for v in info['unique_values'][:30])
+                if info['unique_values'] and max_values:
+                    values_str = ", ".join(str(v) for v in info['unique_values'][:max_values])
                     result.append(f"- {col}: {values_str}")
                 else:
                     result.append(f"- {col}: {info['unique_count']} уникальных значений")
@@ -153,13 +411,14 @@ class TableAnalyzer:
 
         return "\n".join(result)
 
-    def generate_system_prompt_addition(self):
+    def generate_system_prompt_addition(self, include_rules=True):
         """Генерирует дополнение к системному промту"""
         categorical = self.get_categorical_columns()
 
         if not categorical:
             return ""
 
+        self.profile_columns(categorical)
         result = ["\nВОЗМОЖНЫЕ ЗНАЧЕНИЯ В КОЛОНКАХ:"]
 
         for col in categorical:
@@ -168,10 +427,8 @@ class TableAnalyzer:
                 values_str = ", ".join(str(v) for v in info['unique_values'])
                 result.append(f"{col}: {values_str}")
 
-        result.extend([
-            "\nОБЯЗАТЕЛЬНО используй только эти точные значения при формировании WHERE условий.",
-            "Используй SQLite синтаксис и ROUND() для округления числовых результатов."
-        ])
+        if include_rules:
+            result.extend(self.VALUE_RULES)
 
         return "\n".join(result)
 
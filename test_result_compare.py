@@ -0,0 +1,34 @@
+import sqlite3
+
+import pytest
+
+from result_compare import compare_query_results
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('left, right', [
+    (0.12345649999, 0.1234565),
+    (1.0000005, 1.0000004999),
+    (2, 2.0000001)
+])
+def test_ordered_within_tolerance_across_rounding_boundary(conn, left, right):
+    result = compare_query_results(conn, f"SELECT {left} ORDER BY 1", f"SELECT {right} ORDER BY 1")
+    assert result['ordered'] and result['equivalent']
+
+
+def test_ordered_outside_tolerance(conn):
+    result = compare_query_results(conn, "SELECT 1.0 ORDER BY 1", "SELECT 1.001 ORDER BY 1")
+    assert not result['equivalent']
+    assert result['reason'] == 'values'
+
+
+def test_unordered_ignores_row_order(conn):
+    result = compare_query_results(conn, "SELECT 1 UNION ALL SELECT 2.0000001",
+                                   "SELECT 2 UNION ALL SELECT 1")
+    assert not result['ordered'] and result['equivalent']
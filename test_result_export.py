@@ -0,0 +1,68 @@
+import csv
+import json
+import sqlite3
+
+import pytest
+
+from result_export import export_query
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE t (id INTEGER, amount, note, payload BLOB)")
+    conn.executemany("INSERT INTO t VALUES (?, ?, ?, ?)", [
+        (1, 10, None, b'\x00\x01'),
+        (2, 20, None, None),
+        (3, 30.5, 'text', b'\xff'),
+        (4, 40, 7, None)
+    ])
+    yield conn
+    conn.close()
+
+
+def test_csv_blob_as_hex(conn, tmp_path):
+    path = str(tmp_path / 'out.csv')
+    export_query(conn, "SELECT id, payload FROM t ORDER BY id", path)
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows == [['id', 'payload'], ['1', '0001'], ['2', ''], ['3', 'ff'], ['4', '']]
+
+
+def test_jsonl_blob_as_hex(conn, tmp_path):
+    path = str(tmp_path / 'out.jsonl')
+    export_query(conn, "SELECT id, payload FROM t ORDER BY id", path)
+    with open(path, encoding='utf-8') as f:
+        assert [json.loads(line)['payload'] for line in f] == ['0001', None, 'ff', None]
+
+
+def test_parquet_widens_types_across_batches(conn, tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    path = str(tmp_path / 'out.parquet')
+    stats = export_query(conn, "SELECT id, amount, note, payload FROM t ORDER BY id", path, batch_size=2)
+    table = pq.read_table(path)
+
+    assert stats['rows'] == 4
+    assert stats['schema_rewrites'] == 1
+    assert pq.ParquetFile(path).num_row_groups == 2
+    assert table.schema.field('id').type == pa.int64()
+    # int64 -> double, null -> string со смешанными значениями, binary -> hex-строки
+    assert table.schema.field('amount').type == pa.float64()
+    assert table.column('amount').to_pylist() == [10.0, 20.0, 30.5, 40.0]
+    assert table.column('note').to_pylist() == [None, None, 'text', '7']
+    assert table.column('payload').to_pylist() == [b'\x00\x01', None, b'\xff', None]
+
+
+def test_parquet_empty_result(conn, tmp_path):
+    pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    path = str(tmp_path / 'empty.parquet')
+    stats = export_query(conn, "SELECT id, note FROM t WHERE id < 0", path)
+    table = pq.read_table(path)
+
+    assert stats['rows'] == 0
+    assert table.num_rows == 0
+    assert table.column_names == ['id', 'note']
@@ -0,0 +1,34 @@
+import pytest
+
+from sql_utils import SQLStreamExtractor, extract_sql_query
+
+# (ответ модели, ожидаемый запрос)
+CASES = [
+    ("```sql\nSELECT 1\n```", "SELECT 1"),
+    ("```\nSELECT 1\n```", "SELECT 1"),
+    ("Запрос: SELECT 1;", "SELECT 1"),
+    ("Используйте запрос SELECT COUNT(*) FROM freelancer_earnings",
+     "SELECT COUNT(*) FROM freelancer_earnings"),
+    ("Для этого выполните SELECT AVG(x) FROM t;", "SELECT AVG(x) FROM t"),
+    ("Вот запрос: with x as (select 1) select * from x", "with x as (select 1) select * from x"),
+    ("```python\nprint(1)\n```\nSELECT 2", "SELECT 2"),
+    ("I will update you: SELECT 1", "SELECT 1"),
+    ("Выполните SELECT 1; Запрос: SELECT 2;", "SELECT 2"),
+    ("Отсортируйте with rating", None),
+    ("I will delete nothing", None)
+]
+
+
+@pytest.mark.parametrize('text, expected', CASES)
+def test_extract_whole_text(text, expected):
+    assert extract_sql_query(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', CASES)
+@pytest.mark.parametrize('chunk_size', [1, 3, 16])
+def test_extract_streamed(text, expected, chunk_size):
+    extractor = SQLStreamExtractor()
+    for i in range(0, len(text), chunk_size):
+        if extractor.feed(text[i:i + chunk_size]):
+            break
+    assert extractor.finish() == expected
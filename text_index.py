@@ -0,0 +1,151 @@
+"""
+Локальный поисковый индекс TF-IDF по символьным n-граммам (NumPy)
+
+NumPy импортируется при первом построении индекса или поиске, а не при
+импорте модуля: запуск приложения в статическом режиме обходится без него.
+"""
+
+import math
+import re
+from collections import Counter
+
+
+def char_ngrams(text, ngram_range=(3, 4)):
+    """
+    Возвращает символьные n-граммы слов текста.
+
+    Слова дополняются пробелами по краям, поэтому n-граммы учитывают начало
+    и конец слова; подчеркивания и CamelCase разбиваются на отдельные слова.
+    """
+    text = re.sub(r'([a-zа-яё])([A-ZА-ЯЁ])', r'\1 \2', text or '')
+    words = re.findall(r'[^\W_]+', text.lower())
+    n_min, n_max = ngram_range
+
+    grams = []
+    for word in words:
+        padded = f" {word} "
+        for n in range(n_min, n_max + 1):
+            grams.extend(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+    return grams
+
+
+class TfidfIndex:
+    """
+    Индекс TF-IDF с хранением в виде инвертированных списков.
+
+    Документы добавляются через add(), индекс перестраивается лениво
+    при первом поиске после изменений. Память пропорциональна числу
+    ненулевых весов, а не произведению числа документов на словарь.
+    """
+
+    def __init__(self, ngram_range=(3, 4)):
+        self.ngram_range = ngram_range
+        self.doc_ids = []
+        self.payloads = []
+        self._texts = []
+        self._dirty = True
+        self._vocabulary = {}
+        self._idf = None
+        self._postings_ptr = None
+        self._postings_docs = None
+        self._postings_weights = None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def add(self, doc_id, text, payload=None):
+        """Добавляет документ в индекс"""
+        self.doc_ids.append(doc_id)
+        self.payloads.append(payload)
+        self._texts.append(text)
+        self._dirty = True
+
+    def build(self):
+        """Строит индекс по добавленным документам"""
+        import numpy as np
+
+        doc_count = len(self._texts)
+        vocabulary = {}
+        rows, cols, tfs = [], [], []
+
+        for row, text in enumerate(self._texts):
+            for gram, count in Counter(char_ngrams(text, self.ngram_range)).items():
+                col = vocabulary.setdefault(gram, len(vocabulary))
+                rows.append(row)
+                cols.append(col)
+                tfs.append(1.0 + math.log(count))
+
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        weights = np.asarray(tfs, dtype=np.float64)
+
+        document_frequency = np.bincount(cols, minlength=len(vocabulary))
+        idf = np.log((1.0 + doc_count) / (1.0 + document_frequency)) + 1.0
+        weights *= idf[cols]
+
+        # L2-нормировка документов
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=doc_count))
+        norms[norms == 0] = 1.0
+        weights /= norms[rows]
+
+        # Инвертированные списки: документы и веса, сгруппированные по n-грамме
+        order = np.argsort(cols, kind='stable')
+        self._postings_docs = rows[order]
+        self._postings_weights = weights[order]
+        self._postings_ptr = np.concatenate(([0], np.cumsum(document_frequency)))
+        self._vocabulary = vocabulary
+        self._idf = idf
+        self._dirty = False
+
+    def vectorize(self, text):
+        """Возвращает разреженный вектор запроса: (индексы n-грамм, веса)"""
+        import numpy as np
+
+        counts = Counter(g for g in char_ngrams(text, self.ngram_range) if g in self._vocabulary)
+        if not counts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        cols = np.fromiter((self._vocabulary[g] for g in counts), dtype=np.int64, count=len(counts))
+        weights = np.fromiter((1.0 + math.log(c) for c in counts.values()), dtype=np.float64, count=len(counts))
+        weights *= self._idf[cols]
+        weights /= np.linalg.norm(weights)
+        return cols, weights
+
+    def scores(self, text):
+        """Возвращает косинусную близость запроса ко всем документам"""
+        import numpy as np
+
+        if self._dirty:
+            self.build()
+
+        scores = np.zeros(len(self.doc_ids))
+        cols, weights = self.vectorize(text)
+        for col, weight in zip(cols, weights):
+            start, end = self._postings_ptr[col], self._postings_ptr[col + 1]
+            scores[self._postings_docs[start:end]] += weight * self._postings_weights[start:end]
+        return scores
+
+    def query(self, text, k=5, min_score=0.0, exclude=None):
+        """
+        Ищет k наиболее близких документов
+
+        Returns:
+            list: [(doc_id, score, payload), ...] по убыванию близости
+        """
+        if not self.doc_ids:
+            return []
+
+        import numpy as np
+
+        scores = self.scores(text)
+        if exclude is not None:
+            for i, doc_id in enumerate(self.doc_ids):
+                if exclude(doc_id):
+                    scores[i] = -1.0
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+
+        return [(self.doc_ids[i], float(scores[i]), self.payloads[i])
+                for i in top if scores[i] > min_score]
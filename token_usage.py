@@ -0,0 +1,253 @@
+"""
+Учет токенов запросов к модели по компонентам промта
+
+Число токенов промта и ответа берется из метаданных ответа (usage_metadata
+langchain или response_metadata['token_usage'] GigaChat); если модель их не
+вернула, токены оцениваются локально (~4 символа на токен). Токены промта
+распределяются по компонентам: правила, примеры, схема, списки значений,
+история диалога и вопрос. Оценки компонентов масштабируются к числу токенов,
+которое сообщила модель, поэтому их сумма совпадает с ним.
+
+TokenAccountant суммирует учет за сессию; итоги тестового прогона считаются
+по результатам тестов в SuiteReport. Необязательный бюджет промта в токенах
+(LLM_PROMPT_BUDGET) соблюдается до вызова модели: сначала из истории удаляются
+самые старые пары вопрос/ответ, затем уменьшается детализация схемы
+(PromptBuilder.SCHEMA_DETAILS: без списков значений, затем без значений колонок).
+"""
+
+
+PROMPT_COMPONENTS = ('rules', 'examples', 'schema', 'values', 'history', 'question')
+
+COMPONENT_NAMES = {
+    'rules': 'правила',
+    'examples': 'примеры',
+    'schema': 'схема',
+    'values': 'списки значений',
+    'history': 'история',
+    'question': 'вопрос'
+}
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов: ~4 символа на токен"""
+    return max(1, len(text) // 4) if text else 0
+
+
+def _field(usage, name):
+    return usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+
+
+def response_usage(response):
+    """
+    Токены из метаданных ответа модели
+
+    Returns:
+        tuple or None: (токены промта, токены ответа) или None, если модель их не сообщила
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    if usage and _field(usage, 'input_tokens') is not None:
+        return _field(usage, 'input_tokens'), _field(usage, 'output_tokens') or 0
+
+    metadata = getattr(response, 'response_metadata', None) or {}
+    usage = metadata.get('token_usage') or metadata.get('usage')
+    if usage and _field(usage, 'prompt_tokens') is not None:
+        return _field(usage, 'prompt_tokens'), _field(usage, 'completion_tokens') or 0
+    return None
+
+
+def prompt_components(parts, history=(), question=''):
+    """
+    Оценка токенов промта по компонентам
+
+    Args:
+        parts (list): части системного промта [(компонент, текст), ...]
+        history: предыдущие сообщения диалога
+        question (str): текст сообщения пользователя
+
+    Returns:
+        dict: {компонент: токены} для всех PROMPT_COMPONENTS
+    """
+    texts = {}
+    for component, text in parts:
+        texts[component] = texts.get(component, '') + text
+    tokens = {component: estimate_tokens(texts.get(component, '')) for component in PROMPT_COMPONENTS}
+    tokens['history'] = sum(estimate_tokens(message.content) for message in history)
+    tokens['question'] = estimate_tokens(question)
+    return tokens
+
+
+def scale_components(components, total):
+    """Распределяет total токенов пропорционально оценкам компонентов (сумма равна total)"""
+    estimate = sum(components.values())
+    if not estimate:
+        return dict(components)
+    scaled = {component: round(tokens * total / estimate) for component, tokens in components.items()}
+    largest = max(scaled, key=scaled.get)
+    scaled[largest] += total - sum(scaled.values())
+    return scaled
+
+
+def _drop_oldest_exchange(history):
+    """Удаляет из истории самый старый вопрос вместе с ответом; возвращает число сообщений"""
+    del history[0]
+    removed = 1
+    while history and getattr(history[0], 'type', None) != 'human':
+        del history[0]
+        removed += 1
+    return removed
+
+
+class TokenAccountant:
+    """
+    Класс для учета токенов запросов к модели
+
+    fit() собирает системный промт и при заданном бюджете укладывает в него
+    запрос, record() по ответу модели учитывает токены запроса и добавляет
+    их в итоги сессии.
+    """
+
+    def __init__(self, budget=None):
+        """
+        Args:
+            budget (int or None): бюджет токенов промта на запрос (None - без ограничения)
+        """
+        self.budget = budget
+        self.stats = {
+            'requests': 0,
+            'reported': 0,
+            'estimated': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'history_trimmed': 0,
+            'schema_trimmed': 0,
+            'over_budget': 0
+        }
+        self.components = dict.fromkeys(PROMPT_COMPONENTS, 0)
+
+    def fit(self, prompt_builder, question, history=None, user_message=None):
+        """
+        Собирает системный промт и укладывает запрос в бюджет
+
+        Args:
+            prompt_builder: PromptBuilder
+            question (str): вопрос, по которому подбираются схемы и примеры
+            history (list or None): предыдущие сообщения диалога; при превышении
+                бюджета самые старые пары удаляются из этого списка
+            user_message (str or None): текст сообщения пользователя (по умолчанию question)
+
+        Returns:
+            dict: {'system_prompt', 'components', 'prompt_tokens', 'schema_detail',
+                'history_trimmed', 'over_budget'} - оценка токенов до вызова модели
+        """
+        history = history if history is not None else []
+        user_message = question if user_message is None else user_message
+        details = prompt_builder.SCHEMA_DETAILS
+
+        schema_detail = details[0]
+        parts = prompt_builder.build_prompt_parts(question, schema_detail)
+        components = prompt_components(parts, history, user_message)
+        removed = 0
+
+        if self.budget:
+            while history and sum(components.values()) > self.budget:
+                removed += _drop_oldest_exchange(history)
+                components['history'] = prompt_components([], history)['history']
+            for detail in details[1:]:
+                if sum(components.values()) <= self.budget:
+                    break
+                schema_detail = detail
+                parts = prompt_builder.build_prompt_parts(question, schema_detail)
+                components = prompt_components(parts, history, user_message)
+
+        prompt_tokens = sum(components.values())
+        return {
+            'system_prompt': "".join(text for _, text in parts),
+            'components': components,
+            'prompt_tokens': prompt_tokens,
+            'schema_detail': schema_detail,
+            'history_trimmed': removed,
+            'over_budget': bool(self.budget) and prompt_tokens > self.budget
+        }
+
+    def record(self, plan, response):
+        """
+        Учитывает токены запроса по ответу модели
+
+        Args:
+            plan (dict): результат fit()
+            response: ответ модели (AIMessage)
+
+        Returns:
+            dict: {'prompt_tokens', 'completion_tokens', 'total_tokens', 'source',
+                'components', 'schema_detail', 'history_trimmed', 'over_budget'};
+                source - 'model' (метаданные ответа) или 'estimate' (оценка)
+        """
+        reported = response_usage(response)
+        if reported is not None:
+            prompt_tokens, completion_tokens = reported
+            components = scale_components(plan['components'], prompt_tokens)
+            source = 'model'
+        else:
+            prompt_tokens = plan['prompt_tokens']
+            completion_tokens = estimate_tokens(getattr(response, 'content', ''))
+            components = dict(plan['components'])
+            source = 'estimate'
+
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'source': source,
+            'components': components,
+            'schema_detail': plan['schema_detail'],
+            'history_trimmed': plan['history_trimmed'],
+            'over_budget': plan['over_budget']
+        }
+        self.add(usage)
+        return usage
+
+    def add(self, usage):
+        """Добавляет учет одного запроса (record() или результат теста) в итоги"""
+        stats = self.stats
+        stats['requests'] += 1
+        stats['reported' if usage['source'] == 'model' else 'estimated'] += 1
+        stats['prompt_tokens'] += usage['prompt_tokens']
+        stats['completion_tokens'] += usage['completion_tokens']
+        stats['history_trimmed'] += usage.get('history_trimmed', 0)
+        stats['schema_trimmed'] += usage.get('schema_detail', 'full') != 'full'
+        stats['over_budget'] += bool(usage.get('over_budget'))
+        for component, tokens in usage['components'].items():
+            self.components[component] = self.components.get(component, 0) + tokens
+
+    def summary(self):
+        """Итоги учета токенов (для JSON)"""
+        requests = self.stats['requests']
+        total = self.stats['prompt_tokens'] + self.stats['completion_tokens']
+        return dict(self.stats, total_tokens=total, budget=self.budget,
+                    avg_prompt_tokens=self.stats['prompt_tokens'] / requests if requests else 0.0,
+                    avg_completion_tokens=self.stats['completion_tokens'] / requests if requests else 0.0,
+                    components=dict(self.components))
+
+    def format_stats(self):
+        """Форматирует итоги учета токенов"""
+        stats = self.stats
+        requests = stats['requests']
+        if not requests:
+            return "🔢 Токены: запросов к модели не было"
+
+        prompt_tokens = stats['prompt_tokens']
+        lines = [
+            f"🔢 Токены: запросов {requests}, промт {prompt_tokens} (в среднем {prompt_tokens / requests:.0f}), "
+            f"ответ {stats['completion_tokens']} (в среднем {stats['completion_tokens'] / requests:.0f}), "
+            f"из метаданных модели {stats['reported']}, оценено {stats['estimated']}",
+            "  Промт по компонентам: " + ", ".join(
+                f"{COMPONENT_NAMES.get(component, component)} {tokens} ({tokens / prompt_tokens * 100:.0f}%)"
+                for component, tokens in self.components.items() if tokens and prompt_tokens
+            )
+        ]
+        if self.budget or stats['history_trimmed'] or stats['schema_trimmed'] or stats['over_budget']:
+            budget = f" {self.budget}" if self.budget else ""
+            lines.append(f"  Бюджет промта{budget}: удалено сообщений истории {stats['history_trimmed']}, "
+                         f"сокращена схема {stats['schema_trimmed']}, превышен {stats['over_budget']}")
+        return "\n".join(lines)
+